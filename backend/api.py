@@ -1,22 +1,70 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from carbon_data import get_carbon_intensity, get_watttime_token
-from groq_inference import get_optimal_schedule
-from insights import get_insights
-from models import Job, JobStatus, get_db, Base, engine
+from sqlalchemy import desc, func, tuple_
+from carbon_data import get_carbon_intensity_async, get_regional_carbon_intensity, get_watttime_token, check_watttime_access, schedule_request
+from groq_inference import get_optimal_schedule_async, generate_fallback_recommendation, generate_regional_recommendations, plan_regions, with_region
+from insights import get_cached_insights, get_fallback_insights
+from insights_worker import insights_worker, store_insights
+from dispatcher import dispatcher
+from events import broadcaster
+from models import ForecastSnapshot, Job, JobSegment, JobStatus, SessionLocal, get_db
+from providers import call_with_fallback, get_breaker, GROQ_HEDGE_SECONDS, GROQ_TIMEOUT_SECONDS
+from optimizer import parse_point_time, to_naive_utc
+from history import history_store, hour_of_day_profile
+from rollups import BUCKET_KINDS, clear_rollups, query_rollups, record_jobs_created, record_status_change
+from snapshots import carbon_data_summary, decode_values, get_or_create_snapshot
+from assignment import assign_pending
+from metrics import schedule_stage_seconds
+from job_transfer import IMPORT_CHUNK_SIZE, IMPORT_MAX_ERRORS, export_lines, gzip_lines, import_chunk, iter_lines, parse_job
+import asyncio
+import base64
 import json
+import logging
+import os
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 500))
+DEFAULT_PAGE_SIZE = int(os.getenv("JOBS_DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("JOBS_MAX_PAGE_SIZE", 500))
+
 # Request model for scheduling
 class Task(BaseModel):
     task_name: str
     duration_hours: float  # e.g., 3 hours
     resource_usage: str    # e.g., "GPU-heavy"
+    # Optional time window; naive datetimes are UTC
+    earliest_start: Optional[datetime] = None
+    deadline: Optional[datetime] = None
+    # Checkpointable jobs may be split into runs of at least min_chunk_hours
+    interruptible: bool = False
+    min_chunk_hours: Optional[float] = None
+
+def check_constraints(task, now=None):
+    """Raise ValueError when a task's time window cannot fit its duration"""
+    if task.duration_hours <= 0:
+        raise ValueError("duration_hours must be positive")
+    if task.min_chunk_hours is not None:
+        if not task.interruptible:
+            raise ValueError("min_chunk_hours only applies to interruptible tasks")
+        if task.min_chunk_hours <= 0:
+            raise ValueError("min_chunk_hours must be positive")
+    if task.deadline is None:
+        return
+    now = now or datetime.utcnow()
+    window_start = max(now, to_naive_utc(task.earliest_start) or now)
+    if to_naive_utc(task.deadline) - window_start < timedelta(hours=task.duration_hours):
+        raise ValueError("deadline leaves less than duration_hours after the earliest possible start")
 
 # Response models
 class JobBase(BaseModel):
@@ -25,6 +73,7 @@ class JobBase(BaseModel):
     status: JobStatus
     duration_hours: float
     resource_usage: str
+    region: Optional[str] = None
     scheduled_time: Optional[datetime]
     carbon_intensity: Optional[float]
     carbon_saved: Optional[float]
@@ -60,95 +109,188 @@ class JobBase(BaseModel):
             return None
         return self.parameters["recommendation"].get("alternative_windows", [])
 
+# Slim listing projection: scalar columns only, no parameters/results blobs
+class JobSummary(BaseModel):
+    id: int
+    task_name: str
+    status: JobStatus
+    duration_hours: float
+    resource_usage: str
+    region: Optional[str] = None
+    scheduled_time: Optional[datetime]
+    start_time: Optional[datetime] = None
+    completion_time: Optional[datetime] = None
+    carbon_intensity: Optional[float]
+    carbon_saved: Optional[float]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+JOB_SUMMARY_COLUMNS = [getattr(Job, field) for field in JobSummary.__fields__]
+
+def job_summary(job):
+    """JobSummary fields of a Job row as a plain dict, for event payloads"""
+    return {field: getattr(job, field) for field in JobSummary.__fields__}
+
+def encode_cursor(created_at, job_id):
+    """Opaque keyset cursor for (created_at, id)"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{job_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(job_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def query_etag(query, *parts):
+    """
+    Weak ETag for a filtered Job query, read from the database so every
+    process agrees: any insert, update or delete changes the row count or
+    the newest updated_at among the matching jobs
+    """
+    count, last_update = query.with_entities(func.count(Job.id), func.max(Job.updated_at)).one()
+    stamp = last_update.isoformat() if last_update else ""
+    return f'W/"{count}-{stamp}-{zlib.crc32(repr(parts).encode()):x}"'
+
+def build_analysis(carbon_data, recommendation):
+    """Baseline vs optimized intensity metrics stored in Job.results"""
+    baseline_intensity = carbon_data.get("carbon_intensity", 0)
+    optimized_intensity = recommendation.get("expected_intensity", baseline_intensity)
+    carbon_difference = baseline_intensity - optimized_intensity
+    money_saved = carbon_difference * 0.05
+
+    return {
+        "baseline_intensity": baseline_intensity,
+        "optimized_intensity": optimized_intensity,
+        "carbon_difference": carbon_difference,
+        "money_saved": money_saved,
+        "unit": carbon_data.get("unit", "gCO2/kWh"),
+        "data_source": "real" if not carbon_data.get("location", "").startswith("SIMULATED") else "simulated"
+    }
+
+def build_job(task, carbon_data, recommendation, insights, analysis, forecast_snapshot_id=None):
+    """
+    Create (but do not add) the Job row for a scheduled task.
+    The forecast series is referenced through forecast_snapshot_id rather than copied.
+    Split plans for interruptible tasks are stored as JobSegment rows.
+    """
+    segments = [
+        JobSegment(
+            seq=seq,
+            start_time=to_naive_utc(parse_point_time(segment["start_time"])),
+            end_time=to_naive_utc(parse_point_time(segment["end_time"])),
+            expected_intensity=segment["expected_intensity"]
+        )
+        for seq, segment in enumerate(recommendation.get("segments") or [])
+    ]
+    return Job(
+        task_name=task.task_name,
+        duration_hours=task.duration_hours,
+        resource_usage=task.resource_usage,
+        scheduled_time=to_naive_utc(parse_point_time(recommendation.get("recommended_start_time", datetime.now().isoformat()))),
+        carbon_intensity=analysis["baseline_intensity"],
+        expected_intensity=recommendation.get("expected_intensity"),
+        region=carbon_data.get("location"),
+        carbon_saved=recommendation.get("carbon_savings_estimate", 0),
+        forecast_snapshot_id=forecast_snapshot_id,
+        segments=segments,
+        parameters={
+            "task": jsonable_encoder(task),
+            "carbon_data": carbon_data_summary(carbon_data),
+            "recommendation": recommendation,
+            "confidence_score": recommendation.get("confidence_score", 0.7),
+            "reasoning": recommendation.get("reasoning", "Optimized for lower carbon intensity")
+        },
+        results={
+            "insights": insights,
+            "insights_status": "ready" if insights is not None else "pending",
+            "analysis": analysis
+        }
+    )
+
 @router.post("/schedule")
 async def schedule_task(task: Task, db: Session = Depends(get_db)):
     try:
-        # 1. Fetch current carbon intensity data
-        carbon_data = get_carbon_intensity()
-        if not carbon_data:
+        check_constraints(task)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    started = time.perf_counter()
+    try:
+        # 1. Fetch current carbon intensity data for every candidate region at once
+        with schedule_stage_seconds.time("carbon_data"), schedule_request():
+            regional_data = await get_regional_carbon_intensity()
+        if not regional_data or not all(regional_data):
             raise HTTPException(
                 status_code=500,
                 detail="Failed to fetch carbon intensity data"
             )
 
-        # 2. Use Groq API for inference
-        recommendation = get_optimal_schedule(task, carbon_data)
-        if not recommendation:
-            # If recommendation fails, create a basic recommendation
-            current_time = datetime.now().isoformat()
-            recommendation = {
-                "recommended_start_time": current_time,
-                "expected_intensity": carbon_data.get("carbon_intensity", 0),
-                "carbon_savings_estimate": 0,
-                "confidence_score": 0.5,
-                "reasoning": "Using default schedule due to optimization service unavailability",
-                "alternative_windows": []
-            }
+        # 2. Region with the lowest-intensity window, then the start time
+        #    within it (Groq), with its own deadline, circuit breaker and
+        #    solver fallback; hedged to the solver after GROQ_HEDGE_SECONDS
+        with schedule_stage_seconds.time("region_plan"):
+            region_index, windows, region_options = plan_regions([task], regional_data)[0]
+        carbon_data = regional_data[region_index]
+        if windows is None and task.deadline is not None and carbon_data.get("forecast"):
+            raise HTTPException(
+                status_code=422,
+                detail=f"No forecast window between earliest_start and deadline fits duration_hours={task.duration_hours}"
+            )
+        with schedule_stage_seconds.time("recommendation"):
+            recommendation = await call_with_fallback(
+                "Groq",
+                get_optimal_schedule_async(task, carbon_data),
+                GROQ_TIMEOUT_SECONDS,
+                lambda: generate_fallback_recommendation(task, carbon_data),
+                breaker=get_breaker("Groq"),
+                hedge_after=GROQ_HEDGE_SECONDS
+            )
+        recommendation = with_region(recommendation, carbon_data, region_options)
 
-        # 3. Get insights
-        try:
-            insights = get_insights(task, carbon_data)
-        except Exception as e:
-            print(f"Error getting insights: {e}")
-            insights = {
-                "summary": "Insights temporarily unavailable",
-                "recommendations": []
-            }
+        # 3. Insights are generated in the background unless already cached
+        with schedule_stage_seconds.time("insights"):
+            insights = get_cached_insights(task, carbon_data)
 
-        # Calculate metrics
-        baseline_intensity = carbon_data.get("carbon_intensity", 0)
-        optimized_intensity = recommendation.get("expected_intensity", baseline_intensity)
-        carbon_difference = baseline_intensity - optimized_intensity
-        money_saved = carbon_difference * 0.05
-
-        analysis = {
-            "baseline_intensity": baseline_intensity,
-            "optimized_intensity": optimized_intensity,
-            "carbon_difference": carbon_difference,
-            "money_saved": money_saved,
-            "unit": carbon_data.get("unit", "gCO2/kWh"),
-            "data_source": "real" if carbon_data.get("location") != "SIMULATED_CAISO_NORTH" else "simulated"
-        }
+        analysis = build_analysis(carbon_data, recommendation)
 
-        # Create job record
-        db_job = Job(
-            task_name=task.task_name,
-            duration_hours=task.duration_hours,
-            resource_usage=task.resource_usage,
-            scheduled_time=datetime.fromisoformat(recommendation.get("recommended_start_time", datetime.now().isoformat()).replace('Z', '+00:00')),
-            carbon_intensity=baseline_intensity,
-            carbon_saved=recommendation.get("carbon_savings_estimate", 0),
-            parameters={
-                "task": task.dict(),
-                "carbon_data": carbon_data,
-                "recommendation": recommendation,
-                "confidence_score": recommendation.get("confidence_score", 0.7),
-                "reasoning": recommendation.get("reasoning", "Optimized for lower carbon intensity")
-            },
-            results={
-                "insights": insights,
-                "analysis": analysis
-            }
-        )
-        
-        db.add(db_job)
-        db.commit()
-        db.refresh(db_job)
+        # 4. Store the job without blocking the event loop
+        def store_job():
+            snapshot_id = get_or_create_snapshot(db, carbon_data)
+            db_job = build_job(task, carbon_data, recommendation, insights, analysis, snapshot_id)
+            db.add(db_job)
+            db.flush()
+            record_jobs_created(db, [db_job])
+            summary = job_summary(db_job)
+            db.commit()
+            broadcaster.publish("job.created", summary)
+            return db_job.id, snapshot_id, summary["scheduled_time"]
+
+        with schedule_stage_seconds.time("db_commit"):
+            job_id, snapshot_id, scheduled_time = await run_in_threadpool(store_job)
+        dispatcher.submit(job_id, scheduled_time, task.resource_usage)
+
+        if insights is None and not insights_worker.enqueue(job_id, task, carbon_data):
+            # Worker unavailable or saturated: use local insights instead
+            insights = get_fallback_insights(task, carbon_data)
+            await run_in_threadpool(store_insights, job_id, insights)
 
         return {
-            "job_id": db_job.id,
+            "job_id": job_id,
             "task": task.dict(),
-            "carbon_data": carbon_data,
+            "carbon_data": {**carbon_data_summary(carbon_data), "forecast_snapshot_id": snapshot_id},
             "recommendation": recommendation,
             "insights": insights,
-            "analysis": db_job.results["analysis"]
+            "insights_status": "ready" if insights is not None else "pending",
+            "analysis": analysis
         }
     except HTTPException as he:
         db.rollback()
         raise he
     except Exception as e:
         db.rollback()
-        print(f"Error in schedule_task: {str(e)}")
+        logger.exception("Error in schedule_task: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -157,65 +299,420 @@ async def schedule_task(task: Task, db: Session = Depends(get_db)):
                 "type": "internal_error"
             }
         )
+    finally:
+        schedule_stage_seconds.observe("total", value=time.perf_counter() - started)
+
+@router.post("/schedule/batch")
+async def schedule_batch(tasks: List[Dict[str, Any]] = Body(...)):
+    """
+    Schedule many tasks in one request.
+
+    Forecasts for all candidate regions are fetched once, each region is
+    solved for every task in a single vectorized pass, and every Job is
+    inserted in one transaction.
+    Results stream back as NDJSON, one line per submitted item tagged with
+    its index: invalid items as soon as they are validated, items that
+    cannot meet their deadline once solved, scheduled items once the
+    transaction has committed.
+    """
+    if len(tasks) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch size {len(tasks)} exceeds the limit of {MAX_BATCH_SIZE}"
+        )
 
-@router.get("/jobs", response_model=List[JobBase])
-async def get_jobs(db: Session = Depends(get_db)):
+    regional_data = await get_regional_carbon_intensity()
+    if not regional_data or not all(regional_data):
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to fetch carbon intensity data"
+        )
+
+    def store_jobs(db, valid, planned, analyses):
+        # One shared forecast snapshot per region for the whole batch
+        snapshot_ids = {}
+        jobs = []
+        for (index, task), (region_index, recommendation), analysis in zip(valid, planned, analyses):
+            carbon_data = regional_data[region_index]
+            if region_index not in snapshot_ids:
+                snapshot_ids[region_index] = get_or_create_snapshot(db, carbon_data)
+            jobs.append(build_job(
+                task, carbon_data, recommendation, get_fallback_insights(task, carbon_data),
+                analysis, snapshot_ids[region_index]
+            ))
+        db.add_all(jobs)
+        # Flush assigns ids; read them before commit expires the rows
+        db.flush()
+        record_jobs_created(db, jobs)
+        summaries = [job_summary(job) for job in jobs]
+        db.commit()
+        for summary in summaries:
+            broadcaster.publish("job.created", summary)
+        return [(summary["id"], summary["scheduled_time"], summary["resource_usage"]) for summary in summaries]
+
+    def line(result):
+        return json.dumps(result, default=str) + "\n"
+
+    async def stream():
+        # Validate items individually so one bad task does not fail the batch
+        valid = []
+        for index, item in enumerate(tasks):
+            try:
+                task = Task(**item)
+                check_constraints(task)
+                valid.append((index, task))
+            except Exception as e:
+                yield line({"index": index, "status": "error", "error": str(e)})
+        if not valid:
+            return
+
+        valid_tasks = [task for _, task in valid]
+        solved = await run_in_threadpool(generate_regional_recommendations, valid_tasks, regional_data)
+        solvable, planned = [], []
+        for (index, task), (region_index, recommendation) in zip(valid, solved):
+            if recommendation is None:
+                yield line({
+                    "index": index,
+                    "status": "error",
+                    "error": f"No forecast window between earliest_start and deadline fits duration_hours={task.duration_hours}"
+                })
+            else:
+                solvable.append((index, task))
+                planned.append((region_index, recommendation))
+        valid = solvable
+        if not valid:
+            return
+        analyses = [
+            build_analysis(regional_data[region_index], recommendation)
+            for region_index, recommendation in planned
+        ]
+        # The request's session may already be closed while the body streams
+        db = SessionLocal()
+        try:
+            stored = await run_in_threadpool(store_jobs, db, valid, planned, analyses)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Error in schedule_batch: %s", e)
+            for index, _ in valid:
+                yield line({"index": index, "status": "error", "error": f"Failed to store job: {str(e)}"})
+            return
+        finally:
+            db.close()
+        for (index, task), (_, recommendation), analysis, (job_id, scheduled_time, resource_usage) in zip(
+            valid, planned, analyses, stored
+        ):
+            dispatcher.submit(job_id, scheduled_time, resource_usage)
+            yield line({
+                "index": index,
+                "status": "scheduled",
+                "job_id": job_id,
+                "task": task.dict(),
+                "recommendation": recommendation,
+                "analysis": analysis
+            })
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.post("/schedule/optimize")
+async def optimize_schedule(db: Session = Depends(get_db)):
+    """
+    Re-plan all pending jobs together so no resource class exceeds its
+    dispatcher concurrency in any interval, minimizing total emissions.
+    """
     try:
-        jobs = db.query(Job).order_by(desc(Job.created_at)).all()
-        return jobs
+        summary = await run_in_threadpool(assign_pending, db)
+    except Exception as e:
+        db.rollback()
+        logger.exception("Error in optimize_schedule: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to optimize schedule")
+    if summary["moved"]:
+        broadcaster.publish("jobs.rescheduled", {"jobs": summary["moved_jobs"]})
+    return summary
+
+@router.get("/jobs", response_model=List[JobSummary])
+def get_jobs(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status: Optional[JobStatus] = None,
+    resource_usage: Optional[str] = None,
+    region: Optional[str] = None,
+    scheduled_after: Optional[datetime] = None,
+    scheduled_before: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    List jobs newest first, one page at a time.
+
+    Only summary columns are selected, never the JSON blobs; use
+    GET /jobs/{id} for full detail. When more rows exist, the X-Next-Cursor
+    header carries the cursor for the next page. Responses carry an ETag that
+    only changes when a matching job does, so If-None-Match polls are 304s.
+    """
+    try:
+        query = db.query(*JOB_SUMMARY_COLUMNS)
+        if status:
+            query = query.filter(Job.status == status)
+        if resource_usage:
+            query = query.filter(Job.resource_usage == resource_usage)
+        if region:
+            query = query.filter(Job.region == region)
+        if scheduled_after:
+            query = query.filter(Job.scheduled_time >= to_naive_utc(scheduled_after))
+        if scheduled_before:
+            query = query.filter(Job.scheduled_time < to_naive_utc(scheduled_before))
+        if cursor:
+            created_at, job_id = decode_cursor(cursor)
+            query = query.filter(tuple_(Job.created_at, Job.id) < tuple_(created_at, job_id))
+
+        etag = query_etag(query, str(request.query_params))
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+        # Fetch one extra row to learn whether another page exists
+        rows = query.order_by(desc(Job.created_at), desc(Job.id)).limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return rows
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/events")
+async def stream_events():
+    """
+    Server-sent events: job.created, job.status, job.updated, jobs.cleared
+    and periodic intensity ticks. A resync event means the client missed
+    events and should refetch /jobs.
+    """
+    return StreamingResponse(
+        broadcaster.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/jobs/export")
+def export_jobs(
+    status: Optional[JobStatus] = None,
+    resource_usage: Optional[str] = None,
+    region: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    gzip: bool = False
+):
+    """
+    Stream every matching job, oldest first, as NDJSON with all columns and
+    segments; gzip=true compresses the stream. Memory use is constant.
+    """
+    filters = []
+    if status:
+        filters.append(Job.status == status)
+    if resource_usage:
+        filters.append(Job.resource_usage == resource_usage)
+    if region:
+        filters.append(Job.region == region)
+    if created_after:
+        filters.append(Job.created_at >= to_naive_utc(created_after))
+    if created_before:
+        filters.append(Job.created_at < to_naive_utc(created_before))
+    body = export_lines(filters)
+    if gzip:
+        return StreamingResponse(
+            gzip_lines(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="jobs.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="jobs.ndjson"'}
+    )
+
+@router.post("/jobs/import")
+async def import_jobs(request: Request, keep_ids: bool = False):
+    """
+    Bulk-insert an NDJSON job stream (as written by /jobs/export, optionally
+    gzipped) in transactions of IMPORT_CHUNK_SIZE jobs. Bad lines are
+    reported and skipped; chunks already committed stay when a later one fails.
+    keep_ids preserves job ids, skipping ones that already exist.
+    """
+    summary = {"imported": 0, "skipped": 0, "failed": 0, "errors": []}
+    chunk = []
+
+    def report(line, error):
+        if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+            summary["errors"].append({"line": line, "error": error})
+
+    async def flush(last_line):
+        try:
+            inserted, skipped = await run_in_threadpool(import_chunk, chunk, keep_ids)
+        except Exception as e:
+            logger.warning("Error importing jobs: %s", e)
+            summary["failed"] += len(chunk)
+            report(last_line, f"chunk of {len(chunk)} jobs not imported: {e}")
+            return
+        summary["imported"] += len(inserted)
+        summary["skipped"] += skipped
+        for job_id, scheduled_time, resource_usage, status in inserted:
+            if status == JobStatus.PENDING:
+                dispatcher.submit(job_id, scheduled_time, resource_usage)
+
+    line_number = 0
+    async for line in iter_lines(request.stream()):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            chunk.append(parse_job(line))
+        except (ValueError, KeyError, TypeError) as e:
+            summary["failed"] += 1
+            report(line_number, str(e))
+            continue
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush(line_number)
+            chunk = []
+    if chunk:
+        await flush(line_number)
+    if summary["imported"]:
+        broadcaster.publish("jobs.imported", {"count": summary["imported"]})
+    return summary
+
 @router.get("/jobs/{job_id}", response_model=JobBase)
-async def get_job(job_id: int, db: Session = Depends(get_db)):
+def get_job(job_id: int, db: Session = Depends(get_db)):
     try:
         job = db.query(Job).filter(Job.id == job_id).first()
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
         return job
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.delete("/jobs/clear")
+def clear_jobs(db: Session = Depends(get_db)):
+    """Clear all jobs from the queue"""
+    try:
+        db.query(Job).delete(synchronize_session=False)
+        clear_rollups(db)
+        db.commit()
+        dispatcher.clear()
+        broadcaster.publish("jobs.cleared", {})
+        return {"status": "success", "message": "Job queue cleared successfully"}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Failed to clear job queue")
+
 @router.delete("/jobs/{job_id}")
-async def cancel_job(job_id: int, db: Session = Depends(get_db)):
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
     try:
         job = db.query(Job).filter(Job.id == job_id).first()
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
         if job.status == JobStatus.PENDING:
             job.status = JobStatus.CANCELLED
+            record_status_change(db, job, JobStatus.PENDING, JobStatus.CANCELLED)
             db.commit()
+            dispatcher.cancel(job_id)
+            broadcaster.publish("job.status", {"id": job_id, "status": JobStatus.CANCELLED})
             return {"message": "Job cancelled successfully"}
         raise HTTPException(status_code=400, detail="Can only cancel pending jobs")
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/jobs/clear")
-async def clear_jobs(db: Session = Depends(get_db)):
-    """Clear all jobs from the queue"""
-    try:
-        # Execute raw SQL to delete all jobs
-        db.execute("DELETE FROM jobs")
-        db.commit()
-        return {"status": "success", "message": "Job queue cleared successfully"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Failed to clear job queue")
+@router.get("/forecasts/{snapshot_id}")
+def get_forecast_snapshot(snapshot_id: int, db: Session = Depends(get_db)):
+    """Forecast a job was planned against, in compact start/step/values form"""
+    snapshot = db.get(ForecastSnapshot, snapshot_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Forecast snapshot not found")
+    return {
+        "id": snapshot.id,
+        "region": snapshot.region,
+        "signal_type": snapshot.signal_type,
+        "unit": snapshot.unit,
+        "generated_at": snapshot.generated_at,
+        "start_time": snapshot.start_time,
+        "step_seconds": snapshot.step_seconds,
+        "values": decode_values(snapshot).tolist()
+    }
+
+@router.get("/analytics")
+def get_analytics(
+    bucket: str = Query("day", pattern=f"^({'|'.join(BUCKET_KINDS)})$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resource_usage: Optional[str] = None,
+    status: Optional[JobStatus] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Carbon saved, money saved, job counts and mean intensity per hour, day or
+    week, read from the incrementally maintained rollups
+    """
+    return query_rollups(
+        db, bucket,
+        to_naive_utc(start) if start else None,
+        to_naive_utc(end) if end else None,
+        resource_usage, status
+    )
+
+def _region_or_404(region):
+    region = region or history_store.latest_region()
+    if not region or region not in history_store.regions():
+        raise HTTPException(status_code=404, detail="No intensity history for region")
+    return region
+
+@router.get("/intensity/history")
+def get_intensity_history(
+    region: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    kind: str = Query("actual", pattern="^(actual|forecast)$")
+):
+    """Recorded intensity for a region on the store's fixed grid; gaps are null"""
+    region = _region_or_404(region)
+    start_time, step, values = history_store.query(region, start, end, kind)
+    return {
+        "region": region,
+        "kind": kind,
+        "start_time": start_time,
+        "step_seconds": int(step.total_seconds()),
+        "values": [None if value != value else round(float(value), 2) for value in values]
+    }
+
+@router.get("/intensity/profile")
+def get_intensity_profile(region: Optional[str] = None, days: int = Query(7, ge=1, le=365)):
+    """Mean recorded intensity by UTC hour of day over the last `days` days"""
+    region = _region_or_404(region)
+    profile = hour_of_day_profile(region, days)
+    return {
+        "region": region,
+        "days": days,
+        "hours": [None if value != value else round(float(value), 2) for value in profile]
+    }
 
 @router.get("/test/watttime")
 async def test_watttime():
     """Test endpoint to check WattTime API status"""
     try:
-        token = get_watttime_token()
+        token = await asyncio.to_thread(get_watttime_token)
         if not token:
             return {
                 "status": "error",
                 "message": "Failed to get WattTime token",
                 "details": "Check the logs for more information"
             }
+        access_data = await asyncio.to_thread(check_watttime_access, token)
         
-        carbon_data = get_carbon_intensity()
+        carbon_data = await get_carbon_intensity_async()
         if not carbon_data:
             return {
                 "status": "error",
@@ -231,7 +728,8 @@ async def test_watttime():
                 "carbon_intensity": carbon_data.get("carbon_intensity"),
                 "unit": carbon_data.get("unit"),
                 "timestamp": carbon_data.get("timestamp"),
-                "is_simulated": carbon_data.get("location") == "SIMULATED_CAISO_NORTH"
+                "is_simulated": carbon_data.get("location", "").startswith("SIMULATED"),
+                "access": access_data
             }
         }
     except Exception as e:
@@ -0,0 +1,437 @@
+import json
+import logging
+import math
+import os
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, select, update
+from dispatcher import dispatcher
+from groq_inference import DEFAULT_USAGE_FACTOR, USAGE_FACTORS, calculate_carbon_savings
+from models import ForecastSnapshot, Job, JobSegment, JobStatus
+from optimizer import parse_point_time, to_naive_utc
+from rollups import record_metric_changes
+from snapshots import decode_values
+
+logger = logging.getLogger(__name__)
+
+# Capacity-aware placement of every pending job at once.
+#
+# Jobs placed one at a time all pick the same low-carbon window; here each
+# resource_usage class has a per-interval capacity (its dispatcher
+# concurrency limit) and all pending jobs are assigned start slots on a
+# shared grid to minimize total estimated emissions. Classes do not share
+# capacity, so each is solved on its own: a greedy pass places the most
+# constrained jobs first in their cheapest slot with room, then local search
+# moves jobs to cheaper slots, ejecting and re-placing a single blocking job
+# when that lowers the total.
+
+ASSIGNMENT_STEP_MINUTES = int(os.getenv("ASSIGNMENT_STEP_MINUTES", 15))
+ASSIGNMENT_HORIZON_HOURS = int(os.getenv("ASSIGNMENT_HORIZON_HOURS", 72))
+# Local search passes over all jobs; stops early once a pass changes nothing
+ASSIGNMENT_SEARCH_PASSES = int(os.getenv("ASSIGNMENT_SEARCH_PASSES", 3))
+# Cheaper slots, and blocking jobs per slot, tried when ejecting a blocker
+ASSIGNMENT_EJECTION_CANDIDATES = int(os.getenv("ASSIGNMENT_EJECTION_CANDIDATES", 3))
+# Local search stops when this budget runs out; the greedy result always stands
+ASSIGNMENT_SEARCH_SECONDS = float(os.getenv("ASSIGNMENT_SEARCH_SECONDS", 2))
+# A job keeps its slot unless moving cuts its emissions by at least this fraction
+ASSIGNMENT_MIN_GAIN_FRACTION = float(os.getenv("ASSIGNMENT_MIN_GAIN_FRACTION", 0.02))
+# Re-plan entries kept per job in parameters["replans"]
+REPLAN_HISTORY = 10
+
+def _best_start(cost, slots, usage, capacity):
+    """Cheapest start whose window has room on every interval, or None"""
+    full = np.concatenate(([0], np.cumsum(usage >= capacity)))
+    blocked = full[slots:] - full[:-slots] > 0
+    masked = np.where(blocked, np.inf, cost)
+    start = int(np.argmin(masked))
+    return start if np.isfinite(masked[start]) else None
+
+def solve_class(costs, slots, capacity, fixed_usage, passes=ASSIGNMENT_SEARCH_PASSES, budget=ASSIGNMENT_SEARCH_SECONDS):
+    """
+    Assign start slots to the jobs of one resource class.
+
+    costs[j] holds job j's emissions for every start on the grid (inf where
+    not allowed) and slots[j] its length in intervals; at most `capacity`
+    jobs may overlap any interval on top of fixed_usage. Returns a start
+    index per job, or -1 for jobs that cannot be placed anywhere.
+    """
+    count = len(costs)
+    usage = fixed_usage.astype(np.int32)
+    starts = np.full(count, -1)
+    ends = np.full(count, -1)
+
+    def place(job, start):
+        starts[job], ends[job] = start, start + slots[job]
+        usage[start:start + slots[job]] += 1
+
+    def remove(job):
+        usage[starts[job]:ends[job]] -= 1
+        starts[job] = ends[job] = -1
+
+    # Greedy: fewest allowed starts first, then the heaviest jobs
+    options = [int(np.isfinite(cost).sum()) for cost in costs]
+    weight = [float(np.nanmin(np.where(np.isfinite(cost), cost, np.nan))) if option else 0.0 for cost, option in zip(costs, options)]
+    for job in sorted(range(count), key=lambda job: (options[job], -weight[job])):
+        start = _best_start(costs[job], slots[job], usage, capacity)
+        if start is not None:
+            place(job, start)
+
+    deadline = time.monotonic() + budget
+    for _ in range(passes):
+        improved = False
+        # Jobs not already in their cheapest slot, largest potential gain first
+        placed = [job for job in range(count) if starts[job] >= 0 and costs[job][starts[job]] > weight[job] + 1e-9]
+        placed.sort(key=lambda job: weight[job] - costs[job][starts[job]])
+        for job in placed:
+            if time.monotonic() > deadline:
+                return starts
+            current = starts[job]
+            current_cost = costs[job][current]
+            remove(job)
+            start = _best_start(costs[job], slots[job], usage, capacity)
+            if costs[job][start] < current_cost - 1e-9:
+                place(job, start)
+                improved = True
+                continue
+            place(job, current)
+            if _eject(job, costs, slots, capacity, usage, starts, ends, place, remove):
+                improved = True
+        if not improved:
+            break
+    return starts
+
+def _eject(job, costs, slots, capacity, usage, starts, ends, place, remove):
+    """Move job to a cheaper slot by re-placing one job blocking it; True if moved"""
+    current = starts[job]
+    current_cost = costs[job][current]
+    cheaper = np.flatnonzero(costs[job] < current_cost - 1e-9)
+    if not len(cheaper):
+        return False
+    for start in cheaper[np.argsort(costs[job][cheaper])][:ASSIGNMENT_EJECTION_CANDIDATES]:
+        end = start + slots[job]
+        remove(job)
+        full = np.flatnonzero(usage[start:end] >= capacity) + start
+        if not len(full):
+            place(job, start)
+            return True
+        # A single job covering every full interval frees them all
+        blockers = np.flatnonzero((starts >= 0) & (starts <= full[0]) & (ends > full[-1]))
+        for blocker in blockers[:ASSIGNMENT_EJECTION_CANDIDATES]:
+            blocker_start = starts[blocker]
+            blocker_cost = costs[blocker][blocker_start]
+            remove(blocker)
+            if usage[start:end].max() >= capacity:
+                place(blocker, blocker_start)
+                continue
+            place(job, start)
+            moved_to = _best_start(costs[blocker], slots[blocker], usage, capacity)
+            if moved_to is not None and (
+                costs[job][start] + costs[blocker][moved_to] < current_cost + blocker_cost - 1e-9
+            ):
+                place(blocker, moved_to)
+                return True
+            remove(job)
+            place(blocker, blocker_start)
+        place(job, current)
+    return False
+
+def keep_current(starts, keys, currents):
+    """
+    Hand the starts chosen for interchangeable jobs (equal keys, so equal
+    costs) back to the jobs already in them, so the solver never reports a
+    swap between two such jobs as two moves. Updates starts in place.
+    """
+    groups = defaultdict(list)
+    for job, (key, start) in enumerate(zip(keys, starts)):
+        if start >= 0:
+            groups[key].append(job)
+    for jobs in groups.values():
+        chosen = Counter(int(starts[job]) for job in jobs)
+        movers = []
+        for job in jobs:
+            if currents[job] is not None and chosen[currents[job]] > 0:
+                chosen[currents[job]] -= 1
+                starts[job] = currents[job]
+            else:
+                movers.append(job)
+        for job, start in zip(movers, sorted(chosen.elements())):
+            starts[job] = start
+    return starts
+
+def latest_forecasts(db, regions):
+    """Most recent stored forecast per region as (start_time, step_seconds, values)"""
+    forecasts = {}
+    for region in regions:
+        snapshot = db.query(ForecastSnapshot).filter(ForecastSnapshot.region == region).order_by(
+            ForecastSnapshot.created_at.desc(), ForecastSnapshot.id.desc()
+        ).first()
+        if snapshot:
+            forecasts[region] = (snapshot.start_time, snapshot.step_seconds, decode_values(snapshot))
+    return forecasts
+
+def sample_forecast(forecast, grid_start, step, length):
+    """Forecast values at each grid interval, holding the edge values outside it"""
+    start_time, step_seconds, values = forecast
+    offsets = (grid_start - start_time).total_seconds() + np.arange(length) * step.total_seconds()
+    indices = np.clip((offsets // step_seconds).astype(np.int64), 0, len(values) - 1)
+    return values[indices].astype(np.float64)
+
+def grid_range(start_time, end_time, grid_start, step, length):
+    """(first, last) grid intervals covered by start_time..end_time, clipped to the grid"""
+    first = max(0, math.floor((start_time - grid_start) / step))
+    last = min(length, math.ceil((end_time - grid_start) / step))
+    return first, max(first, last)
+
+def class_load(db, grid_start, step, length, pending_windows=False):
+    """
+    Jobs per resource class overlapping each grid interval: running jobs for
+    their remaining time and pending jobs' stored segments, plus with
+    pending_windows the scheduled window of every other pending job.
+    """
+    load = defaultdict(lambda: np.zeros(length, dtype=np.int32))
+    def occupy(resource_usage, start_time, end_time):
+        first, last = grid_range(start_time, end_time, grid_start, step, length)
+        load[(resource_usage or "").lower()][first:last] += 1
+    for resource_usage, start_time, duration_hours in db.query(Job.resource_usage, Job.start_time, Job.duration_hours).filter(
+        Job.status == JobStatus.RUNNING, Job.start_time.isnot(None)
+    ):
+        occupy(resource_usage, start_time, start_time + timedelta(hours=duration_hours or 0))
+    for resource_usage, start_time, end_time in db.query(Job.resource_usage, JobSegment.start_time, JobSegment.end_time).join(
+        JobSegment, JobSegment.job_id == Job.id
+    ).filter(Job.status == JobStatus.PENDING):
+        occupy(resource_usage, start_time, end_time)
+    if pending_windows:
+        grid_end = grid_start + step * length
+        segmented = select(JobSegment.id).where(JobSegment.job_id == Job.id).exists()
+        for resource_usage, scheduled_time, duration_hours in db.query(
+            Job.resource_usage, Job.scheduled_time, Job.duration_hours
+        ).filter(Job.status == JobStatus.PENDING, Job.scheduled_time < grid_end, ~segmented):
+            occupy(resource_usage, scheduled_time, scheduled_time + timedelta(hours=duration_hours or 0))
+    return load
+
+def stored_task_limits(parameters):
+    """(earliest_start, deadline) as naive UTC from a job's stored task parameters"""
+    task = (parameters or {}).get("task") or {}
+    return tuple(
+        to_naive_utc(parse_point_time(task[key])) if task.get(key) else None
+        for key in ("earliest_start", "deadline")
+    )
+
+def with_replan(parameters, recommendation, entry):
+    """
+    Copy of a job's stored parameters with its recommendation replaced and
+    entry, recording why it moved, appended to parameters["replans"]
+    """
+    parameters = dict(parameters or {})
+    parameters.update({
+        "recommendation": recommendation,
+        "confidence_score": recommendation.get("confidence_score", 0.7),
+        "reasoning": recommendation.get("reasoning", "Optimized for lower carbon intensity"),
+        "replans": (parameters.get("replans") or [])[-(REPLAN_HISTORY - 1):] + [entry]
+    })
+    return parameters
+
+def moved_analysis(job, expected_intensity):
+    """
+    (carbon_saved, results["analysis"]) of a job moved to a window with mean
+    expected_intensity, measured against the baseline it was scheduled with
+    """
+    analysis = dict((job.results or {}).get("analysis") or {})
+    baseline_intensity = analysis.get("baseline_intensity", job.carbon_intensity or 0)
+    carbon_difference = baseline_intensity - expected_intensity
+    analysis.update({
+        "baseline_intensity": baseline_intensity,
+        "optimized_intensity": expected_intensity,
+        "carbon_difference": carbon_difference,
+        "money_saved": carbon_difference * 0.05
+    })
+    carbon_saved = calculate_carbon_savings(baseline_intensity, expected_intensity, job.duration_hours, job.resource_usage or "")
+    return carbon_saved, analysis
+
+def write_moves(db, moves, now, **values):
+    """
+    Move still-PENDING jobs in one bulk UPDATE on the caller's transaction.
+    moves are dicts with job_id, new_time, new_intensity and new_parameters;
+    carbon_saved and results["analysis"] are re-derived for the new window
+    and the jobs' rollup metrics follow. values sets further columns on every
+    moved job. Returns the moves applied, skipping jobs no longer pending.
+    """
+    if not moves:
+        return []
+    table = Job.__table__
+    jobs = {job.id: job for job in db.query(
+        Job.id, Job.created_at, Job.status, Job.resource_usage, Job.duration_hours,
+        Job.carbon_intensity, Job.carbon_saved, Job.results
+    ).filter(Job.id.in_([move["job_id"] for move in moves]), Job.status == JobStatus.PENDING)}
+    moves = [move for move in moves if move["job_id"] in jobs]
+    changes = []
+    rows = []
+    for move in moves:
+        job = jobs[move["job_id"]]
+        carbon_saved, analysis = moved_analysis(job, move["new_intensity"])
+        parameters = dict(move["new_parameters"])
+        parameters["recommendation"] = {**parameters.get("recommendation", {}), "carbon_savings_estimate": carbon_saved}
+        move["new_parameters"] = parameters
+        changes.append((job, carbon_saved, {**(job.results or {}), "analysis": analysis}))
+        rows.append({
+            "job_id": move["job_id"],
+            "new_time": move["new_time"],
+            "new_intensity": move["new_intensity"],
+            "new_parameters": parameters,
+            "new_carbon_saved": carbon_saved,
+            "new_analysis": json.dumps(analysis, default=str)
+        })
+    if not rows:
+        return []
+    result = db.execute(
+        update(table).where(table.c.id == bindparam("job_id"), table.c.status == JobStatus.PENDING).values(
+            scheduled_time=bindparam("new_time"),
+            expected_intensity=bindparam("new_intensity"),
+            parameters=bindparam("new_parameters"),
+            carbon_saved=bindparam("new_carbon_saved"),
+            # Merged in SQL so concurrent writes to other results keys are kept
+            results=func.json_set(func.coalesce(table.c.results, "{}"), "$.analysis", func.json(bindparam("new_analysis"))),
+            updated_at=now,
+            **values
+        ),
+        rows
+    )
+    if result.rowcount < len(rows):
+        # Some jobs were claimed meanwhile; the write lock now held keeps the rest PENDING
+        applied = {job_id for (job_id,) in db.query(Job.id).filter(
+            Job.id.in_([move["job_id"] for move in moves]), Job.status == JobStatus.PENDING
+        )}
+        moves = [move for move in moves if move["job_id"] in applied]
+        changes = [change for change in changes if change[0].id in applied]
+    record_metric_changes(db, changes)
+    return moves
+
+def assign_pending(db, now=None, limits=None, default_limit=None):
+    """
+    Re-plan every pending job against per-class capacity and write the new
+    start times, recommendations and re-plan history back in one bulk update.
+    A job only moves when that saves ASSIGNMENT_MIN_GAIN_FRACTION of its
+    emissions, so grid rounding alone never moves it.
+    Jobs with stored segments and running jobs stay put and count as load.
+    Returns a summary of the run.
+    """
+    now = now or datetime.utcnow()
+    limits = limits if limits is not None else dispatcher.limits
+    default_limit = default_limit if default_limit is not None else dispatcher.default_limit
+    step = timedelta(minutes=ASSIGNMENT_STEP_MINUTES)
+    grid_start = datetime.min + math.ceil((now - datetime.min) / step) * step
+    length = int(ASSIGNMENT_HORIZON_HOURS * 60 / ASSIGNMENT_STEP_MINUTES)
+    step_hours = ASSIGNMENT_STEP_MINUTES / 60
+
+    segmented = {job_id for (job_id,) in db.query(JobSegment.job_id).join(Job).filter(Job.status == JobStatus.PENDING).distinct()}
+    pending = db.query(
+        Job.id, Job.resource_usage, Job.duration_hours, Job.region, Job.scheduled_time, Job.parameters
+    ).filter(Job.status == JobStatus.PENDING).all()
+    movable = [job for job in pending if job.id not in segmented]
+    forecasts = latest_forecasts(db, {job.region for job in movable})
+    grids = {region: sample_forecast(forecast, grid_start, step, length) for region, forecast in forecasts.items()}
+
+    # Fixed load: running jobs for their remaining time, and stored segments
+    fixed = class_load(db, grid_start, step, length)
+
+    by_class = defaultdict(list)
+    skipped = 0
+    for job in movable:
+        values = grids.get(job.region)
+        slots = max(1, math.ceil(float(job.duration_hours) / step_hours - 1e-9))
+        if values is None or slots > length:
+            skipped += 1
+            continue
+        earliest_start, deadline = stored_task_limits(job.parameters)
+        lo = 0 if earliest_start is None else max(0, math.ceil((earliest_start - grid_start) / step - 1e-9))
+        hi = length if deadline is None else min(length, math.floor((deadline - grid_start) / step + 1e-9))
+        csum = np.concatenate(([0.0], np.cumsum(values)))
+        factor = USAGE_FACTORS.get((job.resource_usage or "").lower(), DEFAULT_USAGE_FACTOR)
+        # Same units as calculate_carbon_savings: intensity * hours * factor / 1000
+        cost = (csum[slots:] - csum[:-slots]) * step_hours * factor / 1000
+        allowed = np.zeros(len(cost), dtype=bool)
+        allowed[lo:max(lo, hi - slots + 1)] = True
+        cost = np.where(allowed, cost, np.inf)
+        means = (csum[slots:] - csum[:-slots]) / slots
+        current = None if job.scheduled_time is None else math.floor((job.scheduled_time - grid_start) / step)
+        if current is not None and not (0 <= current < len(cost) and np.isfinite(cost[current])):
+            current = None
+        # The current slot is discounted, so the solver only leaves it for a real gain
+        solver_cost = cost.copy()
+        if current is not None:
+            solver_cost[current] *= 1 - ASSIGNMENT_MIN_GAIN_FRACTION
+        by_class[(job.resource_usage or "").lower()].append(
+            (job, slots, cost, solver_cost, means, current, (job.region, slots, lo, hi))
+        )
+
+    updates = []
+    summary = {
+        "jobs": len(pending),
+        "moved": 0,
+        "unassigned": 0,
+        "skipped": skipped + len(segmented),
+        "emissions_before": 0.0,
+        "emissions_after": 0.0
+    }
+    for resource_usage, entries in by_class.items():
+        capacity = limits.get(resource_usage, default_limit)
+        costs = [solver_cost for _, _, _, solver_cost, _, _, _ in entries]
+        starts = solve_class(costs, [slots for _, slots, _, _, _, _, _ in entries], capacity, fixed[resource_usage])
+        keep_current(starts, [key for *_, key in entries], [current for *_, current, _ in entries])
+        for (job, _, cost, _, means, current, _), start in zip(entries, starts):
+            if start < 0:
+                summary["unassigned"] += 1
+                continue
+            if current is not None:
+                summary["emissions_before"] += float(cost[current])
+                summary["emissions_after"] += float(cost[start])
+                if start == current:
+                    continue
+            scheduled_time = grid_start + step * int(start)
+            expected_intensity = float(means[start])
+            previous_intensity = float(means[current]) if current is not None else None
+            if current is None:
+                reason = "outside_window"
+            else:
+                reason = "lower_emissions" if cost[start] < cost[current] else "capacity"
+            previous = (job.parameters or {}).get("recommendation") or {}
+            reasoning = (
+                f"Moved by capacity-aware assignment to a {job.duration_hours}-hour window with a mean "
+                f"forecast intensity of {expected_intensity:.1f}"
+            )
+            if previous_intensity is not None:
+                reasoning += f", versus {previous_intensity:.1f} in its previous slot"
+            recommendation = {
+                **previous,
+                "recommended_start_time": scheduled_time.isoformat(),
+                "expected_intensity": expected_intensity,
+                "reasoning": reasoning + ".",
+                "alternative_windows": []
+            }
+            updates.append({
+                "job_id": job.id,
+                "new_time": scheduled_time,
+                "new_intensity": expected_intensity,
+                "new_parameters": with_replan(job.parameters, recommendation, {
+                    "at": now.isoformat(),
+                    "reason": reason,
+                    "previous_start_time": job.scheduled_time.isoformat() if job.scheduled_time else None,
+                    "scheduled_time": scheduled_time.isoformat(),
+                    "previous_intensity": previous_intensity,
+                    "expected_intensity": expected_intensity
+                }),
+                "resource_usage": job.resource_usage
+            })
+
+    updates = write_moves(db, updates, now)
+    db.commit()
+    for row in updates:
+        dispatcher.submit(row["job_id"], row["new_time"], row["resource_usage"])
+    summary["moved"] = len(updates)
+    logger.info("Reassigned %s of %s pending jobs", len(updates), len(pending), extra={"unassigned": summary["unassigned"]})
+    summary["emissions_before"] = round(summary["emissions_before"], 4)
+    summary["emissions_after"] = round(summary["emissions_after"], 4)
+    summary["moved_jobs"] = [{"id": row["job_id"], "scheduled_time": row["new_time"]} for row in updates]
+    return summary
@@ -0,0 +1,298 @@
+"""
+Benchmarks for the scheduling hot paths.
+
+    python bench.py                          # full run, writes bench_results.json
+    python bench.py --quick --output new.json
+    python bench.py --compare bench_results.json --output new.json
+
+Every benchmark runs at several data sizes (forecast length, jobs in the
+database). External providers are stubbed and the database, history and
+background workers are isolated in a temporary directory, so runs are
+repeatable and never touch the network. --compare reports the median ratio
+against an earlier result file and exits non-zero on regressions beyond
+--threshold.
+"""
+import os
+import sys
+import tempfile
+
+# Isolate state and disable background work before any backend module is imported
+_workdir = tempfile.mkdtemp(prefix="carbon-bench-")
+os.environ.update({
+    "JOBS_DB_PATH": os.path.join(_workdir, "jobs.db"),
+    "HISTORY_DIR": os.path.join(_workdir, "history"),
+    "HISTORY_ENABLED": "false",
+    "FORECASTER_ENABLED": "false",
+    "DISPATCHER_ENABLED": "false",
+    "SCHEDULER_ENGINE": "solver",
+    "WATTTIME_USERNAME": "",
+    "WATTTIME_PASSWORD": "",
+    "GROQ_API_KEY": "",
+    "INTENSITY_TICK_SECONDS": "3600",
+})
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import numpy as np
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List
+from pydantic import TypeAdapter
+
+import carbon_data
+import insights_worker
+from api import JobBase, Task, build_analysis, build_job
+from carbon_data import generate_simulated_data
+from groq_inference import (
+    calculate_carbon_savings,
+    generate_batch_recommendations,
+    generate_fallback_recommendation,
+    generate_heuristic_recommendation,
+)
+from insights import get_fallback_insights
+from models import Job, SessionLocal
+from assignment import solve_class
+from optimizer import find_optimal_segments
+
+FULL_SIZES = {
+    "forecast_points": [96, 288, 864, 2016],
+    "batch_tasks": [10, 100, 1000],
+    "serialized_jobs": [10, 100, 1000],
+    "db_jobs": [100, 1000, 10000],
+}
+QUICK_SIZES = {
+    "forecast_points": [96, 864],
+    "batch_tasks": [10, 100],
+    "serialized_jobs": [10, 100],
+    "db_jobs": [100, 1000],
+}
+
+def measure(func, number, repeat=5):
+    """Per-call timings in microseconds over `repeat` rounds of `number` calls"""
+    func()  # warm-up
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number * 1e6)
+    return {
+        "median_us": round(statistics.median(rounds), 3),
+        "min_us": round(min(rounds), 3),
+        "mean_us": round(statistics.fmean(rounds), 3),
+        "number": number,
+        "repeat": repeat
+    }
+
+def sample_task(index=0):
+    return SimpleNamespace(
+        task_name=f"bench-task-{index}",
+        duration_hours=[0.5, 1, 2, 4, 8][index % 5],
+        resource_usage=["low", "medium", "high"][index % 3]
+    )
+
+def stub_providers(points):
+    """Serve seeded simulated data and local insights instead of calling out"""
+    carbon_data.get_carbon_intensity = lambda signal_type="co2_moer", region=None: generate_simulated_data(
+        f"SIMULATED_{region}" if region else "SIMULATED_CAISO_NORTH", points, seed=1
+    )
+
+    async def verified():
+        return False
+
+    async def local_insights(task, data):
+        return get_fallback_insights(task, data)
+
+    insights_worker.verify_perplexity_access = verified
+    insights_worker.get_insights_async = local_insights
+
+def seed_jobs(total):
+    """Grow the jobs table to `total` rows with realistic JSON payloads"""
+    db = SessionLocal()
+    try:
+        existing = db.query(Job).count()
+        data = generate_simulated_data(points=96, seed=1)
+        for index in range(existing, total):
+            task = Task(**vars(sample_task(index)))
+            recommendation = generate_fallback_recommendation(task, data)
+            db.add(build_job(task, data, recommendation, get_fallback_insights(task, data), build_analysis(data, recommendation)))
+            if index % 1000 == 999:
+                db.commit()
+        db.commit()
+    finally:
+        db.close()
+
+def bench_functions(sizes):
+    results = []
+    results.append({
+        "name": "calculate_carbon_savings",
+        "params": {},
+        **measure(lambda: calculate_carbon_savings(700, 550, 4, "high"), number=10000)
+    })
+    for points in sizes["forecast_points"]:
+        data = generate_simulated_data(points=points, seed=1)
+        task = sample_task()
+        results.append({
+            "name": "generate_simulated_data",
+            "params": {"forecast_points": points},
+            **measure(lambda: generate_simulated_data(points=points, seed=1), number=50)
+        })
+        results.append({
+            "name": "generate_fallback_recommendation",
+            "params": {"forecast_points": points},
+            **measure(lambda: generate_fallback_recommendation(task, data), number=50)
+        })
+        results.append({
+            "name": "generate_heuristic_recommendation",
+            "params": {"forecast_points": points},
+            **measure(lambda: generate_heuristic_recommendation(task, data), number=200)
+        })
+        for min_chunk_hours in (None, 1):
+            results.append({
+                "name": "find_optimal_segments",
+                "params": {"forecast_points": points, "min_chunk_hours": min_chunk_hours},
+                **measure(lambda: find_optimal_segments(data["forecast"], 8, min_chunk_hours), number=20)
+            })
+        for count in sizes["batch_tasks"]:
+            tasks = [sample_task(index) for index in range(count)]
+            results.append({
+                "name": "generate_batch_recommendations",
+                "params": {"forecast_points": points, "tasks": count},
+                **measure(lambda: generate_batch_recommendations(tasks, data), number=3)
+            })
+    # Capacity-aware assignment on a 72-hour, 15-minute grid
+    data = generate_simulated_data(points=288, seed=1)
+    values = [point["value"] for point in data["forecast"]]
+    for count in sizes["batch_tasks"]:
+        costs, slots = [], []
+        for index in range(count):
+            length = 1 + index % 16
+            sums = [sum(values[start:start + length]) for start in range(len(values) - length + 1)]
+            costs.append(np.array(sums))
+            slots.append(length)
+        fixed = np.zeros(len(values), dtype=np.int32)
+        results.append({
+            "name": "solve_class",
+            "params": {"jobs": count, "slots": len(values)},
+            **measure(lambda: solve_class(costs, slots, max(2, count // 20), fixed), number=1, repeat=3)
+        })
+    return results
+
+def bench_serialization(sizes):
+    results = []
+    adapter = TypeAdapter(List[JobBase])
+    data = generate_simulated_data(points=96, seed=1)
+    for count in sizes["serialized_jobs"]:
+        jobs = []
+        for index in range(count):
+            task = Task(**vars(sample_task(index)))
+            recommendation = generate_fallback_recommendation(task, data)
+            job = build_job(task, data, recommendation, get_fallback_insights(task, data), build_analysis(data, recommendation))
+            job.id, job.status, job.created_at = index + 1, "pending", datetime.utcnow()
+            jobs.append(job)
+        results.append({
+            "name": "serialize_jobbase_list",
+            "params": {"jobs": count},
+            **measure(lambda: adapter.dump_json(adapter.validate_python(jobs, from_attributes=True)), number=5)
+        })
+    return results
+
+def bench_endpoints(sizes):
+    from fastapi.testclient import TestClient
+    import main
+
+    results = []
+    payload = {"task_name": "bench", "duration_hours": 2, "resource_usage": "medium"}
+    with TestClient(main.app) as client:
+        for points in sizes["forecast_points"]:
+            stub_providers(points)
+            results.append({
+                "name": "POST /api/schedule",
+                "params": {"forecast_points": points},
+                **measure(lambda: client.post("/api/schedule", json=payload).raise_for_status(), number=10, repeat=3)
+            })
+        stub_providers(96)
+        for total in sizes["db_jobs"]:
+            seed_jobs(total)
+            for limit in (50, 500):
+                results.append({
+                    "name": "GET /api/jobs",
+                    "params": {"db_jobs": total, "limit": limit},
+                    **measure(lambda: client.get("/api/jobs", params={"limit": limit}).raise_for_status(), number=10, repeat=3)
+                })
+            job_id = client.get("/api/jobs", params={"limit": 1}).json()[0]["id"]
+            results.append({
+                "name": "GET /api/jobs/{id}",
+                "params": {"db_jobs": total},
+                **measure(lambda: client.get(f"/api/jobs/{job_id}").raise_for_status(), number=20, repeat=3)
+            })
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def result_key(result):
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+def compare(baseline, current, threshold):
+    """Print median ratios current/baseline; return the regressions"""
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result_key(result))
+        if not before or not before["median_us"]:
+            continue
+        ratio = result["median_us"] / before["median_us"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{result_key(result):70} {before['median_us']:>12.1f} -> {result['median_us']:>12.1f} us  x{ratio:.2f} {flag}")
+        if flag:
+            regressions.append(result_key(result))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes for a fast check")
+    parser.add_argument("--only", choices=["functions", "serialization", "endpoints"], action="append")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median ratio counted as a regression")
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    suites = {"functions": bench_functions, "serialization": bench_serialization, "endpoints": bench_endpoints}
+    results = []
+    for name in args.only or suites:
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        results += suites[name](sizes)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick
+        },
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print(f"{result_key(result):70} {result['median_us']:>12.1f} us")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above x{args.threshold}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
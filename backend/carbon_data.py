@@ -1,146 +1,430 @@
+import asyncio
+import logging
 import os
-import random
+import threading
+import time
+import zlib
+import numpy as np
 import requests
-from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from dotenv import load_dotenv
+from providers import call_with_fallback, get_breaker, CircuitOpenError, WATTTIME_HTTP_TIMEOUT_SECONDS, WATTTIME_TIMEOUT_SECONDS
+from history import history_store, replay_forecast
+from forecaster import extend_forecast
+from metrics import register_cache, schedule_stage_seconds, upstream_errors_total
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Overridable so the backend can point at a local stand-in (see mock_providers.py)
+WATTTIME_BASE_URL = os.getenv("WATTTIME_BASE_URL", "https://api.watttime.org")
+# WattTime login tokens are valid for 30 minutes; refresh a little early
+WATTTIME_TOKEN_TTL_SECONDS = int(os.getenv("WATTTIME_TOKEN_TTL_SECONDS", 30 * 60))
+WATTTIME_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("WATTTIME_TOKEN_REFRESH_MARGIN_SECONDS", 120))
+WATTTIME_POOL_SIZE = int(os.getenv("WATTTIME_POOL_SIZE", 10))
+
+class WattTimeClient:
+    """
+    Reusable WattTime API client.
+
+    Keeps a single pooled HTTP session so TLS connections are reused across
+    requests, and caches the bearer token until shortly before it expires.
+    A 401 from any endpoint forces one token refresh and a retry.
+    Every request has a timeout and goes through the WattTime circuit breaker,
+    so while WattTime is down callers fail fast to their offline data.
+    """
+
+    def __init__(self, username=None, password=None, base_url=WATTTIME_BASE_URL):
+        self.username = username or os.getenv("WATTTIME_USERNAME")
+        self.password = password or os.getenv("WATTTIME_PASSWORD")
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=WATTTIME_POOL_SIZE, pool_maxsize=WATTTIME_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        # Grid regions for a fixed coordinate never change, so look them up once
+        self._region_cache = {}
+        self.breaker = get_breaker("WattTime")
+
+    @property
+    def has_credentials(self):
+        return bool(self.username and self.password)
+
+    def _request(self, url, **kwargs):
+        """GET with a timeout; network errors and 5xx responses count against the breaker"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("WattTime circuit is open")
+        try:
+            response = self.session.get(url, timeout=WATTTIME_HTTP_TIMEOUT_SECONDS, **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _login(self):
+        """Perform an HTTP Basic login and cache the returned token"""
+        logger.info("Logging in to WattTime")
+        response = self._request(
+            f"{self.base_url}/login",
+            auth=HTTPBasicAuth(self.username, self.password)
+        )
+        if response.status_code != 200:
+            logger.warning("WattTime login failed", extra={"status": response.status_code})
+        response.raise_for_status()
+        self._token = response.json()['token']
+        self._token_expires_at = (
+            time.monotonic() + WATTTIME_TOKEN_TTL_SECONDS - WATTTIME_TOKEN_REFRESH_MARGIN_SECONDS
+        )
+        return self._token
+
+    def get_token(self, force_refresh=False):
+        """Return a cached token, logging in only when it is missing or about to expire"""
+        if not self.has_credentials:
+            logger.debug("WattTime credentials not configured")
+            return None
+        with self._token_lock:
+            if force_refresh or not self._token or time.monotonic() >= self._token_expires_at:
+                self._login()
+            return self._token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expires_at = 0.0
+
+    def get(self, path, params=None):
+        """Authenticated GET that refreshes the token once on a 401"""
+        token = self.get_token()
+        if not token:
+            raise RuntimeError("WattTime credentials not configured")
+        url = f"{self.base_url}{path}"
+        response = self._request(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+        if response.status_code == 401:
+            logger.info("WattTime token rejected, refreshing")
+            token = self.get_token(force_refresh=True)
+            response = self._request(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def get_region(self, latitude, longitude, signal_type="co2_moer"):
+        key = (latitude, longitude, signal_type)
+        if key in self._region_cache:
+            return self._region_cache[key]
+        region_data = self.get("/v3/region-from-loc", params={
+            "latitude": latitude,
+            "longitude": longitude,
+            "signal_type": signal_type
+        })
+        self._region_cache[key] = region_data["region"]
+        return region_data["region"]
+
+    def get_forecast(self, region, signal_type="co2_moer"):
+        return self.get("/v3/forecast", params={
+            "region": region,
+            "signal_type": signal_type
+        })
+
+    def get_historical(self, region, start, end, signal_type="co2_moer"):
+        return self.get("/v3/historical", params={
+            "region": region,
+            "signal_type": signal_type,
+            "start": start.isoformat(),
+            "end": end.isoformat()
+        })
+
+watttime_client = WattTimeClient()
+
 def check_watttime_access(token):
-    """Check access status for WattTime API"""
-    url = "https://api.watttime.org/v3/my-access"
+    """
+    Check access status for WattTime API.
+    Diagnostic only - not part of the scheduling hot path.
+    """
+    url = f"{watttime_client.base_url}/v3/my-access"
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        print(f"Checking WattTime access with token: {token[:10]}...")
-        response = requests.get(url, headers=headers)
-        print(f"Access check response status: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Access check error response: {response.text}")
+        response = watttime_client._request(url, headers=headers)
         response.raise_for_status()
-        access_data = response.json()
-        print("Access check response:", access_data)
-        return access_data
+        return response.json()
     except Exception as e:
-        print(f"Error checking WattTime access: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        if isinstance(e, requests.exceptions.RequestException):
-            print(f"Request error details: {e.response.text if e.response else 'No response'}")
+        logger.warning("WattTime access check failed: %s", e, extra={"error_type": type(e).__name__})
         return None
 
 def get_watttime_token():
     """Get login token from WattTime API"""
-    username = os.getenv("WATTTIME_USERNAME")
-    password = os.getenv("WATTTIME_PASSWORD")
-    
-    print(f"Checking WattTime credentials - Username present: {bool(username)}, Password present: {bool(password)}")
-    
-    if not username or not password:
-        print("WattTime credentials not found in environment variables")
-        return None
-    
-    login_url = "https://api.watttime.org/login"
     try:
-        print(f"Attempting to login to WattTime API with username: {username}")
-        response = requests.get(login_url, auth=HTTPBasicAuth(username, password))
-        print(f"WattTime login response status: {response.status_code}")
-        if response.status_code != 200:
-            print(f"WattTime login error response: {response.text}")
-        response.raise_for_status()
-        print("Login successful")
-        token = response.json()['token']
-        # Check access after getting token
-        access_data = check_watttime_access(token)
-        print(f"Access check result: {access_data}")
-        return token
+        return watttime_client.get_token()
+    except CircuitOpenError:
+        return None
     except Exception as e:
-        print(f"Error getting WattTime token: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        if isinstance(e, requests.exceptions.RequestException):
-            print(f"Request error details: {e.response.text if e.response else 'No response'}")
+        logger.warning("Error getting WattTime token: %s", e, extra={"error_type": type(e).__name__})
+        upstream_errors_total.inc("WattTime", "auth")
         return None
 
-def generate_simulated_data():
-    """Generate simulated carbon intensity data with a realistic pattern"""
-    base_intensity = random.randint(600, 800)
-    current_time = datetime.utcnow()
-    
-    # Simulate 24 hours of data with 15-minute intervals
-    data = []
-    for i in range(96):  # 24 hours * 4 (15-minute intervals)
-        time_offset = timedelta(minutes=15 * i)
-        # Add some random variation to create a realistic pattern
-        variation = random.randint(-50, 50)
-        # Time of day variation (lower at night, higher during peak hours)
-        hour = (current_time + time_offset).hour
-        if 0 <= hour < 6:  # Night hours
-            time_factor = -100
-        elif 12 <= hour < 18:  # Peak hours
-            time_factor = 100
-        else:  # Other hours
-            time_factor = 0
-            
-        value = base_intensity + variation + time_factor
-        data.append({
-            "point_time": (current_time + time_offset).isoformat(),
-            "value": max(300, min(1200, value))  # Keep values in realistic range
-        })
-    
+# WattTime regenerates forecasts every 5 minutes
+FORECAST_REFRESH_SECONDS = int(os.getenv("FORECAST_REFRESH_SECONDS", 300))
+# How long past expiry a forecast may still be served while a refresh runs
+FORECAST_MAX_STALE_SECONDS = int(os.getenv("FORECAST_MAX_STALE_SECONDS", 30 * 60))
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+class ForecastCache:
+    """
+    Forecast cache keyed by (region, signal_type).
+
+    Entries expire FORECAST_REFRESH_SECONDS after the forecast's generation
+    time. Concurrent misses for the same key share a single upstream call,
+    and expired entries are served stale while one background refresh runs.
+    """
+
+    def __init__(self, refresh_seconds=FORECAST_REFRESH_SECONDS, max_stale_seconds=FORECAST_MAX_STALE_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _ttl_for(self, payload):
+        generated_at = _parse_timestamp((payload.get("meta") or {}).get("generated_at"))
+        if not generated_at:
+            return self.refresh_seconds
+        age = (datetime.now(timezone.utc) - generated_at).total_seconds()
+        # Never cache for less than a few seconds, even if upstream is lagging
+        return max(5, self.refresh_seconds - max(0, age))
+
+    def _load(self, key, loader, flight):
+        try:
+            payload = loader()
+            now = time.monotonic()
+            expires_at = now + self._ttl_for(payload)
+            with self._lock:
+                self._entries[key] = (payload, expires_at, expires_at + self.max_stale_seconds)
+            flight["result"] = payload
+        except Exception as e:
+            flight["error"] = e
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight["done"].set()
+
+    def _start_flight(self, key, loader, background):
+        """Start a load for key unless one is already running. Caller holds the lock."""
+        flight = self._inflight.get(key)
+        if flight:
+            return flight, False
+        flight = {"done": threading.Event(), "result": None, "error": None}
+        self._inflight[key] = flight
+        if background:
+            threading.Thread(target=self._load, args=(key, loader, flight), daemon=True).start()
+        return flight, True
+
+    def get(self, key, loader):
+        """Return the cached payload for key, calling loader() at most once per refresh"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now < entry[1]:
+                self.hits += 1
+                return entry[0]
+            if entry and now < entry[2]:
+                # Stale but usable: serve it and refresh in the background
+                self.hits += 1
+                self._start_flight(key, loader, background=True)
+                return entry[0]
+            self.misses += 1
+            flight, is_leader = self._start_flight(key, loader, background=False)
+
+        if is_leader:
+            self._load(key, loader, flight)
+        else:
+            flight["done"].wait()
+        if flight["error"] is not None:
+            raise flight["error"]
+        return flight["result"]
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+forecast_cache = ForecastCache()
+register_cache("forecast", forecast_cache)
+
+# Seed for generate_simulated_data; unset keeps it random per call
+SIMULATION_SEED = int(os.getenv("SIMULATION_SEED")) if os.getenv("SIMULATION_SEED") else None
+
+# Region whose recorded history replaces live data when WattTime is down
+HISTORY_FALLBACK_REGION = os.getenv("HISTORY_FALLBACK_REGION")
+
+# Candidate grid regions for spatial shifting, e.g. "CAISO_NORTH,PJM_DC,ERCOT_NORTH".
+# When unset, jobs run in the single region containing the configured coordinates.
+CARBON_REGIONS = [region.strip() for region in os.getenv("CARBON_REGIONS", "").split(",") if region.strip()]
+CARBON_LATITUDE = os.getenv("CARBON_LATITUDE", "37.7749")  # San Francisco
+CARBON_LONGITUDE = os.getenv("CARBON_LONGITUDE", "-122.4194")
+
+def generate_simulated_data(location="SIMULATED_CAISO_NORTH", points=96, step_minutes=15, seed=SIMULATION_SEED, start_time=None):
+    """
+    Generate simulated carbon intensity data with a realistic pattern.
+    With a seed the series is deterministic per (seed, location, start slot);
+    without one it varies on every call.
+    """
+    current_time = start_time or datetime.utcnow()
+    if seed is not None:
+        slot = int((current_time.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds() // (step_minutes * 60))
+        rng = np.random.default_rng([int(seed), zlib.crc32(location.encode()), slot])
+    else:
+        rng = np.random.default_rng()
+
+    base_intensity = rng.integers(600, 801)
+    # Add some random variation to create a realistic pattern
+    variation = rng.integers(-50, 51, size=points)
+    offsets = np.arange(points) * step_minutes * 60
+    # Time of day variation (lower at night, higher during peak hours)
+    hours = (current_time.hour * 3600 + current_time.minute * 60 + current_time.second + offsets) // 3600 % 24
+    time_factor = np.select([hours < 6, (hours >= 12) & (hours < 18)], [-100, 100], 0)
+    # Keep values in realistic range
+    values = np.clip(base_intensity + variation + time_factor, 300, 1200)
+
+    step = timedelta(minutes=step_minutes)
+    data = [
+        {"point_time": (current_time + step * i).isoformat(), "value": int(value)}
+        for i, value in enumerate(values)
+    ]
     return {
         "carbon_intensity": data[0]["value"],
         "unit": "lbs_co2_per_mwh",
-        "location": "SIMULATED_CAISO_NORTH",
+        "location": location,
         "timestamp": data[0]["point_time"],
         "forecast": data
     }
 
-def get_carbon_intensity():
+def get_offline_carbon_data(region=None):
     """
-    Fetch real-time carbon intensity data from the WattTime API.
-    Falls back to simulated data if the API is unavailable.
+    Carbon data for when WattTime is unavailable: a replay of the recorded
+    history for region (default: HISTORY_FALLBACK_REGION or the most recently
+    ingested one), or simulated data when there is not enough history yet.
     """
-    token = get_watttime_token()
-    if not token:
-        print("Using simulated data due to authentication failure")
-        return generate_simulated_data()
-    
-    # First get the region for the coordinates
-    region_url = "https://api.watttime.org/v3/region-from-loc"
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "latitude": "37.7749",  # San Francisco coordinates
-        "longitude": "-122.4194",
-        "signal_type": "co2_moer"
+    history_region = region or HISTORY_FALLBACK_REGION or history_store.latest_region()
+    forecast = replay_forecast(history_region) if history_region else None
+    if not forecast:
+        return generate_simulated_data(f"SIMULATED_{region}") if region else generate_simulated_data()
+    return {
+        "carbon_intensity": forecast[0]["value"],
+        "unit": "lbs_co2_per_mwh",
+        "location": history_region,
+        "timestamp": forecast[0]["point_time"],
+        "source": "history",
+        "forecast": forecast
     }
+
+# True while serving /api/schedule; background callers (re-planner, history
+# ingester, intensity ticks) leave it unset and stay out of its stage timings
+_schedule_request = ContextVar("schedule_request", default=False)
+
+@contextmanager
+def schedule_request():
+    """Time carbon data stages into schedule_stage_seconds within this context"""
+    token = _schedule_request.set(True)
+    try:
+        yield
+    finally:
+        _schedule_request.reset(token)
+
+def _stage(name):
+    return schedule_stage_seconds.time(name) if _schedule_request.get() else nullcontext()
+
+def get_carbon_intensity(signal_type="co2_moer", region=None):
+    """
+    Fetch real-time carbon intensity data from the WattTime API for region,
+    or for the region containing CARBON_LATITUDE/CARBON_LONGITUDE.
+    Forecasts are served from forecast_cache between upstream refreshes.
+    Falls back to recorded history, then simulated data, if the API is unavailable.
+    """
+    with _stage("token"):
+        token = get_watttime_token()
+    if not token:
+        logger.debug("Using offline data: no WattTime token")
+        return get_offline_carbon_data(region)
     
     try:
-        region_response = requests.get(region_url, headers=headers, params=params)
-        region_response.raise_for_status()
-        region_data = region_response.json()
-        region = region_data["region"]
-        print(f"Region: {region}")
+        if region is None:
+            with _stage("region"):
+                region = watttime_client.get_region(CARBON_LATITUDE, CARBON_LONGITUDE, signal_type)
         
         # Get forecast data for the region
-        forecast_url = "https://api.watttime.org/v3/forecast"
-        forecast_params = {
-            "region": region,
-            "signal_type": "co2_moer"
-        }
-        
-        forecast_response = requests.get(forecast_url, headers=headers, params=forecast_params)
-        forecast_response.raise_for_status()
-        forecast_data = forecast_response.json()
+        with _stage("forecast"):
+            forecast_data = forecast_cache.get(
+                (region, signal_type),
+                lambda: watttime_client.get_forecast(region, signal_type)
+            )
         
         return {
             "carbon_intensity": forecast_data["data"][0]["value"],
             "unit": "lbs_co2_per_mwh",
             "location": region,
             "timestamp": forecast_data["data"][0]["point_time"],
+            "generated_at": (forecast_data.get("meta") or {}).get("generated_at"),
             "forecast": forecast_data["data"]
         }
+    except CircuitOpenError:
+        logger.debug("WattTime circuit open, using offline data")
+        return get_offline_carbon_data(region)
     except Exception as e:
-        print(f"Error fetching carbon intensity from WattTime API: {e}")
-        print("Using simulated data")
-        return generate_simulated_data()
+        logger.warning("Error fetching carbon intensity from WattTime, using offline data: %s", e)
+        upstream_errors_total.inc("WattTime", "error")
+        return get_offline_carbon_data(region)
+
+async def get_carbon_intensity_async(signal_type="co2_moer", region=None):
+    """
+    Non-blocking get_carbon_intensity for the async request path.
+    The pooled WattTime session and forecast cache are thread-safe, so the
+    (usually cached) lookup runs in a worker thread under a deadline. The
+    WattTime breaker lives in the client, since get_carbon_intensity already
+    turns upstream errors into offline data.
+    The forecast is extended past the upstream horizon by the local
+    forecaster, which needs no network calls.
+    """
+    carbon_data = await call_with_fallback(
+        "WattTime",
+        asyncio.to_thread(get_carbon_intensity, signal_type, region),
+        WATTTIME_TIMEOUT_SECONDS,
+        lambda: get_offline_carbon_data(region)
+    )
+    return extend_forecast(carbon_data)
+
+async def get_regional_carbon_intensity(signal_type="co2_moer", regions=None):
+    """
+    Carbon data for every candidate region, fetched concurrently so the
+    fan-out costs about as much as the slowest single region.
+    Without CARBON_REGIONS this is a one-element list for the default region.
+    """
+    regions = regions if regions is not None else CARBON_REGIONS
+    return await asyncio.gather(*(
+        get_carbon_intensity_async(signal_type, region) for region in (regions or [None])
+    ))
 
 # Test the function
 if __name__ == "__main__":
@@ -0,0 +1,565 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import shlex
+import socket
+from collections import Counter
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, literal, or_, select, update
+from events import broadcaster
+from models import Job, JobSegment, JobStatus, SessionLocal
+from rollups import record_status_change, record_status_changes
+
+logger = logging.getLogger(__name__)
+
+DISPATCHER_ENABLED = os.getenv("DISPATCHER_ENABLED", "true").lower() == "true"
+# "sleep" simulates each job for duration_hours * DISPATCH_TIME_SCALE;
+# "subprocess" runs DISPATCH_COMMAND formatted with the job's fields.
+# Interruptible jobs are claimed once per stored segment, at its start time,
+# and hold no slot or lease between segments.
+DISPATCH_EXECUTOR = os.getenv("DISPATCH_EXECUTOR", "sleep")
+DISPATCH_TIME_SCALE = float(os.getenv("DISPATCH_TIME_SCALE", 1.0))
+DISPATCH_COMMAND = os.getenv("DISPATCH_COMMAND", "")
+# Concurrent running jobs per resource_usage class, e.g. "high:2,medium:4,low:8"
+DISPATCH_CONCURRENCY = os.getenv("DISPATCH_CONCURRENCY", "high:2,medium:4,low:8")
+DISPATCH_DEFAULT_CONCURRENCY = int(os.getenv("DISPATCH_DEFAULT_CONCURRENCY", 4))
+# Several processes may dispatch from one database: each claims due jobs in
+# batches under a lease it renews while they run, and any worker puts jobs
+# whose lease expired (their worker died) back to PENDING.
+DISPATCH_WORKER_ID = os.getenv("DISPATCH_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+DISPATCH_LEASE_SECONDS = int(os.getenv("DISPATCH_LEASE_SECONDS", 60))
+DISPATCH_HEARTBEAT_SECONDS = float(os.getenv("DISPATCH_HEARTBEAT_SECONDS", 15))
+DISPATCH_CLAIM_BATCH = int(os.getenv("DISPATCH_CLAIM_BATCH", 16))
+# Jobs submitted through other processes are found by polling this often
+DISPATCH_POLL_SECONDS = float(os.getenv("DISPATCH_POLL_SECONDS", 5))
+
+def parse_limits(spec):
+    """Parse "class:limit,..." into a dict keyed by lower-cased class"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition(":")
+        limits[name.strip().lower()] = int(value)
+    return limits
+
+class SleepExecutor:
+    """Stand-in executor that occupies the slot for the job's (scaled) duration"""
+
+    def __init__(self, time_scale=DISPATCH_TIME_SCALE):
+        self.time_scale = time_scale
+
+    async def run(self, job):
+        if not job["segment_time"]:
+            await asyncio.sleep(job["duration_hours"] * 3600 * self.time_scale)
+            return {"executor": "sleep"}
+        start_time, end_time = job["segment_time"]
+        await asyncio.sleep((end_time - start_time).total_seconds() * self.time_scale)
+        return {"executor": "sleep", "segment": job["segment"]}
+
+class CallableExecutor:
+    """Runs a local callable (sync or async) with the job dict"""
+
+    def __init__(self, func):
+        self.func = func
+
+    async def run(self, job):
+        if asyncio.iscoroutinefunction(self.func):
+            return await self.func(job)
+        return await run_in_threadpool(self.func, job)
+
+class SubprocessExecutor:
+    """
+    Runs a shell command template such as "python train.py --job {id}" per job.
+    Interruptible jobs run it once per segment with {segment} set to the
+    segment's index, so a checkpointing command can resume where it stopped.
+    """
+
+    def __init__(self, command=DISPATCH_COMMAND):
+        self.command = command
+
+    async def run(self, job):
+        args = shlex.split(self.command.format(**job))
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"exit code {process.returncode}: {stderr.decode(errors='replace')[-500:]}")
+        return {"executor": "subprocess", "stdout": stdout.decode(errors="replace")[-2000:]}
+
+def build_executor(kind=DISPATCH_EXECUTOR):
+    if kind == "subprocess":
+        return SubprocessExecutor()
+    return SleepExecutor()
+
+def _usage_class(column):
+    return func.lower(func.coalesce(column, ""))
+
+def next_segment_start(job_id_column):
+    """Start of the job's earliest segment that has not run yet"""
+    return select(func.min(JobSegment.start_time)).where(
+        JobSegment.job_id == job_id_column, JobSegment.completed_at.is_(None)
+    ).scalar_subquery()
+
+def parked_conditions(table):
+    """Interruptible jobs between segments: RUNNING, but held by no worker"""
+    return table.c.status == JobStatus.RUNNING, table.c.worker_id.is_(None)
+
+def claimable_ids(now, limit, free, default_free, parked=False):
+    """
+    Ids of up to limit due pending jobs, oldest first, taking at most
+    free[class] jobs of each resource class (default_free for other classes).
+    With parked, interruptible jobs whose next segment is due instead.
+    """
+    usage_class = _usage_class(Job.resource_usage)
+    full = [name for name, room in free.items() if room <= 0]
+    if parked:
+        due_at = next_segment_start(Job.id)
+        conditions = (*parked_conditions(Job.__table__), due_at <= now)
+    else:
+        due_at = Job.scheduled_time
+        conditions = (Job.status == JobStatus.PENDING, or_(Job.scheduled_time <= now, Job.scheduled_time.is_(None)))
+    due = select(Job.id, due_at.label("due_at"), usage_class.label("usage_class")).where(
+        *conditions,
+        usage_class.not_in(full)
+    ).order_by(due_at, Job.id).limit(limit * 4).subquery()
+    ranked = select(
+        due.c.id,
+        due.c.due_at,
+        due.c.usage_class,
+        func.row_number().over(partition_by=due.c.usage_class, order_by=(due.c.due_at, due.c.id)).label("rank")
+    ).subquery()
+    room = case(free, value=ranked.c.usage_class, else_=default_free) if free else literal(default_free)
+    return select(ranked.c.id).where(ranked.c.rank <= room).order_by(ranked.c.due_at, ranked.c.id).limit(limit)
+
+def _claim(db, ids, conditions, worker_id, now, **values):
+    table = Job.__table__
+    return db.execute(
+        update(table).where(table.c.id.in_(ids), *conditions).values(
+            worker_id=worker_id,
+            lease_expires_at=now + timedelta(seconds=DISPATCH_LEASE_SECONDS),
+            updated_at=now,
+            **values
+        ).returning(
+            table.c.id, table.c.task_name, table.c.duration_hours, table.c.resource_usage,
+            table.c.created_at, table.c.carbon_saved, table.c.results
+        )
+    ).all()
+
+def claim_due(worker_id, limit, free, default_free, now=None):
+    """
+    Atomically claim up to limit due jobs under a lease held by worker_id:
+    first parked interruptible jobs whose next segment is due, then PENDING
+    jobs, which move to RUNNING. Each claim is a conditional UPDATE, so a
+    job another worker claimed first fails the check and is claimed once.
+    Returns the claimed jobs as executor dicts, one segment each.
+    """
+    now = now or datetime.utcnow()
+    table = Job.__table__
+    db = SessionLocal()
+    try:
+        resumed = _claim(
+            db, claimable_ids(now, limit, free, default_free, parked=True), parked_conditions(table), worker_id, now
+        )
+        taken = Counter((row.resource_usage or "").lower() for row in resumed)
+        free = {name: free.get(name, default_free) - taken[name] for name in set(free) | set(taken)}
+        claimed = []
+        if len(resumed) < limit:
+            claimed = _claim(
+                db, claimable_ids(now, limit - len(resumed), free, default_free), (table.c.status == JobStatus.PENDING,),
+                worker_id, now, status=JobStatus.RUNNING, start_time=now
+            )
+        if not resumed and not claimed:
+            db.rollback()
+            return []
+        record_status_changes(db, claimed, JobStatus.PENDING, JobStatus.RUNNING)
+        db.commit()
+        # The segment to run now is the earliest one not yet completed
+        counts = Counter()
+        segments = {}
+        for job_id, seq, start_time, end_time, completed_at in db.query(
+            JobSegment.job_id, JobSegment.seq, JobSegment.start_time, JobSegment.end_time, JobSegment.completed_at
+        ).filter(
+            JobSegment.job_id.in_([row.id for row in resumed + claimed])
+        ).order_by(JobSegment.job_id, JobSegment.seq):
+            counts[job_id] += 1
+            if completed_at is None:
+                segments.setdefault(job_id, (seq, start_time, end_time))
+    finally:
+        db.close()
+    started = {row.id for row in claimed}
+    jobs = []
+    for row in resumed + claimed:
+        if row.id in started:
+            broadcaster.publish("job.status", {"id": row.id, "status": JobStatus.RUNNING, "start_time": now})
+        seq, start_time, end_time = segments.get(row.id, (0, None, None))
+        jobs.append({
+            "id": row.id,
+            "task_name": row.task_name,
+            "duration_hours": row.duration_hours,
+            "resource_usage": row.resource_usage,
+            "segment": seq,
+            "segment_time": (start_time, end_time) if start_time else None,
+            "segments": counts[row.id]
+        })
+    return jobs
+
+def park(job_id, seq, worker_id=DISPATCH_WORKER_ID):
+    """
+    Record segment seq of an interruptible job as run and hand back its slot
+    and lease until the next segment is due. Returns that segment's
+    start_time, or None when worker_id no longer holds the job.
+    """
+    now = datetime.utcnow()
+    table = Job.__table__
+    db = SessionLocal()
+    try:
+        held = db.execute(
+            update(table).where(
+                table.c.id == job_id, table.c.status == JobStatus.RUNNING, table.c.worker_id == worker_id
+            ).values(worker_id=None, lease_expires_at=None, updated_at=now).returning(table.c.id)
+        ).first()
+        if not held:
+            db.rollback()
+            logger.warning("Job %s finished segment %s after its lease was lost", job_id, seq)
+            return None
+        db.execute(
+            update(JobSegment.__table__).where(
+                JobSegment.__table__.c.job_id == job_id, JobSegment.__table__.c.seq == seq
+            ).values(completed_at=now)
+        )
+        next_start = db.query(next_segment_start(job_id)).scalar()
+        db.commit()
+        return next_start
+    finally:
+        db.close()
+
+def renew_leases(worker_id, job_ids, now=None):
+    """Extend worker_id's leases on job_ids; returns the ids it still holds"""
+    now = now or datetime.utcnow()
+    table = Job.__table__
+    db = SessionLocal()
+    try:
+        renewed = db.execute(
+            update(table).where(
+                table.c.id.in_(job_ids),
+                table.c.worker_id == worker_id,
+                table.c.status == JobStatus.RUNNING
+            ).values(lease_expires_at=now + timedelta(seconds=DISPATCH_LEASE_SECONDS)).returning(table.c.id)
+        ).scalars().all()
+        db.commit()
+        return set(renewed)
+    finally:
+        db.close()
+
+def requeue(*conditions):
+    """
+    Put RUNNING jobs matching conditions back to PENDING and drop their lease.
+    Interruptible jobs that already ran a segment are parked instead, so they
+    resume from the first segment not completed.
+    Returns (job_id, scheduled_time, resource_usage) for each requeued job.
+    """
+    table = Job.__table__
+    segments = JobSegment.__table__
+    started = select(segments.c.id).where(
+        segments.c.job_id == table.c.id, segments.c.completed_at.is_not(None)
+    ).exists()
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(table).where(table.c.status == JobStatus.RUNNING, started, *conditions).values(
+                worker_id=None, lease_expires_at=None
+            )
+        )
+        rows = db.execute(
+            update(table).where(table.c.status == JobStatus.RUNNING, ~started, *conditions).values(
+                status=JobStatus.PENDING, worker_id=None, lease_expires_at=None, start_time=None
+            ).returning(
+                table.c.id, table.c.scheduled_time, table.c.resource_usage,
+                table.c.created_at, table.c.carbon_saved, table.c.results
+            )
+        ).all()
+        record_status_changes(db, rows, JobStatus.RUNNING, JobStatus.PENDING)
+        db.commit()
+    finally:
+        db.close()
+    for row in rows:
+        broadcaster.publish("job.status", {"id": row.id, "status": JobStatus.PENDING})
+    return [(row.id, row.scheduled_time or datetime.min, row.resource_usage) for row in rows]
+
+def reclaim_expired(now=None):
+    """Requeue jobs whose worker stopped renewing its lease"""
+    now = now or datetime.utcnow()
+    return requeue(Job.__table__.c.lease_expires_at < now)
+
+def release_leases(worker_id, job_ids):
+    """Requeue a stopping worker's jobs at once instead of waiting for their leases to expire"""
+    table = Job.__table__
+    return requeue(table.c.worker_id == worker_id, table.c.id.in_(job_ids))
+
+def mark_finished(job_id, status, execution, worker_id=DISPATCH_WORKER_ID):
+    """
+    RUNNING -> COMPLETED/FAILED, recording completion_time and the executor
+    result, in one UPDATE guarded on worker_id still holding the lease.
+    A segmented job's open segment is marked completed in the same transaction.
+    Returns False when the lease was lost and the result was discarded.
+    """
+    now = datetime.utcnow()
+    table = Job.__table__
+    db = SessionLocal()
+    try:
+        row = db.execute(
+            update(table).where(
+                table.c.id == job_id, table.c.status == JobStatus.RUNNING, table.c.worker_id == worker_id
+            ).values(
+                status=status,
+                completion_time=now,
+                lease_expires_at=None,
+                updated_at=now,
+                # Merged in SQL so concurrent writes to other results keys are kept
+                results=func.json_set(
+                    func.coalesce(table.c.results, "{}"), "$.execution", func.json(json.dumps(execution, default=str))
+                )
+            ).returning(table.c.id, table.c.created_at, table.c.resource_usage, table.c.carbon_saved, table.c.results)
+        ).first()
+        if not row:
+            db.rollback()
+            logger.warning("Job %s finished after its lease was lost; result discarded", job_id)
+            return False
+        # The segment just run is the job's earliest one still open
+        segments = JobSegment.__table__
+        db.execute(
+            update(segments).where(
+                segments.c.job_id == job_id,
+                segments.c.seq == select(func.min(segments.c.seq)).where(
+                    segments.c.job_id == job_id, segments.c.completed_at.is_(None)
+                ).scalar_subquery()
+            ).values(completed_at=now)
+        )
+        record_status_change(db, row, JobStatus.RUNNING, status)
+        db.commit()
+    finally:
+        db.close()
+    broadcaster.publish("job.status", {"id": job_id, "status": status, "completion_time": now})
+    return True
+
+class Dispatcher:
+    """
+    Dispatcher for pending jobs, safe to run in several processes at once.
+
+    Locally submitted jobs sit in a min-heap keyed on scheduled_time, so the
+    loop sleeps until the earliest one is due (or DISPATCH_POLL_SECONDS, to
+    pick up jobs submitted elsewhere) instead of polling tightly. Heap entries
+    are only wake-up hints: due jobs are claimed from the table in batches
+    with a lease, so whichever worker claims a job first runs it. Cancellation
+    removes the job from the live index and its heap entry is discarded lazily.
+    Claims respect the concurrency limit of each resource_usage class.
+    Interruptible jobs are claimed per segment and parked in between, so a
+    gap between segments holds neither a slot nor a lease.
+    """
+
+    def __init__(self, executor=None, limits=None, default_limit=DISPATCH_DEFAULT_CONCURRENCY,
+                 worker_id=DISPATCH_WORKER_ID, claim_batch=DISPATCH_CLAIM_BATCH):
+        self.executor = executor or build_executor()
+        self.limits = limits if limits is not None else parse_limits(DISPATCH_CONCURRENCY)
+        self.default_limit = default_limit
+        self.worker_id = worker_id
+        self.claim_batch = claim_batch
+        self._heap = []
+        self._live = {}
+        # job_id -> (task, resource class) for jobs this worker holds a lease on
+        self._active = {}
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+        self._heartbeat = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        pending = await run_in_threadpool(self._load_pending)
+        for job_id, scheduled_time, resource_usage in pending:
+            self._live[job_id] = (scheduled_time, resource_usage)
+        self._heap = [(scheduled_time, job_id) for job_id, scheduled_time, _ in pending]
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run())
+        self._heartbeat = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        tasks = [task for task in [self._task, self._heartbeat] if task]
+        held = list(self._active)
+        tasks += [task for task, _ in self._active.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._heartbeat = None
+        if held:
+            # Hand interrupted jobs back now rather than after their leases expire
+            await run_in_threadpool(release_leases, self.worker_id, held)
+
+    def _load_pending(self):
+        # RUNNING jobs whose worker died run again
+        reclaim_expired()
+        db = SessionLocal()
+        try:
+            rows = db.query(Job.id, Job.scheduled_time, Job.resource_usage).filter(
+                Job.status == JobStatus.PENDING
+            ).all()
+        finally:
+            db.close()
+        return [(job_id, scheduled_time or datetime.min, resource_usage) for job_id, scheduled_time, resource_usage in rows]
+
+    def _call(self, func, *args):
+        """Run func on the dispatcher's loop; safe to call from worker threads"""
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def submit(self, job_id, scheduled_time, resource_usage):
+        self._call(self._submit, job_id, scheduled_time or datetime.min, resource_usage)
+
+    def cancel(self, job_id):
+        self._call(self._live.pop, job_id, None)
+
+    def clear(self):
+        self._call(self._clear)
+
+    def _submit(self, job_id, scheduled_time, resource_usage):
+        self._live[job_id] = (scheduled_time, resource_usage)
+        heapq.heappush(self._heap, (scheduled_time, job_id))
+        if self._heap[0][1] == job_id:
+            # New earliest deadline: wake the loop so it can re-arm its sleep
+            self._wakeup.set()
+
+    def _clear(self):
+        self._live.clear()
+        self._heap.clear()
+
+    def _peek(self):
+        """Earliest live heap entry, dropping cancelled or superseded ones"""
+        while self._heap:
+            scheduled_time, job_id = self._heap[0]
+            live = self._live.get(job_id)
+            if live and live[0] == scheduled_time:
+                return scheduled_time, job_id
+            heapq.heappop(self._heap)
+        return None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            # Due hints are consumed here; the claim finds the jobs in the table
+            head = self._peek()
+            while head and head[0] <= now:
+                heapq.heappop(self._heap)
+                self._live.pop(head[1], None)
+                head = self._peek()
+            try:
+                claimed = await self._claim()
+            except Exception as e:
+                logger.warning("Error claiming due jobs: %s", e)
+                claimed = 0
+            if claimed == self.claim_batch:
+                # A full batch may mean more are due
+                continue
+            delay = DISPATCH_POLL_SECONDS
+            if head is not None:
+                delay = min(delay, (head[0] - datetime.utcnow()).total_seconds())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _free_slots(self):
+        active = Counter(usage_class for _, usage_class in self._active.values())
+        return {
+            usage_class: self.limits.get(usage_class, self.default_limit) - active[usage_class]
+            for usage_class in set(self.limits) | set(active)
+        }
+
+    async def _claim(self):
+        """Claim a batch of due jobs this worker has room for and start them"""
+        jobs = await run_in_threadpool(claim_due, self.worker_id, self.claim_batch, self._free_slots(), self.default_limit)
+        for job in jobs:
+            task = asyncio.create_task(self._execute(job))
+            self._active[job["id"]] = (task, (job["resource_usage"] or "").lower())
+            task.add_done_callback(lambda _, job_id=job["id"]: self._finished(job_id))
+        return len(jobs)
+
+    def _finished(self, job_id):
+        self._active.pop(job_id, None)
+        # A slot is free again
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _maintain(self):
+        """Renew this worker's leases and requeue jobs whose leases expired"""
+        while True:
+            await asyncio.sleep(DISPATCH_HEARTBEAT_SECONDS)
+            try:
+                if self._active:
+                    renewed = await run_in_threadpool(renew_leases, self.worker_id, list(self._active))
+                    for job_id in set(self._active) - renewed:
+                        # Another worker reclaimed it, so stop to avoid running it twice
+                        logger.warning("Lost the lease on job %s; stopping it", job_id)
+                        task, _ = self._active.get(job_id, (None, None))
+                        if task:
+                            task.cancel()
+                for job_id, scheduled_time, resource_usage in await run_in_threadpool(reclaim_expired):
+                    self._submit(job_id, scheduled_time, resource_usage)
+            except Exception as e:
+                logger.warning("Error renewing dispatch leases: %s", e)
+
+    async def _execute(self, job):
+        try:
+            execution = await self.executor.run(job)
+            status = JobStatus.COMPLETED
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job["id"], e)
+            execution = {"error": str(e)}
+            status = JobStatus.FAILED
+        if status == JobStatus.COMPLETED and job["segment"] + 1 < job["segments"]:
+            # More segments to run: free the slot until the next one is due
+            next_start = await self._store(park, job["id"], job["segment"], self.worker_id)
+            if next_start:
+                self._submit(job["id"], next_start, job["resource_usage"])
+            return
+        if job["segments"]:
+            execution = {**execution, "segments": job["segments"]}
+        await self._store(mark_finished, job["id"], status, execution, self.worker_id)
+
+    async def _store(self, func, *args):
+        """
+        Write a job's outcome, retrying failed writes. The job stays in
+        _active meanwhile, so its lease keeps being renewed until the write
+        lands; if the lease is lost anyway, _maintain cancels the retries.
+        """
+        delay = 0.5
+        while True:
+            try:
+                return await run_in_threadpool(func, *args)
+            except Exception as e:
+                logger.warning("Error storing the outcome of job %s, retrying in %ss: %s", args[0], delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, DISPATCH_HEARTBEAT_SECONDS)
+
+    @property
+    def queued(self):
+        return len(self._live)
+
+dispatcher = Dispatcher()
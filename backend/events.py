@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 256))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", 15))
+INTENSITY_TICK_SECONDS = float(os.getenv("INTENSITY_TICK_SECONDS", 60))
+
+def _json_default(value):
+    # Match the API's ISO-8601 datetimes
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+class Broadcaster:
+    """
+    Fan-out of server-sent events to every connected client.
+
+    Each event is serialized once into its SSE frame and the same string is
+    queued for all subscribers. A subscriber that falls EVENT_QUEUE_SIZE
+    frames behind is sent a "resync" event and should refetch its state.
+    """
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._loop = None
+
+    def bind(self, loop):
+        self._loop = loop
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event_type, data):
+        """Publish an event; safe to call from worker threads"""
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._publish(event_type, data)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, event_type, data)
+
+    def _publish(self, event_type, data):
+        if not self._subscribers:
+            return
+        frame = f"event: {event_type}\ndata: {json.dumps(data, default=_json_default)}\n\n"
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Too far behind: drop its backlog and tell it to refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait("event: resync\ndata: {}\n\n")
+
+    async def stream(self):
+        """Async generator of SSE frames for one client"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            self._subscribers.discard(queue)
+
+broadcaster = Broadcaster()
+
+async def publish_intensity_ticks(get_carbon_data, interval=INTENSITY_TICK_SECONDS):
+    """Periodically push the current intensity, only while someone is listening"""
+    while True:
+        await asyncio.sleep(interval)
+        if not broadcaster.subscriber_count:
+            continue
+        try:
+            carbon_data = await get_carbon_data()
+            broadcaster.publish("intensity", {
+                "carbon_intensity": carbon_data.get("carbon_intensity"),
+                "unit": carbon_data.get("unit"),
+                "location": carbon_data.get("location"),
+                "timestamp": carbon_data.get("timestamp")
+            })
+        except Exception as e:
+            logger.warning("Error publishing intensity tick: %s", e)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from cache import TTLCache
+from history import HistoryStore, history_store, HISTORY_DIR, HISTORY_STEP_SECONDS
+from metrics import register_cache
+from optimizer import forecast_to_series, to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Local seasonal forecaster trained on the recorded history (history.py).
+#
+# The model is a ridge regression on Fourier features of hour-of-day and
+# day-of-week. It is kept as running sufficient statistics (X'X, X'y and
+# per-hour residual sums), so a retrain only folds in the slots recorded
+# since the last one and runs in a separate process, off the request path.
+# Inference is one matrix product over the whole horizon, cached per region.
+FORECASTER_ENABLED = os.getenv("FORECASTER_ENABLED", "true").lower() == "true"
+FORECAST_HORIZON_HOURS = float(os.getenv("FORECAST_HORIZON_HOURS", 72))
+FORECASTER_RETRAIN_SECONDS = float(os.getenv("FORECASTER_RETRAIN_SECONDS", 3600))
+# Minimum recorded slots before a region's model is used
+FORECASTER_MIN_SAMPLES = int(os.getenv("FORECASTER_MIN_SAMPLES", 288))
+FORECASTER_RIDGE_ALPHA = float(os.getenv("FORECASTER_RIDGE_ALPHA", 1.0))
+# z-score of the uncertainty band (1.645 = 90% interval)
+FORECASTER_BAND_Z = float(os.getenv("FORECASTER_BAND_Z", 1.645))
+# Hours over which the last observed deviation from the seasonal fit decays
+FORECASTER_LEVEL_DECAY_HOURS = float(os.getenv("FORECASTER_LEVEL_DECAY_HOURS", 6))
+
+DAY_HARMONICS = 3
+WEEK_HARMONICS = 2
+EPOCH = datetime(1970, 1, 1)
+
+def seasonal_features(seconds):
+    """Design matrix of bias plus hour-of-day and day-of-week Fourier terms for epoch seconds"""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    day = 2 * np.pi * (seconds % 86400) / 86400
+    # Epoch day 0 was a Thursday; shift so the weekly phase starts on Monday
+    week = 2 * np.pi * ((seconds + 3 * 86400) % (7 * 86400)) / (7 * 86400)
+    columns = [np.ones_like(seconds)]
+    for k in range(1, DAY_HARMONICS + 1):
+        columns += [np.sin(k * day), np.cos(k * day)]
+    for k in range(1, WEEK_HARMONICS + 1):
+        columns += [np.sin(k * week), np.cos(k * week)]
+    return np.column_stack(columns)
+
+def _epoch_seconds(when):
+    return (to_naive_utc(when) - EPOCH).total_seconds()
+
+def empty_state():
+    size = 1 + 2 * (DAY_HARMONICS + WEEK_HARMONICS)
+    return {
+        "xtx": np.zeros((size, size)),
+        "xty": np.zeros(size),
+        "samples": 0,
+        "residual_sq": np.zeros(24),
+        "residual_n": np.zeros(24),
+        "trained_until": None,
+        "coef": None,
+        "last_time": None,
+        "last_value": None
+    }
+
+def update_model(state, region, directory=HISTORY_DIR, step_seconds=HISTORY_STEP_SECONDS, alpha=FORECASTER_RIDGE_ALPHA):
+    """
+    Fold the history recorded since state["trained_until"] into the model.
+    Runs in the trainer process: it reads the memory-mapped history directly
+    and returns the updated state.
+    """
+    store = HistoryStore(directory, step_seconds)
+    start, step, values = store.query(region, state["trained_until"])
+    if start is None:
+        return state
+    seconds = _epoch_seconds(start) + np.arange(len(values)) * step.total_seconds()
+    known = ~np.isnan(values)
+    if not known.any():
+        return state
+    seconds, targets = seconds[known], values[known].astype(np.float64)
+    features = seasonal_features(seconds)
+
+    state = dict(state)
+    state["xtx"] = state["xtx"] + features.T @ features
+    state["xty"] = state["xty"] + features.T @ targets
+    state["samples"] += len(targets)
+    penalty = alpha * np.eye(len(state["xty"]))
+    penalty[0, 0] = 0  # do not shrink the intercept
+    state["coef"] = np.linalg.solve(state["xtx"] + penalty, state["xty"])
+
+    # Residual variance per hour of day drives the width of the bands
+    residuals = targets - features @ state["coef"]
+    hours = (seconds % 86400 // 3600).astype(int)
+    state["residual_sq"] = state["residual_sq"] + np.bincount(hours, weights=residuals ** 2, minlength=24)
+    state["residual_n"] = state["residual_n"] + np.bincount(hours, minlength=24)
+    state["trained_until"] = start + step * len(values)
+    state["last_time"] = EPOCH + timedelta(seconds=float(seconds[-1]))
+    state["last_value"] = float(targets[-1])
+    return state
+
+class Forecaster:
+    """Per-region models, retrained in a background process and served from memory"""
+
+    def __init__(self, horizon_hours=FORECAST_HORIZON_HOURS):
+        self.horizon_hours = horizon_hours
+        self._states = {}
+        self._versions = {}
+        self._predictions = TTLCache(maxsize=64, ttl_seconds=FORECASTER_RETRAIN_SECONDS)
+        register_cache("forecaster", self._predictions)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def ready(self, region):
+        state = self._states.get(region)
+        return bool(state and state["coef"] is not None and state["samples"] >= FORECASTER_MIN_SAMPLES)
+
+    async def retrain(self, regions=None):
+        """Incrementally update every region's model in the trainer process"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        for region in regions if regions is not None else history_store.regions():
+            state = self._states.get(region) or empty_state()
+            updated = await loop.run_in_executor(self._pool, update_model, state, region, history_store.directory)
+            with self._lock:
+                self._states[region] = updated
+                self._versions[region] = self._versions.get(region, 0) + 1
+
+    async def run(self, interval=FORECASTER_RETRAIN_SECONDS):
+        while True:
+            try:
+                await self.retrain()
+            except Exception as e:
+                logger.exception("Error retraining intensity forecaster: %s", e)
+            await asyncio.sleep(interval)
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def predict(self, region, start, step, count):
+        """
+        (values, lower, upper) for count slots from start, or None if the
+        region has no usable model. One batched evaluation per distinct
+        request, cached until the model changes.
+        """
+        if not self.ready(region):
+            return None
+        state = self._states[region]
+        key = (region, self._versions.get(region), to_naive_utc(start), step, count)
+        cached = self._predictions.get(key)
+        if cached is not None:
+            return cached
+
+        seconds = _epoch_seconds(start) + np.arange(count) * step.total_seconds()
+        values = seasonal_features(seconds) @ state["coef"]
+        # Carry the most recent deviation from the seasonal fit, decaying with lead time
+        if state["last_time"] is not None:
+            last_seconds = _epoch_seconds(state["last_time"])
+            offset = state["last_value"] - float((seasonal_features([last_seconds]) @ state["coef"])[0])
+            lead_hours = np.maximum(seconds - last_seconds, 0) / 3600
+            values = values + offset * np.exp(-lead_hours / FORECASTER_LEVEL_DECAY_HOURS)
+        hours = (seconds % 86400 // 3600).astype(int)
+        variance = np.divide(state["residual_sq"], state["residual_n"], out=np.zeros(24), where=state["residual_n"] > 0)
+        spread = FORECASTER_BAND_Z * np.sqrt(variance[hours])
+        result = (values, values - spread, values + spread)
+        self._predictions.set(key, result)
+        return result
+
+forecaster = Forecaster()
+
+def upstream_forecast(carbon_data):
+    """The provider's forecast points, without any locally predicted extension"""
+    forecast = carbon_data.get("forecast") or []
+    extension = carbon_data.get("forecast_extension")
+    return forecast[:len(forecast) - extension["points"]] if extension else forecast
+
+def extend_forecast(carbon_data, horizon_hours=None):
+    """
+    Append locally predicted points so carbon_data's forecast covers
+    horizon_hours from its first point. Predicted points carry lower/upper
+    band values; carbon_data["forecast_extension"] records where they start.
+    Returns carbon_data unchanged when the region has no trained model.
+    """
+    horizon = timedelta(hours=horizon_hours or forecaster.horizon_hours)
+    forecast = carbon_data.get("forecast")
+    if not forecast or carbon_data.get("forecast_extension"):
+        return carbon_data
+    start, step, values = forecast_to_series(forecast)
+    count = int((start + horizon - (start + step * len(values))) // step)
+    if count <= 0:
+        return carbon_data
+    first = start + step * len(values)
+    predicted = forecaster.predict(carbon_data.get("location"), first, step, count)
+    if predicted is None:
+        return carbon_data
+
+    values, lower, upper = predicted
+    extension = [
+        {
+            "point_time": (first + step * index).isoformat(),
+            "value": round(float(value), 2),
+            "lower": round(float(low), 2),
+            "upper": round(float(high), 2)
+        }
+        for index, (value, low, high) in enumerate(zip(values, lower, upper))
+    ]
+    return {
+        **carbon_data,
+        "forecast": forecast + extension,
+        "forecast_extension": {"start_time": extension[0]["point_time"], "points": len(extension)}
+    }
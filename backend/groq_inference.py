@@ -1,31 +1,61 @@
+import copy
+import logging
 import os
 import groq
 from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
+from optimizer import (
+    InfeasibleWindowError, find_optimal_segments, find_optimal_windows, find_optimal_windows_batch, rank_regions, to_naive_utc
+)
+from providers import GROQ_TIMEOUT_SECONDS
+from cache import TTLCache
+from metrics import fallbacks_total, register_cache, upstream_errors_total
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get API key from environment variable
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Unset uses the SDK default; point at mock_providers.py for load tests
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+# SDK-level retries all count against GROQ_TIMEOUT_SECONDS; the caller's
+# breaker and fallback handle failures, so none by default
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", 0))
+# "solver" skips the LLM and always uses the deterministic forecast solver
+SCHEDULER_ENGINE = os.getenv("SCHEDULER_ENGINE", "llm").lower()
+
+# LLM recommendations are memoized per task signature and forecast snapshot
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", 1024))
+RECOMMENDATION_CACHE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", 300))
+RECOMMENDATION_INTENSITY_BUCKET = float(os.getenv("RECOMMENDATION_INTENSITY_BUCKET", 10))
+recommendation_cache = TTLCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL_SECONDS)
+register_cache("recommendation", recommendation_cache)
 
 if not GROQ_API_KEY:
-    print("Groq API key not found in environment variables - using fallback recommendation system")
-    client = None
+    logger.info("Groq API key not configured - using the forecast solver for recommendations")
+    async_client = None
 else:
     try:
-        # Initialize Groq client with basic configuration
-        client = groq.Groq(
+        # Initialize the Groq client with basic configuration
+        async_client = groq.AsyncGroq(
             api_key=GROQ_API_KEY,
+            base_url=GROQ_BASE_URL,
+            timeout=GROQ_TIMEOUT_SECONDS,
+            max_retries=GROQ_MAX_RETRIES,
         )
     except Exception as e:
-        print(f"Error initializing Groq client: {e}")
-        client = None
+        logger.error("Error initializing Groq client: %s", e)
+        async_client = None
+
+# Relative power draw per resource_usage class (assume high/medium/low scale)
+USAGE_FACTORS = {"high": 1.0, "medium": 0.6, "low": 0.3}
+DEFAULT_USAGE_FACTOR = 0.5
 
 def calculate_carbon_savings(baseline_intensity, optimized_intensity, duration_hours, resource_usage):
     """Calculate potential carbon savings based on intensity difference"""
-    # Convert resource usage string to numeric value (assume high/medium/low scale)
-    usage_factors = {"high": 1.0, "medium": 0.6, "low": 0.3}
-    usage_factor = usage_factors.get(resource_usage.lower(), 0.5)
+    # Convert resource usage string to numeric value
+    usage_factor = USAGE_FACTORS.get(resource_usage.lower(), DEFAULT_USAGE_FACTOR)
     
     # Calculate savings (in kg CO2)
     intensity_difference = baseline_intensity - optimized_intensity
@@ -34,15 +64,62 @@ def calculate_carbon_savings(baseline_intensity, optimized_intensity, duration_h
     savings = (intensity_difference * hours * usage_factor) / 1000
     return max(0, savings)  # Ensure non-negative savings
 
-def get_optimal_schedule(task, carbon_data):
-    """Get optimal schedule recommendation using Groq's LLM or fallback system"""
-    if not client:
-        print("Using fallback recommendation system")
-        return generate_fallback_recommendation(task, carbon_data)
-        
-    try:
-        # Prepare the prompt with more context and constraints
-        prompt = f"""You are an AI scheduling assistant specializing in carbon-aware computing. Your task is to analyze the following job and provide scheduling recommendations in JSON format.
+def apply_savings_metrics(recommendation, task, carbon_data):
+    """Recompute savings and sustainability metrics locally for an LLM recommendation"""
+    # Calculate actual carbon savings
+    current_intensity = carbon_data.get("carbon_intensity", 0)
+    expected_intensity = recommendation.get("expected_intensity", current_intensity * 0.9)
+    carbon_savings = calculate_carbon_savings(
+        current_intensity,
+        expected_intensity,
+        task.duration_hours,
+        task.resource_usage
+    )
+    
+    # Update recommendation with calculated metrics
+    recommendation["carbon_savings_estimate"] = carbon_savings
+    recommendation["sustainability_impact"] = build_sustainability_impact(
+        current_intensity, expected_intensity, carbon_savings
+    )
+    
+    # Ensure alternative_windows is a list with reasons
+    if "alternative_windows" not in recommendation:
+        recommendation["alternative_windows"] = []
+    
+    return recommendation
+
+def recommendation_cache_key(task, carbon_data):
+    """
+    Normalized task signature plus a fingerprint of the forecast it was planned on.
+    Real forecasts are identified by their generation time; otherwise the current
+    intensity is bucketed so near-identical conditions share an entry.
+    """
+    task_signature = (
+        " ".join(task.task_name.lower().split()),
+        round(float(task.duration_hours), 2),
+        task.resource_usage.strip().lower()
+    )
+    location = carbon_data.get("location")
+    generated_at = carbon_data.get("generated_at")
+    if generated_at:
+        return task_signature + (location, generated_at)
+    intensity = carbon_data.get("carbon_intensity", 0) or 0
+    return task_signature + (location, int(intensity // RECOMMENDATION_INTENSITY_BUCKET))
+
+def get_cached_recommendation(task, carbon_data):
+    """Cached LLM recommendation for this task and forecast, re-post-processed locally"""
+    cached = recommendation_cache.get(recommendation_cache_key(task, carbon_data))
+    if cached is None:
+        return None
+    return apply_savings_metrics(copy.deepcopy(cached), task, carbon_data)
+
+def cache_recommendation(task, carbon_data, recommendation):
+    recommendation_cache.set(recommendation_cache_key(task, carbon_data), copy.deepcopy(recommendation))
+
+def build_schedule_messages(task, carbon_data):
+    """Chat messages asking the LLM for a schedule recommendation"""
+    # Prepare the prompt with more context and constraints
+    prompt = f"""You are an AI scheduling assistant specializing in carbon-aware computing. Your task is to analyze the following job and provide scheduling recommendations in JSON format.
 
 Task Details:
 - Name: {task.task_name}
@@ -83,160 +160,270 @@ Provide a detailed scheduling recommendation in the following JSON format:
 Make your reasoning detailed and focused on environmental impact. Include specific sustainability metrics and comparisons.
 Respond ONLY with the JSON object, no additional text."""
 
-        # Get completion from Groq
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a carbon-aware computing scheduler that returns ONLY valid JSON responses following the exact format specified in the prompt. No additional text or explanations outside the JSON structure."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="mixtral-8x7b-32768",
-            temperature=0.3,  # Lower temperature for more consistent JSON
-            max_tokens=1000
-        )
+    return [
+        {
+            "role": "system",
+            "content": "You are a carbon-aware computing scheduler that returns ONLY valid JSON responses following the exact format specified in the prompt. No additional text or explanations outside the JSON structure."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
 
-        # Parse the response
-        response_text = chat_completion.choices[0].message.content.strip()
+def parse_schedule_response(response_text, task, carbon_data):
+    """Parse the LLM's JSON and recompute savings metrics locally"""
+    # Remove any potential markdown code block markers
+    response_text = response_text.strip().replace('```json', '').replace('```', '').strip()
+    
+    try:
+        recommendation = json.loads(response_text)
         
-        # Remove any potential markdown code block markers
-        response_text = response_text.replace('```json', '').replace('```', '').strip()
+        # Ensure all required fields are present
+        required_fields = ['recommended_start_time', 'expected_intensity', 'confidence_score', 'reasoning', 'sustainability_impact']
+        if not all(field in recommendation for field in required_fields):
+            raise ValueError("Missing required fields in recommendation")
         
-        try:
-            recommendation = json.loads(response_text)
-            
-            # Ensure all required fields are present
-            required_fields = ['recommended_start_time', 'expected_intensity', 'confidence_score', 'reasoning', 'sustainability_impact']
-            if not all(field in recommendation for field in required_fields):
-                raise ValueError("Missing required fields in recommendation")
-            
-            # Calculate actual carbon savings
-            current_intensity = carbon_data.get("carbon_intensity", 0)
-            expected_intensity = recommendation.get("expected_intensity", current_intensity * 0.9)
-            carbon_savings = calculate_carbon_savings(
-                current_intensity,
-                expected_intensity,
-                task.duration_hours,
-                task.resource_usage
-            )
-            
-            # Calculate sustainability metrics
-            carbon_reduction = ((current_intensity - expected_intensity) / current_intensity) * 100
-            trees_equivalent = carbon_savings * 0.0165  # Rough estimate: 1 kg CO2 = 0.0165 trees/year
-            cost_savings = carbon_savings * 0.05  # Assuming $0.05 per kg CO2 saved
-            
-            # Update recommendation with calculated metrics
-            recommendation["carbon_savings_estimate"] = carbon_savings
-            recommendation["sustainability_impact"] = {
-                "carbon_reduction_percentage": round(carbon_reduction, 2),
-                "equivalent_trees_planted": round(trees_equivalent, 2),
-                "energy_cost_savings": round(cost_savings, 2)
+        cache_recommendation(task, carbon_data, recommendation)
+        return apply_savings_metrics(recommendation, task, carbon_data)
+
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.warning("Error parsing Groq response: %s", e, extra={"response_chars": len(response_text)})
+        logger.debug("Unparseable Groq response: %s", response_text)
+        upstream_errors_total.inc("Groq", "parse")
+        fallbacks_total.inc("Groq")
+        # Fall back to the deterministic forecast solver
+        return generate_fallback_recommendation(task, carbon_data)
+
+def task_limits(task):
+    """(earliest_start, deadline) of a task; either may be None"""
+    return getattr(task, "earliest_start", None), getattr(task, "deadline", None)
+
+def has_constraints(task):
+    """
+    Tasks with a time window or that may be split are planned by the solver
+    only, since the LLM prompt knows nothing about either.
+    """
+    return any(task_limits(task)) or getattr(task, "interruptible", False)
+
+async def get_optimal_schedule_async(task, carbon_data):
+    """
+    Start time recommendation from Groq's LLM, or the forecast solver when
+    Groq is not configured or the task has constraints the prompt cannot express.
+    Upstream errors propagate so the caller can apply its own deadline and fallback.
+    """
+    if not async_client or SCHEDULER_ENGINE == "solver" or has_constraints(task):
+        return generate_fallback_recommendation(task, carbon_data)
+
+    cached = get_cached_recommendation(task, carbon_data)
+    if cached:
+        return cached
+
+    chat_completion = await async_client.chat.completions.create(
+        messages=build_schedule_messages(task, carbon_data),
+        model="mixtral-8x7b-32768",
+        temperature=0.3,  # Lower temperature for more consistent JSON
+        max_tokens=1000
+    )
+    return parse_schedule_response(chat_completion.choices[0].message.content, task, carbon_data)
+
+def build_sustainability_impact(current_intensity, expected_intensity, carbon_savings):
+    """Derive the sustainability_impact block from intensities and savings"""
+    if current_intensity:
+        carbon_reduction = ((current_intensity - expected_intensity) / current_intensity) * 100
+    else:
+        carbon_reduction = 0
+    trees_equivalent = carbon_savings * 0.0165  # Rough estimate: 1 kg CO2 = 0.0165 trees/year
+    cost_savings = carbon_savings * 0.05  # Assuming $0.05 per kg CO2 saved
+    return {
+        "carbon_reduction_percentage": round(carbon_reduction, 2),
+        "equivalent_trees_planted": round(trees_equivalent, 2),
+        "energy_cost_savings": round(cost_savings, 2)
+    }
+
+def unsolved_recommendation(task, carbon_data):
+    """
+    Recommendation when the solver found no window: the heuristic if there
+    is no forecast to solve over, else the task cannot meet its deadline.
+    """
+    earliest_start, deadline = task_limits(task)
+    if deadline is not None and carbon_data.get("forecast"):
+        raise InfeasibleWindowError(
+            f"no forecast window between earliest_start and deadline fits duration_hours={task.duration_hours}"
+        )
+    return generate_heuristic_recommendation(task, carbon_data)
+
+def build_segmented_recommendation(task, carbon_data):
+    """
+    Recommendation for an interruptible task: the lowest-carbon set of
+    intervals before its deadline, each at least min_chunk_hours long.
+    """
+    plan = find_optimal_segments(
+        carbon_data.get("forecast"),
+        task.duration_hours,
+        getattr(task, "min_chunk_hours", None),
+        *task_limits(task)
+    )
+    if not plan:
+        return unsolved_recommendation(task, carbon_data)
+
+    current_intensity = carbon_data.get("carbon_intensity", 0)
+    unit = carbon_data.get("unit", "gCO2/kWh")
+    expected_intensity = plan["expected_intensity"]
+    carbon_savings = calculate_carbon_savings(
+        current_intensity,
+        expected_intensity,
+        task.duration_hours,
+        task.resource_usage
+    )
+    segments = plan["segments"]
+    reasoning = (
+        f"Split into {len(segments)} segment(s) with a mean forecast intensity of "
+        f"{expected_intensity:.1f} {unit}, versus {plan['run_now_intensity']:.1f} {unit} "
+        f"for one {task.duration_hours}-hour run started as early as allowed."
+    )
+    if not plan["horizon_covered"]:
+        reasoning += " The task runs past the end of the forecast, so the whole forecast was averaged."
+
+    return {
+        "recommended_start_time": segments[0]["start_time"].isoformat(),
+        "expected_intensity": expected_intensity,
+        "carbon_savings_estimate": carbon_savings,
+        "confidence_score": 0.8 if plan["horizon_covered"] else 0.6,
+        "reasoning": reasoning,
+        "sustainability_impact": build_sustainability_impact(current_intensity, expected_intensity, carbon_savings),
+        "segments": [
+            {
+                "start_time": segment["start_time"].isoformat(),
+                "end_time": segment["end_time"].isoformat(),
+                "expected_intensity": segment["expected_intensity"]
             }
-            
-            # Ensure alternative_windows is a list with reasons
-            if "alternative_windows" not in recommendation:
-                recommendation["alternative_windows"] = []
-            
-            return recommendation
-
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error parsing Groq response: {e}")
-            print(f"Raw response: {response_text}")
-            # Enhanced fallback with realistic calculations
-            current_time = datetime.now()
-            optimal_hour = 2  # 2 AM typically has lower carbon intensity
-            recommended_time = current_time.replace(hour=optimal_hour, minute=0)
-            if recommended_time < current_time:
-                recommended_time += timedelta(days=1)
-                
-            current_intensity = carbon_data.get("carbon_intensity", 0)
-            expected_intensity = current_intensity * 0.8  # Assume 20% reduction during optimal time
-            
-            carbon_savings = calculate_carbon_savings(
-                current_intensity,
-                expected_intensity,
-                task.duration_hours,
-                task.resource_usage
-            )
-            
-            recommendation = {
-                "recommended_start_time": recommended_time.isoformat(),
-                "expected_intensity": expected_intensity,
-                "carbon_savings_estimate": carbon_savings,
-                "confidence_score": 0.7,
-                "reasoning": "Scheduled for typical low-carbon intensity period (early morning) based on historical patterns",
-                "alternative_windows": [
-                    {
-                        "start_time": (recommended_time + timedelta(days=1)).isoformat(),
-                        "expected_intensity": expected_intensity * 1.1
-                    }
-                ]
+            for segment in segments
+        ],
+        "alternative_windows": []
+    }
+
+def build_solver_recommendation(task, carbon_data, windows):
+    """Turn solver output from optimizer.py into a recommendation dict"""
+    if getattr(task, "interruptible", False):
+        # windows only ranked the region; the split plan is solved here
+        return build_segmented_recommendation(task, carbon_data)
+    if not windows:
+        return unsolved_recommendation(task, carbon_data)
+
+    current_intensity = carbon_data.get("carbon_intensity", 0)
+    unit = carbon_data.get("unit", "gCO2/kWh")
+    best = windows["best"]
+    expected_intensity = best["expected_intensity"]
+    carbon_savings = calculate_carbon_savings(
+        current_intensity,
+        expected_intensity,
+        task.duration_hours,
+        task.resource_usage
+    )
+    reasoning = (
+        f"Lowest mean forecast intensity for a {task.duration_hours}-hour window is "
+        f"{expected_intensity:.1f} {unit} starting {best['start_time'].isoformat()}, "
+        f"versus {windows['run_now_intensity']:.1f} {unit} if started now."
+    )
+    if not windows["horizon_covered"]:
+        reasoning += " The task runs past the end of the forecast, so the whole forecast was averaged."
+
+    return {
+        "recommended_start_time": best["start_time"].isoformat(),
+        "expected_intensity": expected_intensity,
+        "carbon_savings_estimate": carbon_savings,
+        "confidence_score": 0.8 if windows["horizon_covered"] else 0.6,
+        "reasoning": reasoning,
+        "sustainability_impact": build_sustainability_impact(current_intensity, expected_intensity, carbon_savings),
+        "alternative_windows": [
+            {
+                "start_time": window["start_time"].isoformat(),
+                "expected_intensity": window["expected_intensity"],
+                "reason": f"Next-lowest non-overlapping window ({window['expected_intensity'] - expected_intensity:+.1f} {unit} vs best)"
             }
+            for window in windows["alternatives"]
+        ]
+    }
 
-            return recommendation
+def solve_or_none(task, carbon_data, windows):
+    """build_solver_recommendation, or None when the task cannot meet its deadline"""
+    try:
+        return build_solver_recommendation(task, carbon_data, windows)
+    except InfeasibleWindowError:
+        return None
 
-    except Exception as e:
-        print(f"Error in get_optimal_schedule: {e}")
-        # Improved error fallback
-        return {
-            "recommended_start_time": (datetime.now() + timedelta(hours=1)).isoformat(),
-            "expected_intensity": carbon_data.get("carbon_intensity", 0),
-            "carbon_savings_estimate": 0,
-            "confidence_score": 0.3,
-            "reasoning": f"Error in optimization: {str(e)}. Defaulting to +1 hour schedule.",
-            "alternative_windows": []
-        }
+def generate_batch_recommendations(tasks, carbon_data):
+    """
+    Deterministic recommendations for many tasks from a single solver pass;
+    None for tasks that cannot meet their deadline.
+    """
+    all_windows = find_optimal_windows_batch(
+        carbon_data.get("forecast"),
+        [task.duration_hours for task in tasks],
+        limits=[task_limits(task) for task in tasks]
+    )
+    return [
+        solve_or_none(task, carbon_data, windows)
+        for task, windows in zip(tasks, all_windows)
+    ]
+
+def plan_regions(tasks, regional_data):
+    """
+    Choose the region for each task jointly with its start time: the region
+    whose best window has the lowest expected intensity wins.
+    Returns per task (region_index, windows, region_options); windows is None
+    when no region has a forecast.
+    """
+    ranked = rank_regions(
+        [carbon_data.get("forecast") for carbon_data in regional_data],
+        [task.duration_hours for task in tasks],
+        limits=[task_limits(task) for task in tasks]
+    )
+    plans = []
+    for options in ranked:
+        region_options = [
+            {
+                "region": regional_data[region_index].get("location"),
+                "start_time": windows["best"]["start_time"].isoformat(),
+                "expected_intensity": windows["best"]["expected_intensity"]
+            }
+            for region_index, windows in options
+        ]
+        region_index, windows = options[0] if options else (0, None)
+        plans.append((region_index, windows, region_options))
+    return plans
+
+def with_region(recommendation, carbon_data, region_options):
+    """Record the chosen region and the per-region candidates on a recommendation"""
+    return {**recommendation, "region": carbon_data.get("location"), "region_options": region_options}
+
+def generate_regional_recommendations(tasks, regional_data):
+    """
+    Deterministic (region, start time) recommendations for many tasks.
+    Returns (region_index, recommendation) per task; the recommendation is
+    None for tasks that cannot meet their deadline in any region.
+    """
+    planned = []
+    for task, (region_index, windows, region_options) in zip(tasks, plan_regions(tasks, regional_data)):
+        recommendation = solve_or_none(task, regional_data[region_index], windows)
+        if recommendation is not None:
+            recommendation = with_region(recommendation, regional_data[region_index], region_options)
+        planned.append((region_index, recommendation))
+    return planned
 
 def generate_fallback_recommendation(task, carbon_data):
-    """Generate a fallback recommendation when Groq API is not available"""
+    """
+    Generate a deterministic recommendation from the forecast when Groq is
+    unavailable, using the sliding-window solver in optimizer.py
+    """
     try:
-        current_time = datetime.now()
-        # Schedule for early morning (2 AM) when carbon intensity is typically lower
-        optimal_hour = 2
-        recommended_time = current_time.replace(hour=optimal_hour, minute=0)
-        if recommended_time < current_time:
-            recommended_time += timedelta(days=1)
-            
-        current_intensity = carbon_data.get("carbon_intensity", 0)
-        expected_intensity = current_intensity * 0.8  # Assume 20% reduction during optimal time
-        
-        carbon_savings = calculate_carbon_savings(
-            current_intensity,
-            expected_intensity,
-            task.duration_hours,
-            task.resource_usage
-        )
-        
-        # Calculate sustainability metrics
-        carbon_reduction = ((current_intensity - expected_intensity) / current_intensity) * 100
-        trees_equivalent = carbon_savings * 0.0165  # Rough estimate: 1 kg CO2 = 0.0165 trees/year
-        cost_savings = carbon_savings * 0.05  # Assuming $0.05 per kg CO2 saved
-        
-        return {
-            "recommended_start_time": recommended_time.isoformat(),
-            "expected_intensity": expected_intensity,
-            "carbon_savings_estimate": carbon_savings,
-            "confidence_score": 0.7,
-            "reasoning": "Scheduled for typical low-carbon intensity period (early morning) based on historical patterns",
-            "sustainability_impact": {
-                "carbon_reduction_percentage": round(carbon_reduction, 2),
-                "equivalent_trees_planted": round(trees_equivalent, 2),
-                "energy_cost_savings": round(cost_savings, 2)
-            },
-            "alternative_windows": [
-                {
-                    "start_time": (recommended_time + timedelta(days=1)).isoformat(),
-                    "expected_intensity": expected_intensity * 1.1,
-                    "reason": "Alternative window with slightly higher carbon intensity"
-                }
-            ]
-        }
+        windows = find_optimal_windows(carbon_data.get("forecast"), task.duration_hours, 3, *task_limits(task))
+        return build_solver_recommendation(task, carbon_data, windows)
+    except InfeasibleWindowError:
+        raise
     except Exception as e:
-        print(f"Error in fallback recommendation: {e}")
+        logger.exception("Error in fallback recommendation: %s", e)
         return {
             "recommended_start_time": (datetime.now() + timedelta(hours=1)).isoformat(),
             "expected_intensity": carbon_data.get("carbon_intensity", 0),
@@ -250,3 +437,32 @@ def generate_fallback_recommendation(task, carbon_data):
             },
             "alternative_windows": []
         }
+
+def generate_heuristic_recommendation(task, carbon_data):
+    """Early-morning heuristic used only when no forecast is available"""
+    current_time = datetime.now()
+    # Schedule for early morning (2 AM) when carbon intensity is typically lower
+    recommended_time = current_time.replace(hour=2, minute=0)
+    if recommended_time < current_time:
+        recommended_time += timedelta(days=1)
+    earliest_start, _ = task_limits(task)
+    if earliest_start is not None:
+        recommended_time = max(recommended_time, to_naive_utc(earliest_start))
+
+    current_intensity = carbon_data.get("carbon_intensity", 0)
+    expected_intensity = current_intensity * 0.8  # Assume 20% reduction during optimal time
+    carbon_savings = calculate_carbon_savings(
+        current_intensity,
+        expected_intensity,
+        task.duration_hours,
+        task.resource_usage
+    )
+    return {
+        "recommended_start_time": recommended_time.isoformat(),
+        "expected_intensity": expected_intensity,
+        "carbon_savings_estimate": carbon_savings,
+        "confidence_score": 0.5,
+        "reasoning": "No forecast available; scheduled for typical low-carbon intensity period (early morning)",
+        "sustainability_impact": build_sustainability_impact(current_intensity, expected_intensity, carbon_savings),
+        "alternative_windows": []
+    }
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from optimizer import forecast_to_series, to_naive_utc
+
+# Columnar intensity history: one memory-mapped float32 file per (region, kind)
+# on a fixed time grid, plus a small JSON sidecar holding the grid origin.
+# Missing slots are NaN. Range queries return views into the memmap, not copies.
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_data"))
+HISTORY_STEP_SECONDS = int(os.getenv("HISTORY_STEP_SECONDS", 300))
+
+def _safe_name(region):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", region)
+
+class HistoryStore:
+    """Append-only float32 time series per region, memory-mapped for zero-copy reads"""
+
+    def __init__(self, directory=HISTORY_DIR, step_seconds=HISTORY_STEP_SECONDS):
+        self.directory = directory
+        self.step = timedelta(seconds=step_seconds)
+        self._meta = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def _meta_path(self, region):
+        return os.path.join(self.directory, f"{_safe_name(region)}.json")
+
+    def _data_path(self, region, kind):
+        return os.path.join(self.directory, f"{_safe_name(region)}.{kind}.f32")
+
+    def _origin(self, region, first_time=None):
+        """Grid origin for region, created at first_time (floored to the step) if new"""
+        if region in self._meta:
+            return self._meta[region]
+        path = self._meta_path(region)
+        if os.path.exists(path):
+            with open(path) as f:
+                origin = datetime.fromisoformat(json.load(f)["origin"])
+        elif first_time is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            step_seconds = self.step.total_seconds()
+            origin = datetime.utcfromtimestamp(
+                (first_time - datetime(1970, 1, 1)).total_seconds() // step_seconds * step_seconds
+            )
+            with open(path, "w") as f:
+                json.dump({"origin": origin.isoformat(), "step_seconds": step_seconds}, f)
+        else:
+            return None
+        self._meta[region] = origin
+        return origin
+
+    def _map(self, region, kind, min_length=0):
+        """Memmap for (region, kind), growing the file with NaNs to min_length slots"""
+        path = self._data_path(region, kind)
+        length = os.path.getsize(path) // 4 if os.path.exists(path) else 0
+        if min_length > length:
+            with open(path, "ab") as f:
+                f.write(np.full(min_length - length, np.nan, dtype="<f4").tobytes())
+            length = min_length
+            self._maps.pop((region, kind), None)
+        if length == 0:
+            return None
+        current = self._maps.get((region, kind))
+        if current is None or len(current) != length:
+            current = np.memmap(path, dtype="<f4", mode="r+", shape=(length,))
+            self._maps[(region, kind)] = current
+        return current
+
+    def _slot(self, origin, when):
+        return int((when - origin) // self.step)
+
+    def record(self, region, points, kind="actual"):
+        """
+        Write a {"point_time", "value"} series into the grid. Points coarser
+        than the grid step fill every slot they cover; later writes win.
+        """
+        start, step, values = forecast_to_series(points)
+        if start is None:
+            return 0
+        start = to_naive_utc(start)
+        repeat = max(1, int(step // self.step))
+        values = np.repeat(values.astype("<f4"), repeat)
+        with self._lock:
+            origin = self._origin(region, start)
+            first = self._slot(origin, start)
+            if first < 0:
+                # Points before the grid origin are not stored
+                values = values[-first:]
+                first = 0
+            if not len(values):
+                return 0
+            series = self._map(region, kind, first + len(values))
+            series[first:first + len(values)] = values
+            series.flush()
+        return len(values)
+
+    def query(self, region, start=None, end=None, kind="actual"):
+        """
+        Return (start_time, step, values) for [start, end) where values is a
+        read-only view into the memory map. Returns (None, step, empty) if the
+        region has no history.
+        """
+        with self._lock:
+            origin = self._origin(region)
+            series = self._map(region, kind) if origin is not None else None
+        if series is None:
+            return None, self.step, np.empty(0, dtype="<f4")
+        first = 0 if start is None else max(0, self._slot(origin, to_naive_utc(start)))
+        last = len(series) if end is None else min(len(series), max(first, self._slot(origin, to_naive_utc(end))))
+        view = series[first:last].view(np.ndarray)
+        view.flags.writeable = False
+        return origin + self.step * first, self.step, view
+
+    def regions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def latest_region(self):
+        """Region with the most recently written actuals, or None"""
+        latest = None
+        for region in self.regions():
+            path = self._data_path(region, "actual")
+            if os.path.exists(path) and (latest is None or os.path.getmtime(path) > latest[0]):
+                latest = (os.path.getmtime(path), region)
+        return latest[1] if latest else None
+
+    def last_time(self, region, kind="actual"):
+        """Timestamp of the last recorded (non-NaN) slot, or None"""
+        start, step, values = self.query(region, kind=kind)
+        present = np.flatnonzero(~np.isnan(values))
+        if not len(present):
+            return None
+        return start + step * int(present[-1])
+
+history_store = HistoryStore()
+
+def hour_of_day_profile(region, days=7, kind="actual", now=None):
+    """Mean intensity per UTC hour of day over the last `days` days (NaN where unknown)"""
+    now = now or datetime.utcnow()
+    start, step, values = history_store.query(region, now - timedelta(days=days), now, kind)
+    profile = np.full(24, np.nan)
+    if start is None or not len(values):
+        return profile
+    offsets = np.arange(len(values)) * step.total_seconds()
+    hours = ((start.hour * 3600 + start.minute * 60 + start.second + offsets) // 3600 % 24).astype(int)
+    valid = ~np.isnan(values)
+    sums = np.bincount(hours[valid], weights=values[valid], minlength=24)
+    counts = np.bincount(hours[valid], minlength=24)
+    np.divide(sums, counts, out=profile, where=counts > 0)
+    return profile
+
+def replay_forecast(region, horizon_hours=24, now=None):
+    """
+    Seasonal-naive forecast from recorded history: each future slot takes the
+    value recorded at the same time one day earlier (or the hour-of-day mean
+    when that is missing). Returns None when there is not enough history.
+    """
+    now = now or datetime.utcnow()
+    start, step, yesterday = history_store.query(
+        region, now - timedelta(days=1), now - timedelta(days=1) + timedelta(hours=horizon_hours)
+    )
+    if start is None or not len(yesterday):
+        return None
+    values = np.array(yesterday, dtype=np.float64)
+    missing = np.isnan(values)
+    if missing.any():
+        profile = hour_of_day_profile(region, now=now)
+        hours = np.array([(start + step * i).hour for i in range(len(values))])
+        values[missing] = profile[hours[missing]]
+    if np.isnan(values).mean() > 0.5:
+        return None
+    values = np.where(np.isnan(values), np.nanmean(values), values)
+    first = start + timedelta(days=1)
+    return [
+        {"point_time": (first + step * i).isoformat(), "value": round(float(value), 2)}
+        for i, value in enumerate(values)
+    ]
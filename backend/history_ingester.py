@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from carbon_data import get_regional_carbon_intensity, watttime_client
+from forecaster import upstream_forecast
+from history import history_store
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+HISTORY_INGEST_SECONDS = float(os.getenv("HISTORY_INGEST_SECONDS", 300))
+# How far back to fetch actuals for a region with no recorded history
+HISTORY_BACKFILL_HOURS = int(os.getenv("HISTORY_BACKFILL_HOURS", 24))
+
+def fetch_actuals(region, carbon_data, signal_type="co2_moer"):
+    """
+    Measured intensity since the last recorded slot. Simulated data has no
+    actuals, so its current value stands in as the observation for now.
+    """
+    if region.startswith("SIMULATED") or not watttime_client.has_credentials:
+        return upstream_forecast(carbon_data)[:1]
+    now = datetime.utcnow()
+    last = history_store.last_time(region)
+    start = last + history_store.step if last else now - timedelta(hours=HISTORY_BACKFILL_HOURS)
+    if start >= now:
+        return []
+    return watttime_client.get_historical(region, start, now, signal_type).get("data", [])
+
+def ingest(carbon_data):
+    """Append one fetch's forecast and actuals to the history store"""
+    region = carbon_data.get("location")
+    if not region or carbon_data.get("source") == "history":
+        # Never feed replayed history back into the store
+        return 0
+    written = history_store.record(region, upstream_forecast(carbon_data), kind="forecast")
+    written += history_store.record(region, fetch_actuals(region, carbon_data), kind="actual")
+    return written
+
+async def run_history_ingester(interval=HISTORY_INGEST_SECONDS):
+    """Record every candidate region's forecast and actuals every interval seconds"""
+    while True:
+        try:
+            for carbon_data in await get_regional_carbon_intensity():
+                await asyncio.to_thread(ingest, carbon_data)
+        except Exception as e:
+            logger.warning("Error ingesting carbon intensity history: %s", e)
+        await asyncio.sleep(interval)
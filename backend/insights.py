@@ -1,27 +1,49 @@
 # backend/insights.py
+import logging
 import os
-import json
-import requests
-from openai import OpenAI
+import aiohttp
 from dotenv import load_dotenv
+from providers import get_http_session, PERPLEXITY_TIMEOUT_SECONDS
+from cache import TTLCache
+from metrics import register_cache
 load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
+# Overridable so the backend can point at a local stand-in (see mock_providers.py)
+PERPLEXITY_BASE_URL = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai")
+PERPLEXITY_CHAT_URL = f"{PERPLEXITY_BASE_URL}/chat/completions"
+
+# Insights are generic per task category and region, so cache them by that
+INSIGHTS_CACHE_SIZE = int(os.getenv("INSIGHTS_CACHE_SIZE", 256))
+INSIGHTS_CACHE_TTL_SECONDS = int(os.getenv("INSIGHTS_CACHE_TTL_SECONDS", 6 * 60 * 60))
+insights_cache = TTLCache(INSIGHTS_CACHE_SIZE, INSIGHTS_CACHE_TTL_SECONDS)
+register_cache("insights", insights_cache)
+
+# None until verify_perplexity_access() has run at startup
+perplexity_verified = None
+
 def debug_env_vars():
-    """Debug function to check environment variables"""
-    perplexity_key = os.getenv("PERPLEXITY_API_KEY")
-    groq_key = os.getenv("GROQ_API_KEY")
-    watttime_user = os.getenv("WATTTIME_USERNAME")
-    watttime_pass = os.getenv("WATTTIME_PASSWORD")
-    
-    print("\nEnvironment Variables Status:")
-    print(f"PERPLEXITY_API_KEY present: {bool(perplexity_key)}")
-    print(f"GROQ_API_KEY present: {bool(groq_key)}")
-    print(f"WATTTIME_USERNAME present: {bool(watttime_user)}")
-    print(f"WATTTIME_PASSWORD present: {bool(watttime_pass)}")
-    
-    if perplexity_key:
-        print(f"Perplexity key length: {len(perplexity_key)}")
-        print(f"Perplexity key starts with: {perplexity_key[:10]}...")
+    """Log which provider credentials are configured (never their values)"""
+    logger.info("Provider credentials configured", extra={
+        name.lower(): bool(os.getenv(name))
+        for name in ("PERPLEXITY_API_KEY", "GROQ_API_KEY", "WATTTIME_USERNAME", "WATTTIME_PASSWORD")
+    })
+
+def classify_task(task):
+    """Classify a task as compute-, IO- or general-purpose from its name"""
+    task_type = task.task_name.lower()
+    if any(word in task_type for word in ['training', 'processing', 'analysis', 'compute']):
+        return "compute"
+    if any(word in task_type for word in ['backup', 'transfer', 'download', 'upload']):
+        return "io"
+    return "general"
+
+def insights_cache_key(task, carbon_data):
+    return (classify_task(task), carbon_data.get('location', 'Unknown'))
+
+def get_cached_insights(task, carbon_data):
+    return insights_cache.get(insights_cache_key(task, carbon_data))
 
 def get_fallback_insights(task, carbon_data):
     """Generate fallback insights when API is unavailable"""
@@ -31,19 +53,17 @@ def get_fallback_insights(task, carbon_data):
     intensity = carbon_data['carbon_intensity']
     unit = carbon_data.get('unit', 'gCO2/kWh')
     
-    # Determine task category
-    compute_intensive = any(word in task_type for word in ['training', 'processing', 'analysis', 'compute'])
-    io_intensive = any(word in task_type for word in ['backup', 'transfer', 'download', 'upload'])
+    category = classify_task(task)
     
     base_insights = f"""Current grid carbon intensity is {intensity} {unit}. Based on your {duration}-hour {task_type} task with {resource_profile} resource profile, here are key optimization insights:
 
 """
     
-    if compute_intensive:
+    if category == "compute":
         base_insights += """• Consider implementing dynamic voltage and frequency scaling (DVFS) to optimize power consumption while maintaining performance targets. This typically yields 15-30% energy savings.
 • Batch processing and workload consolidation can improve resource utilization and reduce idle power consumption.
 • Monitor and adjust CPU/GPU clock speeds based on workload demands."""
-    elif io_intensive:
+    elif category == "io":
         base_insights += """• Schedule data transfers during periods of lower grid carbon intensity to minimize environmental impact.
 • Implement data compression to reduce transfer volumes and storage requirements.
 • Consider using local caching and incremental processing where applicable."""
@@ -54,13 +74,8 @@ def get_fallback_insights(task, carbon_data):
         
     return base_insights
 
-def get_insights(task, carbon_data):
-    """
-    Generate insights using Perplexity API with fallback to local generation.
-    """
-    # Debug environment variables
-    debug_env_vars()
-    
+def build_insights_messages(task, carbon_data):
+    """Chat messages asking Perplexity for optimization insights"""
     prompt = f"""
     Task Analysis Request:
     - Task Name: {task.task_name}
@@ -93,84 +108,77 @@ Keep each paragraph focused and concise. Use technical language but remain clear
             "content": prompt
         }
     ]
+    return messages
 
-    # Try to use Perplexity API if available
+async def verify_perplexity_access():
+    """
+    One-off startup probe that checks the Perplexity key with a tiny request.
+    The result gates every later insights call, so requests never pay for it.
+    """
+    global perplexity_verified
+    debug_env_vars()
     perplexity_key = os.getenv("PERPLEXITY_API_KEY")
     if not perplexity_key:
-        print("\nNo Perplexity API key found in environment")
-        return get_fallback_insights(task, carbon_data)
+        perplexity_verified = False
+        return perplexity_verified
 
     try:
-        print("\nAttempting to call Perplexity API...")
-        
-        # First try a direct API call to verify the key
-        verify_url = "https://api.perplexity.ai/chat/completions"
-        headers = {
+        async with get_http_session().post(
+            PERPLEXITY_CHAT_URL,
+            headers={
+                "Authorization": f"Bearer {perplexity_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": "sonar-pro-2",
+                "messages": [{"role": "user", "content": "Hello"}],
+                "max_tokens": 5
+            },
+            timeout=aiohttp.ClientTimeout(total=PERPLEXITY_TIMEOUT_SECONDS)
+        ) as response:
+            logger.info("Perplexity verification finished", extra={"status": response.status})
+            perplexity_verified = response.status == 200
+    except Exception as e:
+        logger.warning("Perplexity verification failed: %s", e)
+        perplexity_verified = False
+    return perplexity_verified
+
+async def get_insights_async(task, carbon_data):
+    """
+    Insights from Perplexity using the shared aiohttp session, with local
+    fallback insights when no key is configured or verification failed.
+    Upstream errors propagate so the caller can apply its own deadline and fallback.
+    """
+    cached = get_cached_insights(task, carbon_data)
+    if cached:
+        return cached
+
+    perplexity_key = os.getenv("PERPLEXITY_API_KEY")
+    if not perplexity_key or perplexity_verified is False:
+        return get_fallback_insights(task, carbon_data)
+
+    async with get_http_session().post(
+        PERPLEXITY_CHAT_URL,
+        headers={
             "Authorization": f"Bearer {perplexity_key}",
             "Content-Type": "application/json"
-        }
-        
-        # Simple test request
-        test_data = {
+        },
+        json={
             "model": "sonar-pro-2",
-            "messages": [{"role": "user", "content": "Hello"}],
-            "max_tokens": 5
+            "messages": build_insights_messages(task, carbon_data),
+            "temperature": 0.4,
+            "max_tokens": 300
         }
-        
-        print("\nTesting API connection...")
-        try:
-            test_response = requests.post(verify_url, headers=headers, json=test_data)
-            print(f"Test API Status: {test_response.status_code}")
-            print(f"Test API Response: {test_response.text[:200]}")
-        except Exception as e:
-            print(f"Test API call failed: {str(e)}")
-            return get_fallback_insights(task, carbon_data)
-
-        if test_response.status_code != 200:
-            print(f"API test failed with status {test_response.status_code}")
-            return get_fallback_insights(task, carbon_data)
-
-        print("\nAPI test successful, making main API call...")
-        
-        # Make the actual API call
-        try:
-            response = requests.post(
-                verify_url,
-                headers=headers,
-                json={
-                    "model": "sonar-pro-2",
-                    "messages": messages,
-                    "temperature": 0.4,
-                    "max_tokens": 300
-                },
-                timeout=30
-            )
-            
-            print(f"\nAPI Response Status: {response.status_code}")
-            if response.status_code == 200:
-                result = response.json()
-                insights = result['choices'][0]['message']['content'].strip()
-                if insights:
-                    print("Successfully received insights from API")
-                    return insights
-                else:
-                    print("Received empty insights from API")
-            else:
-                print(f"API error: {response.text}")
-                
-        except Exception as e:
-            print(f"\nAPI call failed: {str(e)}")
-            if hasattr(e, 'response'):
-                print(f"Response status: {e.response.status_code}")
-                print(f"Response body: {e.response.text}")
-            return get_fallback_insights(task, carbon_data)
+    ) as response:
+        # Raise so the caller's breaker counts the failure and falls back
+        response.raise_for_status()
+        result = await response.json()
 
-    except Exception as e:
-        print(f"\nUnexpected error: {str(e)}")
+    insights = result['choices'][0]['message']['content'].strip()
+    if not insights:
         return get_fallback_insights(task, carbon_data)
-
-    print("\nFalling back to local insights generation")
-    return get_fallback_insights(task, carbon_data)
+    insights_cache.set(insights_cache_key(task, carbon_data), insights)
+    return insights
 
 # # Test function
 # if __name__ == "__main__":
@@ -189,7 +197,7 @@ Keep each paragraph focused and concise. Use technical language but remain clear
 #     }
     
 #     # Test the get_insights function
-#     insights = get_insights(test_task, test_carbon_data)
+#     insights = asyncio.run(get_insights_async(test_task, test_carbon_data))
 #     print("\nTest Results:")
 #     print("Task:", test_task.task_name)
 #     print("Duration:", test_task.duration_hours, "hours")
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from types import SimpleNamespace
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, update
+from events import broadcaster
+from insights import get_insights_async, get_fallback_insights, verify_perplexity_access
+from metrics import schedule_stage_seconds
+from models import Job, SessionLocal
+from providers import call_with_fallback, get_breaker, PERPLEXITY_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INSIGHTS_WORKERS = int(os.getenv("INSIGHTS_WORKERS", 2))
+INSIGHTS_QUEUE_SIZE = int(os.getenv("INSIGHTS_QUEUE_SIZE", 1000))
+
+def store_insights(job_id, insights):
+    """Write generated insights into Job.results"""
+    table = Job.__table__
+    db = SessionLocal()
+    try:
+        stored = db.execute(
+            update(table).where(table.c.id == job_id).values(
+                # Merged in SQL so concurrent writes to other results keys are kept
+                results=func.json_set(
+                    func.coalesce(table.c.results, "{}"),
+                    "$.insights", func.json(json.dumps(insights, default=str)),
+                    "$.insights_status", "ready"
+                ),
+                updated_at=datetime.utcnow()
+            )
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    if stored:
+        broadcaster.publish("job.updated", {"id": job_id, "insights_status": "ready"})
+
+class InsightsWorker:
+    """
+    Background stage that generates insights for stored jobs.
+
+    /api/schedule enqueues (job_id, task, carbon_data) and returns at once;
+    workers call Perplexity (with deadline and local fallback) and write the
+    result into Job.results["insights"].
+    """
+
+    def __init__(self, workers=INSIGHTS_WORKERS, queue_size=INSIGHTS_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self._tasks = []
+        self._verification = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # Verify the Perplexity key once; workers wait for it before their first call
+        self._verification = asyncio.create_task(verify_perplexity_access())
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        await run_in_threadpool(self._requeue_pending)
+
+    async def stop(self):
+        for task in self._tasks + [self._verification]:
+            if task:
+                task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, job_id, task, carbon_data):
+        """Queue insights generation; returns False if the worker is not accepting work"""
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait((job_id, task, carbon_data))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _requeue_pending(self):
+        """Pick up jobs whose insights were still pending when the server stopped"""
+        db = SessionLocal()
+        try:
+            pending = db.query(Job.id, Job.parameters).filter(
+                Job.results["insights_status"].as_string() == "pending"
+            ).all()
+        finally:
+            db.close()
+        for job_id, parameters in pending:
+            parameters = parameters or {}
+            if "task" in parameters and "carbon_data" in parameters:
+                self.enqueue(job_id, SimpleNamespace(**parameters["task"]), parameters["carbon_data"])
+
+    async def _run(self):
+        await asyncio.shield(self._verification)
+        while True:
+            job_id, task, carbon_data = await self.queue.get()
+            try:
+                with schedule_stage_seconds.time("insights_generation"):
+                    insights = await call_with_fallback(
+                        "Perplexity",
+                        get_insights_async(task, carbon_data),
+                        PERPLEXITY_TIMEOUT_SECONDS,
+                        lambda: get_fallback_insights(task, carbon_data),
+                        breaker=get_breaker("Perplexity")
+                    )
+                await run_in_threadpool(store_insights, job_id, insights)
+            except Exception as e:
+                logger.exception("Error generating insights for job %s: %s", job_id, e)
+            finally:
+                self.queue.task_done()
+
+insights_worker = InsightsWorker()
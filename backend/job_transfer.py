@@ -0,0 +1,231 @@
+import enum
+import json
+import logging
+import math
+import os
+import zlib
+from datetime import datetime
+from sqlalchemy import JSON, DateTime, Enum, Float, Integer, String, select
+from models import ForecastSnapshot, Job, JobSegment, JobStatus, SessionLocal
+from optimizer import parse_point_time, to_naive_utc
+from rollups import record_jobs_created
+
+logger = logging.getLogger(__name__)
+
+# Job history as NDJSON: one job per line with every jobs column plus its
+# segments. Export streams from a server-side cursor and import inserts in
+# chunked transactions, so neither holds more than one chunk in memory.
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))
+# Per-line import errors reported back; later ones are only counted
+IMPORT_MAX_ERRORS = 20
+
+JOB_COLUMNS = list(Job.__table__.c)
+# Leases belong to the exporting deployment's workers, never to the importer's
+LEASE_FIELDS = {"worker_id", "lease_expires_at"}
+# Fields the job listing and detail responses require
+REQUIRED_FIELDS = ("task_name", "duration_hours", "resource_usage")
+# Snapshot ids are local to a database, so exports also carry the snapshot's
+# content_hash and imports resolve it to whichever local snapshot has it
+SNAPSHOT_HASH_FIELD = "forecast_snapshot_hash"
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def export_lines(filters=(), batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield NDJSON bytes for the jobs matching filters, oldest first, one
+    chunk per batch_size rows. Runs its own session so it can outlive the
+    request's, and reads through yield_per so memory stays flat.
+    """
+    db = SessionLocal()
+    try:
+        query = select(*JOB_COLUMNS, ForecastSnapshot.content_hash.label(SNAPSHOT_HASH_FIELD)).outerjoin(
+            ForecastSnapshot, ForecastSnapshot.id == Job.forecast_snapshot_id
+        ).where(*filters).order_by(Job.created_at, Job.id)
+        result = db.execute(query.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            segments = {}
+            for job_id, start_time, end_time, expected_intensity in db.execute(
+                select(JobSegment.job_id, JobSegment.start_time, JobSegment.end_time, JobSegment.expected_intensity).where(
+                    JobSegment.job_id.in_([row.id for row in rows])
+                ).order_by(JobSegment.job_id, JobSegment.seq)
+            ):
+                segments.setdefault(job_id, []).append(
+                    {"start_time": start_time, "end_time": end_time, "expected_intensity": expected_intensity}
+                )
+            yield "".join(
+                json.dumps({**row._mapping, "segments": segments.get(row.id, [])}, default=_json_default) + "\n"
+                for row in rows
+            ).encode()
+    finally:
+        db.close()
+
+def gzip_lines(chunks):
+    """Gzip a byte stream incrementally"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+async def iter_lines(body):
+    """
+    Split an async byte stream into lines, gunzipping it first when it
+    starts with the gzip magic number.
+    """
+    decompressor = None
+    pending = b""
+    first = True
+    async for chunk in body:
+        if first and chunk:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(wbits=31)
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if decompressor:
+        pending += decompressor.flush()
+    if pending:
+        yield pending
+
+def _parse_time(name, value):
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be an ISO 8601 string")
+    try:
+        return to_naive_utc(parse_point_time(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} is not a valid ISO 8601 time: {value!r}")
+
+def _parse_float(name, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return float(value)
+
+def _coerce(column, value):
+    """value converted to column's type; raises ValueError when it does not fit"""
+    name, column_type = column.name, column.type
+    if isinstance(column_type, Enum):
+        try:
+            return JobStatus(str(value).lower())
+        except ValueError:
+            raise ValueError(f"{name} must be one of {', '.join(status.value for status in JobStatus)}")
+    if isinstance(column_type, DateTime):
+        return _parse_time(name, value)
+    if isinstance(column_type, Integer):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{name} must be an integer")
+        return value
+    if isinstance(column_type, Float):
+        return _parse_float(name, value)
+    if isinstance(column_type, String):
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+        if column_type.length and len(value) > column_type.length:
+            raise ValueError(f"{name} is longer than {column_type.length} characters")
+        return value
+    if isinstance(column_type, JSON):
+        if not isinstance(value, dict):
+            raise ValueError(f"{name} must be a JSON object")
+        return value
+    return value
+
+def parse_job(line):
+    """
+    Job field dict (plus "segments" and the snapshot hash) from one NDJSON
+    line, with every value checked against its column; raises ValueError
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("each line must be a JSON object")
+    fields = {
+        column.name: None if record[column.name] is None else _coerce(column, record[column.name])
+        for column in JOB_COLUMNS
+        if column.name in record and column.name not in LEASE_FIELDS
+    }
+    for name in REQUIRED_FIELDS:
+        if fields.get(name) is None:
+            raise ValueError(f"missing {name}")
+    if fields["duration_hours"] <= 0:
+        raise ValueError("duration_hours must be positive")
+    snapshot_hash = record.get(SNAPSHOT_HASH_FIELD)
+    if snapshot_hash is not None and not isinstance(snapshot_hash, str):
+        raise ValueError(f"{SNAPSHOT_HASH_FIELD} must be a string")
+    fields[SNAPSHOT_HASH_FIELD] = snapshot_hash
+    segments = record.get("segments") or []
+    if not isinstance(segments, list) or not all(isinstance(segment, dict) for segment in segments):
+        raise ValueError("segments must be a list of JSON objects")
+    fields["segments"] = []
+    for segment in segments:
+        start_time = _parse_time("segments.start_time", segment.get("start_time"))
+        end_time = _parse_time("segments.end_time", segment.get("end_time"))
+        if end_time <= start_time:
+            raise ValueError("segments.end_time must be after start_time")
+        expected_intensity = segment.get("expected_intensity")
+        fields["segments"].append({
+            "start_time": start_time,
+            "end_time": end_time,
+            "expected_intensity": None if expected_intensity is None else _parse_float(
+                "segments.expected_intensity", expected_intensity
+            )
+        })
+    return fields
+
+def import_chunk(records, keep_ids=False):
+    """
+    Insert parsed job records in one transaction and update the rollups.
+    With keep_ids, rows whose id already exists (or repeats in the chunk)
+    are skipped; otherwise new ids are assigned. Snapshots are matched by
+    content hash, and dropped when no local snapshot has it. RUNNING jobs
+    come in PENDING, since no worker here holds them.
+    Returns (inserted jobs as (id, scheduled_time, resource_usage, status), skipped).
+    """
+    db = SessionLocal()
+    try:
+        existing = set()
+        if keep_ids:
+            ids = [record["id"] for record in records if record.get("id") is not None]
+            existing = {job_id for (job_id,) in db.query(Job.id).filter(Job.id.in_(ids))}
+        hashes = {record[SNAPSHOT_HASH_FIELD] for record in records} - {None}
+        snapshots = dict(
+            db.query(ForecastSnapshot.content_hash, ForecastSnapshot.id).filter(ForecastSnapshot.content_hash.in_(hashes))
+        ) if hashes else {}
+
+        jobs = []
+        for record in records:
+            fields = dict(record)
+            segments = fields.pop("segments")
+            if not keep_ids:
+                fields.pop("id", None)
+            elif fields.get("id") in existing:
+                continue
+            elif fields.get("id") is not None:
+                existing.add(fields["id"])
+            fields["forecast_snapshot_id"] = snapshots.get(fields.pop(SNAPSHOT_HASH_FIELD))
+            if fields.get("status") == JobStatus.RUNNING:
+                fields["status"] = JobStatus.PENDING
+                fields["start_time"] = None
+            fields["status"] = fields.get("status") or JobStatus.PENDING
+            fields["created_at"] = fields.get("created_at") or datetime.utcnow()
+            jobs.append(Job(**fields, segments=[JobSegment(seq=seq, **segment) for seq, segment in enumerate(segments)]))
+        db.add_all(jobs)
+        db.flush()
+        record_jobs_created(db, jobs)
+        inserted = [(job.id, job.scheduled_time, job.resource_usage, job.status) for job in jobs]
+        db.commit()
+        return inserted, len(records) - len(jobs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
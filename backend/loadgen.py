@@ -0,0 +1,96 @@
+"""
+Open-loop load generator for the scheduling API.
+
+    python loadgen.py --url http://localhost:8000 --rps 50 --duration 30
+
+Requests are issued on a fixed schedule at the target rate whether or not
+earlier ones have finished, so a slow server shows up as latency rather than
+as a lower offered load. Prints p50/p95/p99 latency, achieved throughput and
+status counts; --json writes the same report to a file.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+import aiohttp
+import numpy as np
+
+RESOURCE_USAGE = ("low", "medium", "high")
+
+def make_task(rng):
+    return {
+        "task_name": f"load-test-{rng.randrange(1000)}",
+        "duration_hours": rng.choice([0.5, 1, 2, 4, 8]),
+        "resource_usage": rng.choice(RESOURCE_USAGE)
+    }
+
+async def fire(session, url, payload, results):
+    started = time.perf_counter()
+    try:
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            status = response.status
+    except Exception as e:
+        status = type(e).__name__
+    results.append((time.perf_counter() - started, status))
+
+async def run(url, rps, duration, seed, timeout, endpoint):
+    rng = random.Random(seed)
+    results = []
+    tasks = []
+    interval = 1.0 / rps
+    total = int(rps * duration)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        for index in range(total):
+            # Sleep until this request's slot on the fixed schedule
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire(session, f"{url}{endpoint}", make_task(rng), results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return report(results, elapsed, rps)
+
+def report(results, elapsed, target_rps):
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    statuses = Counter(str(status) for _, status in results)
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    percentiles = np.percentile(latencies, [50, 95, 99]) if len(latencies) else [0, 0, 0]
+    return {
+        "requests": len(results),
+        "target_rps": target_rps,
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0,
+        "success_rps": round(ok / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(float(percentiles[0]), 2),
+            "p95": round(float(percentiles[1]), 2),
+            "p99": round(float(percentiles[2]), 2),
+            "max": round(float(latencies.max()), 2) if len(latencies) else 0
+        },
+        "status_counts": dict(statuses),
+        "elapsed_seconds": round(elapsed, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/api/schedule")
+    parser.add_argument("--rps", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.url, args.rps, args.duration, args.seed, args.timeout, args.endpoint))
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,26 @@
+from logging_config import configure_logging
+configure_logging()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from api import router
+from providers import close_http_session
+from insights_worker import insights_worker
+from models import init_db
+from dispatcher import dispatcher, DISPATCHER_ENABLED
+from events import broadcaster, publish_intensity_ticks
+from carbon_data import get_carbon_intensity_async
+from history_ingester import run_history_ingester, HISTORY_ENABLED
+from forecaster import forecaster, FORECASTER_ENABLED
+from replanner import replanner, REPLAN_ENABLED
+from metrics import render as render_metrics
+import asyncio
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 # Configure CORS
@@ -31,10 +49,40 @@ app.add_middleware(
 # Mount the API router
 app.include_router(router, prefix="/api")
 
+@app.on_event("startup")
+async def startup():
+    broadcaster.bind(asyncio.get_running_loop())
+    applied = init_db()
+    if applied:
+        logger.info("Applied database migrations: %s", applied)
+    await insights_worker.start()
+    if DISPATCHER_ENABLED:
+        await dispatcher.start()
+    app.state.intensity_ticks = asyncio.create_task(publish_intensity_ticks(get_carbon_intensity_async))
+    app.state.history_ingester = asyncio.create_task(run_history_ingester()) if HISTORY_ENABLED else None
+    app.state.forecaster = asyncio.create_task(forecaster.run()) if FORECASTER_ENABLED else None
+    app.state.replanner = asyncio.create_task(replanner.run()) if REPLAN_ENABLED else None
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.intensity_ticks.cancel()
+    for task in (app.state.history_ingester, app.state.forecaster, app.state.replanner):
+        if task:
+            task.cancel()
+    forecaster.shutdown()
+    await dispatcher.stop()
+    await insights_worker.stop()
+    await close_http_session()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Carbon-Aware AI Job Scheduler API"}
 
+@app.get("/metrics")
+def metrics():
+    """Per-stage latencies, upstream errors and cache hit rates for Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics: counters, histograms and callback
+# gauges rendered in the text exposition format by GET /metrics.
+# Kept dependency-free; every update is a dict lookup under one lock.
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_metrics = []
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels_text(self.labels, key)} {value}" for key, value in items]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, *label_values, value):
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - started)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = sorted((key, (list(counts), count, total)) for key, (counts, count, total) in self._series.items())
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels_text(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels_text(self.labels + ('le',), key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {count}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {total}")
+        return lines
+
+class Gauge:
+    """Metric whose samples come from a callback returning {label_values: value}"""
+
+    def __init__(self, name, help_text, labels, collect, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.kind = kind
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_labels_text(self.labels, key)} {value}" for key, value in sorted(self.collect().items())]
+        return lines
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+schedule_stage_seconds = Histogram(
+    "schedule_stage_seconds",
+    "Time spent in each stage of scheduling a task",
+    labels=("stage",)
+)
+upstream_errors_total = Counter(
+    "upstream_errors_total",
+    "Failed or timed-out calls to external providers",
+    labels=("provider", "kind")
+)
+fallbacks_total = Counter(
+    "fallbacks_total",
+    "Responses served by a local fallback instead of the provider",
+    labels=("provider",)
+)
+short_circuits_total = Counter(
+    "short_circuits_total",
+    "Provider calls skipped because the circuit breaker was open",
+    labels=("provider",)
+)
+hedged_total = Counter(
+    "hedged_total",
+    "Responses served by the fallback because the provider missed its hedge budget",
+    labels=("provider",)
+)
+replans_total = Counter(
+    "replans_total",
+    "Pending jobs moved by the re-planner after a forecast update",
+    labels=("reason",)
+)
+
+# Caches report their own hit/miss counters; see register_cache
+_caches = {}
+
+def register_cache(name, cache):
+    """Expose cache.hits / cache.misses under cache_hits_total{cache=name} etc."""
+    _caches[name] = cache
+
+Gauge("cache_hits_total", "Cache lookups that found a live entry", ("cache",),
+      lambda: {(name,): cache.hits for name, cache in _caches.items()}, kind="counter")
+Gauge("cache_misses_total", "Cache lookups that found nothing usable", ("cache",),
+      lambda: {(name,): cache.misses for name, cache in _caches.items()}, kind="counter")
+Gauge("cache_hit_ratio", "hits / (hits + misses) since start", ("cache",),
+      lambda: {
+          (name,): round(cache.hits / (cache.hits + cache.misses), 4)
+          for name, cache in _caches.items() if cache.hits + cache.misses
+      })
+
+_breakers = {}
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def register_breaker(name, breaker):
+    """Expose breaker.state as circuit_breaker_state{provider=name}"""
+    _breakers[name] = breaker
+
+Gauge("circuit_breaker_state", "0 closed, 1 half-open, 2 open", ("provider",),
+      lambda: {(name,): BREAKER_STATES[breaker.state] for name, breaker in _breakers.items()})
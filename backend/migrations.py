@@ -0,0 +1,168 @@
+import importlib
+from datetime import datetime
+from sqlalchemy import inspect
+
+# Versioned schema migrations for the job store.
+# Each entry is (version, description, steps); a step is a SQL string or a
+# callable taking the connection. Applied versions are recorded in
+# schema_migrations, so every step runs exactly once per database.
+
+def add_column(table, column, ddl):
+    """Step that adds a column unless it already exists"""
+    def step(conn):
+        existing = {col["name"] for col in inspect(conn).get_columns(table)}
+        if column not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return step
+
+def backfill(module, function):
+    """Step that calls module.function(conn), imported lazily to avoid import cycles"""
+    def step(conn):
+        getattr(importlib.import_module(module), function)(conn)
+    return step
+
+MIGRATIONS = [
+    (1, "baseline jobs table", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER NOT NULL,
+            task_name VARCHAR(255),
+            status VARCHAR(9),
+            duration_hours FLOAT,
+            resource_usage VARCHAR(50),
+            scheduled_time DATETIME,
+            start_time DATETIME,
+            completion_time DATETIME,
+            carbon_intensity FLOAT,
+            carbon_saved FLOAT,
+            parameters JSON,
+            results JSON,
+            created_at DATETIME,
+            updated_at DATETIME,
+            PRIMARY KEY (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_jobs_id ON jobs (id)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_task_name ON jobs (task_name)",
+    ]),
+    (2, "secondary indexes for listing and dispatch", [
+        "CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_created_at ON jobs (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_status_scheduled_time ON jobs (status, scheduled_time)",
+    ]),
+    (3, "deduplicated forecast snapshots", [
+        """
+        CREATE TABLE IF NOT EXISTS forecast_snapshots (
+            id INTEGER NOT NULL,
+            region VARCHAR(64),
+            signal_type VARCHAR(32),
+            unit VARCHAR(32),
+            generated_at DATETIME,
+            start_time DATETIME,
+            step_seconds INTEGER,
+            point_count INTEGER,
+            "values" BLOB,
+            content_hash VARCHAR(64),
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (content_hash)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_forecast_snapshots_region_generated_at ON forecast_snapshots (region, generated_at)",
+        add_column("jobs", "forecast_snapshot_id", "INTEGER REFERENCES forecast_snapshots (id)"),
+        "CREATE INDEX IF NOT EXISTS ix_jobs_forecast_snapshot_id ON jobs (forecast_snapshot_id)",
+    ]),
+    (4, "incrementally maintained analytics rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS analytics_rollups (
+            bucket_kind VARCHAR(8) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            resource_usage VARCHAR(50) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            job_count INTEGER,
+            carbon_saved FLOAT,
+            money_saved FLOAT,
+            intensity_sum FLOAT,
+            baseline_intensity_sum FLOAT,
+            PRIMARY KEY (bucket_kind, bucket_start, resource_usage, status)
+        )
+        """,
+        # Filled by the rebuild in migration 11, once every metric column exists
+    ]),
+    (5, "grid region per job", [
+        add_column("jobs", "region", "VARCHAR(64)"),
+        "UPDATE jobs SET region = json_extract(parameters, '$.carbon_data.location') WHERE region IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_region ON jobs (region)",
+    ]),
+    (6, "run segments for interruptible jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS job_segments (
+            id INTEGER NOT NULL,
+            job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            start_time DATETIME,
+            end_time DATETIME,
+            expected_intensity FLOAT,
+            PRIMARY KEY (id),
+            UNIQUE (job_id, seq)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_job_segments_start_time ON job_segments (start_time)",
+    ]),
+    (7, "planned intensity per job for re-planning", [
+        add_column("jobs", "expected_intensity", "FLOAT"),
+        "UPDATE jobs SET expected_intensity = json_extract(parameters, '$.recommendation.expected_intensity') WHERE expected_intensity IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_region_status_expected_intensity ON jobs (region, status, expected_intensity)",
+    ]),
+    (8, "dispatch leases for multi-process workers", [
+        add_column("jobs", "worker_id", "VARCHAR(128)"),
+        add_column("jobs", "lease_expires_at", "DATETIME"),
+        "CREATE INDEX IF NOT EXISTS ix_jobs_status_lease_expires_at ON jobs (status, lease_expires_at)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_worker_id ON jobs (worker_id)",
+    ]),
+    (9, "per-segment dispatch of interruptible jobs", [
+        add_column("job_segments", "completed_at", "DATETIME"),
+    ]),
+    (10, "requeue running jobs that predate dispatch leases", [
+        # Only expired leases are reclaimed at runtime, so rows that never had
+        # one (and are not parked between segments) are put back to PENDING here
+        """
+        UPDATE jobs SET status = 'PENDING', start_time = NULL
+        WHERE status = 'RUNNING' AND worker_id IS NULL AND lease_expires_at IS NULL
+        AND id NOT IN (SELECT job_id FROM job_segments WHERE completed_at IS NOT NULL)
+        """,
+        # Rollups follow the requeue in the rebuild of migration 11
+    ]),
+    (11, "count jobs with an intensity in analytics rollups", [
+        add_column("analytics_rollups", "intensity_count", "INTEGER DEFAULT 0"),
+        add_column("analytics_rollups", "baseline_intensity_count", "INTEGER DEFAULT 0"),
+        backfill("rollups", "rebuild_rollups"),
+    ]),
+]
+
+def run_migrations(engine):
+    """Apply any migrations this database has not seen yet; returns the versions applied"""
+    applied_now = []
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER NOT NULL PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at DATETIME
+            )
+        """)
+        applied = {row[0] for row in conn.exec_driver_sql("SELECT version FROM schema_migrations")}
+        for version, description, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.exec_driver_sql(step)
+            conn.exec_driver_sql(
+                "INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.utcnow().isoformat())
+            )
+            applied_now.append(version)
+    return applied_now
@@ -0,0 +1,180 @@
+"""
+Local stand-in for the WattTime, Groq and Perplexity APIs, for load tests.
+
+Run it and point the backend at it:
+
+    python mock_providers.py            # listens on MOCK_PORT (default 9000)
+
+    WATTTIME_BASE_URL=http://localhost:9000
+    WATTTIME_USERNAME=mock WATTTIME_PASSWORD=mock
+    GROQ_BASE_URL=http://localhost:9000 GROQ_API_KEY=mock
+    PERPLEXITY_BASE_URL=http://localhost:9000 PERPLEXITY_API_KEY=mock
+
+Data is seeded (MOCK_SEED), so the same region and time slot always get the
+same forecast. Latency and failures are injected per provider:
+MOCK_<PROVIDER>_LATENCY_MS, MOCK_<PROVIDER>_JITTER_MS and
+MOCK_<PROVIDER>_ERROR_RATE, where PROVIDER is WATTTIME, GROQ or PERPLEXITY,
+with MOCK_LATENCY_MS / MOCK_JITTER_MS / MOCK_ERROR_RATE as defaults.
+POST /_mock/config changes these at runtime.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, HTTPException, Request
+from carbon_data import generate_simulated_data
+
+MOCK_PORT = int(os.getenv("MOCK_PORT", 9000))
+MOCK_SEED = int(os.getenv("MOCK_SEED", 42))
+MOCK_REGION = os.getenv("MOCK_REGION", "CAISO_NORTH")
+# WattTime forecasts are 5-minute points covering 24 hours
+MOCK_FORECAST_POINTS = int(os.getenv("MOCK_FORECAST_POINTS", 288))
+MOCK_FORECAST_STEP_MINUTES = int(os.getenv("MOCK_FORECAST_STEP_MINUTES", 5))
+
+PROVIDERS = ("watttime", "groq", "perplexity")
+
+def _provider_setting(provider, name, default):
+    return float(os.getenv(f"MOCK_{provider.upper()}_{name}", os.getenv(f"MOCK_{name}", default)))
+
+faults = {
+    provider: {
+        "latency_ms": _provider_setting(provider, "LATENCY_MS", 0),
+        "jitter_ms": _provider_setting(provider, "JITTER_MS", 0),
+        "error_rate": _provider_setting(provider, "ERROR_RATE", 0)
+    }
+    for provider in PROVIDERS
+}
+# Seeded so a given request sequence sees the same latencies and failures
+fault_rng = random.Random(MOCK_SEED)
+counters = {provider: {"requests": 0, "errors": 0} for provider in PROVIDERS}
+
+app = FastAPI()
+
+async def inject(provider):
+    """Apply the provider's configured latency and maybe fail the request"""
+    settings = faults[provider]
+    counters[provider]["requests"] += 1
+    delay = settings["latency_ms"] + fault_rng.uniform(-1, 1) * settings["jitter_ms"]
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if fault_rng.random() < settings["error_rate"]:
+        counters[provider]["errors"] += 1
+        raise HTTPException(status_code=503, detail=f"Injected {provider} failure")
+
+def mock_forecast(region, now=None):
+    """Seeded forecast for region, stable within one forecast step"""
+    now = now or datetime.now(timezone.utc)
+    step_seconds = MOCK_FORECAST_STEP_MINUTES * 60
+    start = datetime.fromtimestamp(now.timestamp() // step_seconds * step_seconds, timezone.utc)
+    return generate_simulated_data(
+        region, MOCK_FORECAST_POINTS, MOCK_FORECAST_STEP_MINUTES, seed=MOCK_SEED, start_time=start
+    )
+
+def chat_completion(content):
+    """OpenAI-style chat completion body, the shape Groq and Perplexity both return"""
+    return {
+        "id": f"mock-{fault_rng.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(datetime.now(timezone.utc).timestamp()),
+        "model": "mock",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+@app.get("/login")
+async def login():
+    await inject("watttime")
+    return {"token": "mock-token"}
+
+@app.get("/v3/my-access")
+async def my_access():
+    await inject("watttime")
+    return {"signal_types": [{"signal_type": "co2_moer", "regions": [{"region": MOCK_REGION}]}]}
+
+@app.get("/v3/region-from-loc")
+async def region_from_loc(latitude: str, longitude: str, signal_type: str = "co2_moer"):
+    await inject("watttime")
+    return {"region": MOCK_REGION, "region_full_name": f"Mock {MOCK_REGION}", "signal_type": signal_type}
+
+@app.get("/v3/forecast")
+async def forecast(region: str, signal_type: str = "co2_moer"):
+    await inject("watttime")
+    data = mock_forecast(region)
+    return {
+        "data": data["forecast"],
+        "meta": {
+            "region": region,
+            "signal_type": signal_type,
+            "units": data["unit"],
+            "generated_at": data["timestamp"]
+        }
+    }
+
+@app.get("/v3/historical")
+async def historical(region: str, start: str, end: str, signal_type: str = "co2_moer"):
+    await inject("watttime")
+    start_time = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+    end_time = datetime.fromisoformat(end).replace(tzinfo=timezone.utc)
+    step = timedelta(minutes=MOCK_FORECAST_STEP_MINUTES)
+    points = max(0, int((end_time - start_time) / step))
+    data = generate_simulated_data(region, points, MOCK_FORECAST_STEP_MINUTES, seed=MOCK_SEED, start_time=start_time) if points else {"forecast": []}
+    return {"data": data["forecast"], "meta": {"region": region, "signal_type": signal_type}}
+
+@app.post("/openai/v1/chat/completions")
+async def groq_chat(request: Request):
+    """Groq schedule recommendation: a fixed-offset window at a slightly lower intensity"""
+    await inject("groq")
+    body = await request.json()
+    prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+    match = re.search(r"Current Carbon Intensity: ([\d.]+)", prompt)
+    current = float(match.group(1)) if match else 500.0
+    expected = round(current * 0.85, 2)
+    start = datetime.now(timezone.utc) + timedelta(hours=2)
+    recommendation = {
+        "recommended_start_time": start.isoformat(),
+        "expected_intensity": expected,
+        "carbon_savings_estimate": round((current - expected) * 0.1, 2),
+        "confidence_score": 0.75,
+        "reasoning": "Mock recommendation: shift two hours later for lower intensity.",
+        "sustainability_impact": {
+            "carbon_reduction_percentage": 15,
+            "equivalent_trees_planted": 0.1,
+            "energy_cost_savings": 0.5
+        },
+        "alternative_windows": []
+    }
+    return chat_completion(json.dumps(recommendation))
+
+@app.post("/chat/completions")
+async def perplexity_chat(request: Request):
+    await inject("perplexity")
+    return chat_completion(
+        "Mock insights: run during overnight low-carbon hours and batch small jobs together."
+    )
+
+@app.get("/_mock/stats")
+def stats():
+    return {"faults": faults, "counters": counters}
+
+@app.post("/_mock/config")
+async def configure(request: Request):
+    """Update fault settings, e.g. {"groq": {"latency_ms": 800, "error_rate": 0.1}}"""
+    updates = await request.json()
+    for provider, settings in updates.items():
+        if provider not in faults:
+            raise HTTPException(status_code=400, detail=f"Unknown provider {provider}")
+        for name, value in settings.items():
+            if name not in faults[provider]:
+                raise HTTPException(status_code=400, detail=f"Unknown setting {name}")
+            faults[provider][name] = float(value)
+    return faults
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=MOCK_PORT)
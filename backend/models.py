@@ -1,20 +1,46 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON, Enum as SQLEnum
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, event, Column, ForeignKey, Index, Integer, LargeBinary, PrimaryKeyConstraint, String, Float, DateTime, JSON, UniqueConstraint, Enum as SQLEnum
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime
+from migrations import run_migrations
 import enum
 import os
 
-# Create SQLite database engine with absolute path
-DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# Database location; DATABASE_URL overrides the default SQLite file next to this module.
+# Only SQLite is supported: migrations.py is written in its dialect
+# (json_extract, INSERT OR IGNORE, DATETIME/BLOB columns).
+DATABASE_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DATABASE_PATH}")
+
+# SQLite storage profile: WAL lets readers proceed while a write is in flight,
+# and synchronous=NORMAL is durable across application crashes in WAL mode
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    raise RuntimeError(f"Unsupported DATABASE_URL {SQLALCHEMY_DATABASE_URL.split(':', 1)[0]}://...; the job store requires SQLite")
 
 # Create engine with correct parameters
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    echo=True  # Enable SQL logging for debugging
+    echo=SQL_ECHO
 )
 
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    # Negative cache_size is in KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -27,27 +53,111 @@ class JobStatus(str, enum.Enum):
     FAILED = "failed"
     CANCELLED = "cancelled"
 
+class ForecastSnapshot(Base):
+    """
+    A forecast stored once and shared by every job planned against it.
+    Values are a packed little-endian float32 array starting at start_time
+    with a fixed step, instead of a list of ISO-string dicts.
+    """
+    __tablename__ = "forecast_snapshots"
+    __table_args__ = (
+        Index("ix_forecast_snapshots_region_generated_at", "region", "generated_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    region = Column(String(64))
+    signal_type = Column(String(32))
+    unit = Column(String(32))
+    generated_at = Column(DateTime, nullable=True)
+    start_time = Column(DateTime)
+    step_seconds = Column(Integer)
+    point_count = Column(Integer)
+    values = Column(LargeBinary)
+    content_hash = Column(String(64), unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Job(Base):
     __tablename__ = "jobs"
+    # Mirrors migrations.py; the schema itself is created by run_migrations()
+    __table_args__ = (
+        Index("ix_jobs_status", "status"),
+        Index("ix_jobs_created_at", "created_at", "id"),
+        Index("ix_jobs_status_scheduled_time", "status", "scheduled_time"),
+        Index("ix_jobs_region", "region"),
+        Index("ix_jobs_region_status_expected_intensity", "region", "status", "expected_intensity"),
+        Index("ix_jobs_status_lease_expires_at", "status", "lease_expires_at"),
+        Index("ix_jobs_worker_id", "worker_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     task_name = Column(String(255), index=True)  # Specify length for String
     status = Column(SQLEnum(JobStatus), default=JobStatus.PENDING)
     duration_hours = Column(Float)
     resource_usage = Column(String(50))  # Specify length for String
+    region = Column(String(64), nullable=True)  # Grid region the job was placed in
     scheduled_time = Column(DateTime, nullable=True)
     start_time = Column(DateTime, nullable=True)
     completion_time = Column(DateTime, nullable=True)
     carbon_intensity = Column(Float, nullable=True)
+    # Mean forecast intensity over the planned window(s)
+    expected_intensity = Column(Float, nullable=True)
     carbon_saved = Column(Float, nullable=True)
     parameters = Column(JSON, nullable=True)
     results = Column(JSON, nullable=True)
+    forecast_snapshot_id = Column(Integer, ForeignKey("forecast_snapshots.id"), nullable=True, index=True)
+    # Dispatcher process holding (or that last held) the job, and until when
+    worker_id = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Only interruptible jobs have segments; others run once from scheduled_time
+    segments = relationship(
+        "JobSegment", order_by="JobSegment.seq", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+class JobSegment(Base):
+    """One run interval of an interruptible job, in execution order"""
+    __tablename__ = "job_segments"
+    __table_args__ = (
+        UniqueConstraint("job_id", "seq"),
+        Index("ix_job_segments_start_time", "start_time"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    start_time = Column(DateTime)
+    end_time = Column(DateTime)
+    expected_intensity = Column(Float, nullable=True)
+    # Set once the dispatcher has run the segment
+    completed_at = Column(DateTime, nullable=True)
+
+class AnalyticsRollup(Base):
+    """
+    Running totals per (bucket, resource_usage, status), maintained as jobs
+    are created and change status so analytics never scan the jobs table.
+    """
+    __tablename__ = "analytics_rollups"
+    __table_args__ = (
+        PrimaryKeyConstraint("bucket_kind", "bucket_start", "resource_usage", "status"),
+    )
+
+    bucket_kind = Column(String(8))
+    bucket_start = Column(DateTime)
+    resource_usage = Column(String(50))
+    status = Column(String(16))
+    job_count = Column(Integer, default=0)
+    carbon_saved = Column(Float, default=0.0)
+    money_saved = Column(Float, default=0.0)
+    intensity_sum = Column(Float, default=0.0)
+    baseline_intensity_sum = Column(Float, default=0.0)
+    # Jobs contributing to each intensity sum; jobs without an analysis add 0 to neither
+    intensity_count = Column(Integer, default=0)
+    baseline_intensity_count = Column(Integer, default=0)
 
-# Drop existing tables and create new ones
-Base.metadata.drop_all(bind=engine)
-Base.metadata.create_all(bind=engine)
+def init_db():
+    """Bring the schema up to date; safe to call on every start"""
+    return run_migrations(engine)
 
 # Dependency
 def get_db():
@@ -55,4 +165,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -0,0 +1,287 @@
+import math
+import numpy as np
+from datetime import datetime, timedelta, timezone
+
+def parse_point_time(value):
+    """Parse a forecast point_time (ISO string, optionally with a trailing Z)"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+def to_naive_utc(value):
+    """Convert an aware datetime to naive UTC, which is how the job store keeps times"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def to_aware_utc(value):
+    """Treat a naive datetime as UTC so it compares with parsed forecast times"""
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+def forecast_to_series(forecast):
+    """
+    Convert a forecast list of {"point_time", "value"} dicts to (start, step, values).
+    Forecast points are evenly spaced, so only the first two timestamps are parsed.
+    """
+    if not forecast:
+        return None, None, np.empty(0)
+    values = np.fromiter((point["value"] for point in forecast), dtype=np.float64, count=len(forecast))
+    start = parse_point_time(forecast[0]["point_time"])
+    if len(forecast) > 1:
+        step = parse_point_time(forecast[1]["point_time"]) - start
+    else:
+        step = timedelta(minutes=5)
+    return start, step, values
+
+class InfeasibleWindowError(ValueError):
+    """A task's duration does not fit between its earliest_start and deadline"""
+
+def window_slots(duration_hours, step):
+    """Number of forecast intervals needed to cover duration_hours"""
+    return max(1, math.ceil(float(duration_hours) * 3600 / step.total_seconds() - 1e-9))
+
+def feasible_slots(start, step, length, earliest_start=None, deadline=None):
+    """
+    Forecast index range [lo, hi) a task may occupy: from the first interval
+    starting at or after earliest_start to the last one ending by deadline.
+    """
+    start = to_aware_utc(start)
+    lo, hi = 0, length
+    if earliest_start is not None:
+        lo = max(0, math.ceil((to_aware_utc(earliest_start) - start) / step - 1e-9))
+    if deadline is not None:
+        hi = min(length, math.floor((to_aware_utc(deadline) - start) / step + 1e-9))
+    return lo, max(lo, hi)
+
+def fits_deadline(start, step, lo, slots, deadline=None):
+    """
+    Whether a run of slots intervals starting at index lo ends by deadline.
+    The deadline may lie past the forecast, so this is not bounded by hi.
+    """
+    if deadline is None:
+        return True
+    return lo + slots <= math.floor((to_aware_utc(deadline) - to_aware_utc(start)) / step + 1e-9)
+
+def window_means(values, slots):
+    """Mean intensity for every feasible start index, via cumulative sums"""
+    slots = min(slots, len(values))
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    return (csum[slots:] - csum[:-slots]) / slots
+
+def top_k_starts(means, slots, k):
+    """Indices of the k lowest-mean windows that do not overlap each other"""
+    order = np.argsort(means, kind="stable")
+    blocked = np.zeros(len(means), dtype=bool)
+    chosen = []
+    for index in order:
+        if blocked[index]:
+            continue
+        chosen.append(int(index))
+        if len(chosen) == k:
+            break
+        blocked[max(0, index - slots + 1):index + slots] = True
+    return chosen
+
+def find_optimal_windows(forecast, duration_hours, top_k=3, earliest_start=None, deadline=None):
+    """
+    Find the lowest-carbon start time for a task over the forecast.
+
+    Only windows between earliest_start and deadline are considered.
+    Returns None when the forecast is empty, has no points in that range, or
+    the range is too short for duration_hours before the deadline, otherwise a dict with the best window plus up to top_k - 1
+    non-overlapping alternatives, each as
+    {"start_time": datetime, "expected_intensity": float}.
+    """
+    start, step, values = forecast_to_series(forecast)
+    lo, hi = feasible_slots(start, step, len(values), earliest_start, deadline)
+    if lo >= hi:
+        return None
+
+    slots = window_slots(duration_hours, step)
+    if not fits_deadline(start, step, lo, slots, deadline):
+        return None
+    means = window_means(values[lo:hi], slots)
+    return _windows_result(start + step * lo, step, means, slots, hi - lo, top_k)
+
+def _windows_result(start, step, means, slots, length, top_k):
+    windows = [
+        {"start_time": start + step * index, "expected_intensity": float(means[index])}
+        for index in top_k_starts(means, min(slots, length), top_k)
+    ]
+    return {
+        "best": windows[0],
+        "alternatives": windows[1:],
+        "run_now_intensity": float(means[0]),
+        "slots": slots,
+        "step": step,
+        "horizon_covered": slots <= length
+    }
+
+def find_optimal_windows_batch(forecast, durations, top_k=3, limits=None):
+    """
+    Solve many tasks against one forecast.
+
+    limits optionally holds an (earliest_start, deadline) pair per task.
+    The forecast is parsed and prefix-summed once; tasks that need the same
+    number of intervals over the same feasible range share a single
+    window-means pass.
+    """
+    start, step, values = forecast_to_series(forecast)
+    if not len(values):
+        return [None] * len(durations)
+
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    keys = []
+    for duration, (earliest_start, deadline) in zip(durations, limits or [(None, None)] * len(durations)):
+        slots = window_slots(duration, step)
+        lo, hi = feasible_slots(start, step, len(values), earliest_start, deadline)
+        keys.append((slots, lo, hi, fits_deadline(start, step, lo, slots, deadline)))
+    solved = {}
+    for key in set(keys):
+        slots, lo, hi, fits = key
+        if lo >= hi or not fits:
+            solved[key] = None
+            continue
+        covered = min(slots, hi - lo)
+        means = (csum[lo + covered:hi + 1] - csum[lo:hi - covered + 1]) / covered
+        solved[key] = _windows_result(start + step * lo, step, means, slots, hi - lo, top_k)
+    return [solved[key] for key in keys]
+
+def _chunked_selection(values, total, chunk):
+    """
+    Boolean mask choosing exactly `total` intervals of values, in runs of at
+    least `chunk`, with the lowest sum.
+
+    DP over positions with two states per used-interval count: between runs
+    (free to start one) and inside a run that has reached the minimum
+    length. Starting a run takes `chunk` intervals at once via prefix sums,
+    so each position costs a few vectorized operations over the counts.
+    """
+    n = len(values)
+    inf = np.inf
+    seg = np.concatenate(([0.0], np.cumsum(values)))
+    seg = seg[chunk:] - seg[:-chunk]
+    between = np.full(total + 1, inf)
+    between[0] = 0.0
+    # Inside-run costs for the next chunk + 1 positions, as a ring buffer
+    inside = np.full((chunk + 1, total + 1), inf)
+    came_from_run = np.zeros((n + 1, total + 1), dtype=bool)
+    started_run = np.zeros((n + 1, total + 1), dtype=bool)
+    for i in range(n):
+        current = inside[i % (chunk + 1)]
+        if i + chunk <= n:
+            target = inside[(i + chunk) % (chunk + 1), chunk:]
+            candidate = between[:total + 1 - chunk] + seg[i]
+            np.less(candidate, target, out=started_run[i + chunk, chunk:])
+            np.minimum(target, candidate, out=target)
+        following = inside[(i + 1) % (chunk + 1), 1:]
+        extended = current[:-1] + values[i]
+        started_run[i + 1, 1:] &= following <= extended
+        np.minimum(following, extended, out=following)
+        np.less(current, between, out=came_from_run[i + 1])
+        np.minimum(between, current, out=between)
+        current.fill(inf)
+
+    mask = np.zeros(n, dtype=bool)
+    i, used = n, total
+    in_run = inside[n % (chunk + 1)][total] < between[total]
+    if not in_run and not np.isfinite(between[total]):
+        return None
+    while i > 0:
+        if in_run:
+            if started_run[i, used]:
+                mask[i - chunk:i] = True
+                i, used, in_run = i - chunk, used - chunk, False
+            else:
+                mask[i - 1] = True
+                i, used = i - 1, used - 1
+        else:
+            in_run = came_from_run[i, used]
+            i -= 1
+    return mask
+
+def find_optimal_segments(forecast, duration_hours, min_chunk_hours=None, earliest_start=None, deadline=None):
+    """
+    Lowest-carbon set of intervals for an interruptible task.
+
+    Picks intervals between earliest_start and deadline adding up to
+    duration_hours, in runs of at least min_chunk_hours (any length when
+    unset). Without a minimum this is a partial sort; with one it is the
+    DP in _chunked_selection. Returns None when the forecast has no points
+    in range or duration_hours does not fit before the deadline, otherwise {"segments": [{"start_time", "end_time",
+    "expected_intensity"}], "expected_intensity", "run_now_intensity",
+    "slots", "step", "horizon_covered"}.
+    """
+    start, step, values = forecast_to_series(forecast)
+    lo, hi = feasible_slots(start, step, len(values), earliest_start, deadline)
+    if lo >= hi:
+        return None
+
+    slots = window_slots(duration_hours, step)
+    if not fits_deadline(start, step, lo, slots, deadline):
+        return None
+    chunk = min(window_slots(min_chunk_hours, step), slots) if min_chunk_hours else 1
+    feasible = values[lo:hi]
+    if len(feasible) <= slots or chunk == slots:
+        # No room to split: the best single window is the answer
+        windows = find_optimal_windows(forecast, duration_hours, 1, earliest_start, deadline)
+        best = windows["best"]
+        return {
+            "segments": [{
+                "start_time": best["start_time"],
+                # Past the forecast when it is shorter than the task
+                "end_time": best["start_time"] + step * slots,
+                "expected_intensity": best["expected_intensity"]
+            }],
+            "expected_intensity": best["expected_intensity"],
+            "run_now_intensity": windows["run_now_intensity"],
+            "slots": slots,
+            "step": step,
+            "horizon_covered": windows["horizon_covered"]
+        }
+
+    if chunk == 1:
+        mask = np.zeros(len(feasible), dtype=bool)
+        mask[np.argpartition(feasible, slots - 1)[:slots]] = True
+    else:
+        mask = _chunked_selection(feasible, slots, chunk)
+        if mask is None:
+            return None
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    base = start + step * lo
+    segments = [
+        {
+            "start_time": base + step * int(run_start),
+            "end_time": base + step * int(run_end),
+            "expected_intensity": float(feasible[run_start:run_end].mean())
+        }
+        for run_start, run_end in zip(edges[::2], edges[1::2])
+    ]
+    return {
+        "segments": segments,
+        "expected_intensity": float(feasible[mask].mean()),
+        "run_now_intensity": float(feasible[:slots].mean()),
+        "slots": slots,
+        "step": step,
+        "horizon_covered": True
+    }
+
+def rank_regions(forecasts, durations, top_k=3, limits=None):
+    """
+    Joint (region, start time) search for many tasks over several regions.
+
+    forecasts holds one forecast list per candidate region; each region is
+    solved once for all tasks, within each task's optional
+    (earliest_start, deadline) from limits. Returns, per task,
+    [(region_index, windows)] ordered by the best window's expected
+    intensity. Regions without a forecast are left out.
+    """
+    per_region = [find_optimal_windows_batch(forecast, durations, top_k, limits) for forecast in forecasts]
+    ranked = []
+    for task_index in range(len(durations)):
+        options = [(region_index, solved[task_index]) for region_index, solved in enumerate(per_region) if solved[task_index]]
+        options.sort(key=lambda option: option[1]["best"]["expected_intensity"])
+        ranked.append(options)
+    return ranked
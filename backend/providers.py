@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import aiohttp
+from metrics import fallbacks_total, hedged_total, register_breaker, short_circuits_total, upstream_errors_total
+
+logger = logging.getLogger(__name__)
+
+# Per-provider deadlines for the scheduling pipeline (seconds)
+WATTTIME_TIMEOUT_SECONDS = float(os.getenv("WATTTIME_TIMEOUT_SECONDS", 10))
+GROQ_TIMEOUT_SECONDS = float(os.getenv("GROQ_TIMEOUT_SECONDS", 15))
+PERPLEXITY_TIMEOUT_SECONDS = float(os.getenv("PERPLEXITY_TIMEOUT_SECONDS", 30))
+# Timeout for each individual WattTime HTTP request; kept below
+# WATTTIME_TIMEOUT_SECONDS so a hung socket fails inside the deadline
+WATTTIME_HTTP_TIMEOUT_SECONDS = float(os.getenv("WATTTIME_HTTP_TIMEOUT_SECONDS", 5))
+# If Groq has not answered within this budget, return the deterministic
+# recommendation immediately and let the LLM call finish in the background
+# (its answer is cached for the next identical request). 0 disables hedging.
+GROQ_HEDGE_SECONDS = float(os.getenv("GROQ_HEDGE_SECONDS", 0))
+
+# Consecutive failures that open a provider's circuit, and how long it stays
+# open before a single trial call is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open"""
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    closed: calls go through; BREAKER_FAILURE_THRESHOLD consecutive failures open it.
+    open: calls are refused so callers go straight to their local fallback.
+    half_open: after BREAKER_RESET_SECONDS one trial call is allowed; its
+    outcome closes the circuit again or re-opens it for another period.
+    Thread-safe, since WattTime calls run in worker threads.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("%s circuit closed", self.name)
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("%s circuit opened after %s failure(s)", self.name, self.failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """The shared CircuitBreaker for provider name, created on first use"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+            register_breaker(name, _breakers[name])
+        return _breakers[name]
+
+_http_session = None
+
+def get_http_session():
+    """Shared aiohttp session so async providers reuse pooled connections"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession()
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+# Hedged calls left running after their fallback was returned
+_background_calls = set()
+_FAILED = object()
+
+async def _guarded(name, coro, timeout, breaker):
+    """Await coro under its deadline, recording the outcome; _FAILED on error"""
+    try:
+        result = await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        logger.warning("%s timed out after %ss, using fallback", name, timeout)
+        upstream_errors_total.inc(name, "timeout")
+    except Exception as e:
+        logger.warning("%s failed: %s, using fallback", name, e)
+        upstream_errors_total.inc(name, "error")
+    else:
+        if breaker:
+            breaker.record_success()
+        return result
+    if breaker:
+        breaker.record_failure()
+    return _FAILED
+
+async def call_with_fallback(name, coro, timeout, fallback, breaker=None, hedge_after=None):
+    """
+    Await coro with a deadline. On timeout or error, return fallback()
+    instead so one slow provider cannot stall the request.
+
+    With a breaker, calls are skipped entirely while its circuit is open.
+    With hedge_after (seconds, below timeout), fallback() is returned as soon
+    as the budget runs out; coro keeps running until its deadline so its
+    result can still warm the provider's cache and the breaker's state.
+    """
+    if breaker and not breaker.allow():
+        coro.close()
+        short_circuits_total.inc(name)
+        fallbacks_total.inc(name)
+        return fallback()
+
+    call = asyncio.ensure_future(_guarded(name, coro, timeout, breaker))
+    if hedge_after and hedge_after < timeout:
+        done, _ = await asyncio.wait({call}, timeout=hedge_after)
+        if not done:
+            _background_calls.add(call)
+            call.add_done_callback(_background_calls.discard)
+            hedged_total.inc(name)
+            fallbacks_total.inc(name)
+            return fallback()
+    result = await call
+    if result is _FAILED:
+        fallbacks_total.inc(name)
+        return fallback()
+    return result
@@ -0,0 +1,402 @@
+import asyncio
+import logging
+import math
+import os
+import numpy as np
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import delete, insert
+from assignment import ASSIGNMENT_STEP_MINUTES, class_load, grid_range, stored_task_limits, with_replan, write_moves
+from carbon_data import get_regional_carbon_intensity
+from dispatcher import dispatcher
+from events import broadcaster
+from groq_inference import generate_batch_recommendations
+from metrics import replans_total
+from models import ForecastSnapshot, Job, JobSegment, JobStatus, SessionLocal
+from optimizer import parse_point_time, to_naive_utc
+from snapshots import decode_values, get_or_create_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Incremental re-planning of pending jobs as forecasts are revised.
+#
+# Each new forecast is compared with the previous one for its region. Only
+# pending jobs whose window overlaps an interval that rose, or whose planned
+# intensity is above the cheapest interval that fell (or, for a bounded
+# number, above the cheapest newly forecast interval), are loaded (through
+# the status/scheduled_time, segment start and region/expected_intensity
+# indexes); those are checked against the snapshot they were planned with
+# and re-solved in batches, moving only into windows with room under each
+# resource class's dispatcher concurrency.
+
+REPLAN_ENABLED = os.getenv("REPLAN_ENABLED", "true").lower() == "true"
+REPLAN_CHECK_SECONDS = float(os.getenv("REPLAN_CHECK_SECONDS", 60))
+# Forecast intervals that moved by less than this fraction count as unchanged
+REPLAN_CHANGE_FRACTION = float(os.getenv("REPLAN_CHANGE_FRACTION", 0.02))
+# A job's window is materially worse once its mean rose this much since planning
+REPLAN_WORSE_FRACTION = float(os.getenv("REPLAN_WORSE_FRACTION", 0.05))
+# An alternative is materially better when it is this much below the current window
+REPLAN_GAIN_FRACTION = float(os.getenv("REPLAN_GAIN_FRACTION", 0.05))
+REPLAN_BATCH_SIZE = int(os.getenv("REPLAN_BATCH_SIZE", 200))
+# Jobs due to start within this many minutes are left alone
+REPLAN_FREEZE_MINUTES = int(os.getenv("REPLAN_FREEZE_MINUTES", 10))
+# Longest job looked back for when a changed interval may overlap its window
+REPLAN_MAX_JOB_HOURS = float(os.getenv("REPLAN_MAX_JOB_HOURS", 48))
+# Jobs checked against intervals past the previous forecast's horizon, highest planned intensity first
+REPLAN_HORIZON_MAX_JOBS = int(os.getenv("REPLAN_HORIZON_MAX_JOBS", 200))
+
+def window_mean(forecast, intervals):
+    """Mean forecast value over (start, end) intervals, or None when none overlap it"""
+    start_time, step_seconds, values = forecast
+    total = 0.0
+    count = 0
+    for start, end in intervals:
+        first = max(0, math.floor((start - start_time).total_seconds() / step_seconds))
+        last = min(len(values), math.ceil((end - start_time).total_seconds() / step_seconds))
+        if first < last:
+            total += float(values[first:last].astype(np.float64).sum())
+            count += last - first
+    return total / count if count else None
+
+def _runs(mask, start_time, step, merge_gap=timedelta(hours=1)):
+    """(start, end) time ranges of the True runs in mask, merging close runs"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    runs = []
+    for first, last in zip(edges[::2], edges[1::2]):
+        start, end = start_time + step * int(first), start_time + step * int(last)
+        if runs and start - runs[-1][1] <= merge_gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
+
+def compare_forecasts(previous, current):
+    """
+    Intervals where current moved materially against previous, compared
+    only where both forecasts overlap.
+    Returns (worse, better, floor, horizon): time ranges that rose and fell,
+    the lowest value among the fallen ones (None if nothing fell), and
+    (start, end, lowest value) of the intervals past previous's horizon,
+    which no plan has seen (None when current does not extend it).
+    """
+    start_time, step_seconds, values = current
+    previous_start, previous_step, previous_values = previous
+    offsets = (start_time - previous_start).total_seconds() + np.arange(len(values)) * step_seconds
+    indices = (offsets // previous_step).astype(np.int64)
+    covered = (indices >= 0) & (indices < len(previous_values))
+    old = previous_values[np.clip(indices, 0, len(previous_values) - 1)].astype(np.float64)
+    new = values.astype(np.float64)
+    tolerance = np.abs(old) * REPLAN_CHANGE_FRACTION
+    rose = covered & (new > old + tolerance)
+    fell = covered & (new < old - tolerance)
+    step = timedelta(seconds=step_seconds)
+    floor = float(new[fell].min()) if fell.any() else None
+    beyond = np.flatnonzero(indices >= len(previous_values))
+    horizon = None
+    if len(beyond):
+        horizon = (start_time + step * int(beyond[0]), start_time + step * len(values), float(new[beyond].min()))
+    return _runs(rose, start_time, step), _runs(fell, start_time, step), floor, horizon
+
+def affected_job_ids(db, region, worse, floor, now, horizon=None):
+    """
+    Pending jobs in region that a forecast change may have affected. Of the
+    jobs that may gain from a newly forecast horizon, only the
+    REPLAN_HORIZON_MAX_JOBS planned highest are taken.
+    """
+    frozen = now + timedelta(minutes=REPLAN_FREEZE_MINUTES)
+    reach = timedelta(hours=REPLAN_MAX_JOB_HOURS)
+    job_ids = set()
+    for start, end in worse:
+        # The index bounds the range; the exact overlap check needs the duration
+        job_ids.update(job_id for job_id, scheduled_time, duration_hours in db.query(
+            Job.id, Job.scheduled_time, Job.duration_hours
+        ).filter(
+            Job.status == JobStatus.PENDING,
+            Job.scheduled_time >= max(start - reach, frozen),
+            Job.scheduled_time < end,
+            Job.region == region
+        ) if scheduled_time + timedelta(hours=duration_hours or 0) > start)
+        job_ids.update(job_id for (job_id,) in db.query(JobSegment.job_id).join(Job).filter(
+            JobSegment.start_time >= start - reach,
+            JobSegment.start_time < end,
+            JobSegment.end_time > start,
+            Job.status == JobStatus.PENDING,
+            Job.region == region
+        ))
+    if floor is not None:
+        # Only jobs planned above the new low point can gain from it
+        job_ids.update(job_id for (job_id,) in db.query(Job.id).filter(
+            Job.region == region,
+            Job.status == JobStatus.PENDING,
+            Job.expected_intensity > floor / (1 - REPLAN_GAIN_FRACTION)
+        ))
+    if horizon is not None:
+        job_ids.update(job_id for (job_id,) in db.query(Job.id).filter(
+            Job.region == region,
+            Job.status == JobStatus.PENDING,
+            Job.expected_intensity > horizon[2] / (1 - REPLAN_GAIN_FRACTION),
+            Job.scheduled_time >= frozen
+        ).order_by(Job.expected_intensity.desc()).limit(REPLAN_HORIZON_MAX_JOBS))
+    return job_ids
+
+def _stored_task(job):
+    """Task-like object rebuilt from a job's columns and stored parameters"""
+    stored = (job.parameters or {}).get("task") or {}
+    earliest_start, deadline = stored_task_limits(job.parameters)
+    return SimpleNamespace(
+        task_name=job.task_name,
+        duration_hours=job.duration_hours,
+        resource_usage=job.resource_usage,
+        earliest_start=earliest_start,
+        deadline=deadline,
+        interruptible=bool(stored.get("interruptible")),
+        min_chunk_hours=stored.get("min_chunk_hours")
+    )
+
+def _planned_intervals(recommendation, duration_hours):
+    segments = recommendation.get("segments")
+    if segments:
+        return [
+            (to_naive_utc(parse_point_time(segment["start_time"])), to_naive_utc(parse_point_time(segment["end_time"])))
+            for segment in segments
+        ]
+    start = to_naive_utc(parse_point_time(recommendation["recommended_start_time"]))
+    return [(start, start + timedelta(hours=duration_hours))]
+
+def _snapshot_forecast(db, snapshot_id, cache):
+    if snapshot_id not in cache:
+        snapshot = db.get(ForecastSnapshot, snapshot_id) if snapshot_id else None
+        cache[snapshot_id] = (snapshot.start_time, snapshot.step_seconds, decode_values(snapshot)) if snapshot else None
+    return cache[snapshot_id]
+
+def replan_batch(db, job_ids, carbon_data, forecast, snapshot_id, now, planned_cache):
+    """
+    Re-solve the given pending jobs on the new forecast and move those whose
+    window got materially worse or that have a materially better option
+    with room under their class's dispatcher concurrency.
+    Returns the moves applied, as dicts with job_id, new_time and reason.
+    """
+    frozen = now + timedelta(minutes=REPLAN_FREEZE_MINUTES)
+    jobs = db.query(
+        Job.id, Job.task_name, Job.duration_hours, Job.resource_usage, Job.scheduled_time,
+        Job.expected_intensity, Job.forecast_snapshot_id, Job.parameters
+    ).filter(Job.id.in_(job_ids), Job.status == JobStatus.PENDING).all()
+    segments = defaultdict(list)
+    for job_id, start_time, end_time in db.query(JobSegment.job_id, JobSegment.start_time, JobSegment.end_time).filter(
+        JobSegment.job_id.in_(job_ids)
+    ).order_by(JobSegment.job_id, JobSegment.seq):
+        segments[job_id].append((start_time, end_time))
+
+    candidates = []
+    for job in jobs:
+        if job.scheduled_time is None or job.scheduled_time < frozen or job.forecast_snapshot_id == snapshot_id:
+            continue
+        intervals = segments.get(job.id) or [(job.scheduled_time, job.scheduled_time + timedelta(hours=job.duration_hours))]
+        current_intensity = window_mean(forecast, intervals)
+        if current_intensity is None:
+            continue
+        planned = _snapshot_forecast(db, job.forecast_snapshot_id, planned_cache)
+        planned_intensity = (window_mean(planned, intervals) if planned else None) or job.expected_intensity
+        candidates.append((job, intervals, planned_intensity, current_intensity))
+    if not candidates:
+        return []
+
+    recommendations = generate_batch_recommendations([_stored_task(job) for job, _, _, _ in candidates], carbon_data)
+    planned = [
+        (candidate, recommendation, _planned_intervals(recommendation, candidate[0].duration_hours))
+        for candidate, recommendation in zip(candidates, recommendations)
+        # None when the deadline no longer fits the new forecast; keep the current plan
+        if recommendation is not None
+    ]
+    # Largest potential gain first, so contested capacity goes where it saves the most
+    planned.sort(key=lambda entry: (window_mean(forecast, entry[2]) or math.inf) - entry[0][3])
+
+    # Moves must fit each class's dispatcher concurrency, counting every
+    # other pending and running job, as assign_pending does
+    step = timedelta(minutes=ASSIGNMENT_STEP_MINUTES)
+    grid_start = datetime.min + math.floor((now - datetime.min) / step) * step
+    grid_end = max(end for (_, current_intervals, _, _), _, intervals in planned for _, end in current_intervals + intervals) if planned else now
+    length = max(1, math.ceil((grid_end - grid_start) / step))
+    load = class_load(db, grid_start, step, length, pending_windows=True)
+
+    def occupy(usage, intervals, count):
+        for start, end in intervals:
+            first, last = grid_range(start, end, grid_start, step, length)
+            usage[first:last] += count
+
+    def fits(usage, intervals, capacity):
+        for start, end in intervals:
+            first, last = grid_range(start, end, grid_start, step, length)
+            if first < last and usage[first:last].max() >= capacity:
+                return False
+        return True
+
+    moves = []
+    new_segments = []
+    blocked = 0
+    for (job, current_intervals, planned_intensity, current_intensity), recommendation, intervals in planned:
+        usage_class = (job.resource_usage or "").lower()
+        usage = load[usage_class]
+        capacity = dispatcher.limits.get(usage_class, dispatcher.default_limit)
+        worse = planned_intensity is not None and current_intensity > planned_intensity * (1 + REPLAN_WORSE_FRACTION)
+        # Ranked alternatives stand in when the best window is at capacity
+        options = [(intervals, recommendation)] + [
+            (
+                [(start, start + timedelta(hours=job.duration_hours))],
+                {
+                    **recommendation,
+                    "recommended_start_time": alternative["start_time"],
+                    "expected_intensity": alternative["expected_intensity"],
+                    "reasoning": f"{recommendation.get('reasoning', '')} The best window was at capacity for "
+                                 f"{job.resource_usage} jobs, so the next-lowest one was taken.".strip(),
+                    "alternative_windows": []
+                }
+            )
+            for alternative in recommendation.get("alternative_windows") or []
+            if not recommendation.get("segments")
+            for start in [to_naive_utc(parse_point_time(alternative["start_time"]))]
+        ]
+        occupy(usage, current_intervals, -1)
+        chosen = None
+        for option_intervals, option in options:
+            # Measured on the forecast itself, so heuristic fallbacks compare fairly
+            expected_intensity = window_mean(forecast, option_intervals)
+            if expected_intensity is None or option_intervals == current_intervals:
+                continue
+            better = expected_intensity < current_intensity * (1 - REPLAN_GAIN_FRACTION)
+            if not (better or (worse and expected_intensity < current_intensity)):
+                continue
+            if fits(usage, option_intervals, capacity):
+                chosen = (option_intervals, option, expected_intensity)
+                break
+            blocked += 1
+        if chosen is None:
+            occupy(usage, current_intervals, 1)
+            continue
+        intervals, recommendation, expected_intensity = chosen
+        occupy(usage, intervals, 1)
+        reason = "window_worse" if worse else "better_window"
+        parameters = with_replan(job.parameters, recommendation, {
+            "at": now.isoformat(),
+            "reason": reason,
+            "previous_start_time": job.scheduled_time.isoformat(),
+            "scheduled_time": intervals[0][0].isoformat(),
+            "planned_intensity": planned_intensity,
+            "previous_intensity": current_intensity,
+            "expected_intensity": expected_intensity,
+            "forecast_snapshot_id": snapshot_id
+        })
+        moves.append({
+            "job_id": job.id,
+            "new_time": intervals[0][0],
+            "new_intensity": expected_intensity,
+            "new_parameters": parameters,
+            "reason": reason,
+            "resource_usage": job.resource_usage
+        })
+        new_segments += [
+            {
+                "job_id": job.id,
+                "seq": seq,
+                "start_time": to_naive_utc(parse_point_time(segment["start_time"])),
+                "end_time": to_naive_utc(parse_point_time(segment["end_time"])),
+                "expected_intensity": segment["expected_intensity"]
+            }
+            for seq, segment in enumerate(recommendation.get("segments") or [])
+        ]
+    if blocked:
+        logger.debug("%s re-plan options skipped for lack of class capacity", blocked)
+    if not moves:
+        return []
+
+    moves = write_moves(db, moves, now, forecast_snapshot_id=snapshot_id)
+    applied = {move["job_id"] for move in moves}
+    new_segments = [segment for segment in new_segments if segment["job_id"] in applied]
+    moved_ids = [move["job_id"] for move in moves if move["job_id"] in segments]
+    if moved_ids:
+        db.execute(delete(JobSegment.__table__).where(JobSegment.__table__.c.job_id.in_(moved_ids)))
+    if new_segments:
+        db.execute(insert(JobSegment.__table__), new_segments)
+    return moves
+
+def replan_region(db, region, carbon_data, snapshot_id, previous, forecast, now=None):
+    """
+    Re-plan the pending jobs of one region affected by a change from the
+    previous forecast to forecast (snapshot_id). Returns a summary.
+    """
+    now = now or datetime.utcnow()
+    worse, better, floor, horizon = compare_forecasts(previous, forecast)
+    job_ids = sorted(affected_job_ids(db, region, worse, floor, now, horizon))
+    summary = {"region": region, "snapshot_id": snapshot_id, "candidates": len(job_ids), "moved": 0, "reasons": {}}
+    reasons = Counter()
+    planned_cache = {}
+    for offset in range(0, len(job_ids), REPLAN_BATCH_SIZE):
+        moves = replan_batch(db, job_ids[offset:offset + REPLAN_BATCH_SIZE], carbon_data, forecast, snapshot_id, now, planned_cache)
+        db.commit()
+        if not moves:
+            continue
+        for move in moves:
+            dispatcher.submit(move["job_id"], move["new_time"], move["resource_usage"])
+            replans_total.inc(move["reason"])
+            reasons[move["reason"]] += 1
+        broadcaster.publish("jobs.rescheduled", {"jobs": [
+            {"id": move["job_id"], "scheduled_time": move["new_time"], "reason": move["reason"]}
+            for move in moves
+        ]})
+    summary["moved"] = sum(reasons.values())
+    summary["reasons"] = dict(reasons)
+    if job_ids:
+        logger.info("Re-planned %s of %s affected jobs in %s", summary["moved"], len(job_ids), region, extra={"reasons": summary["reasons"]})
+    return summary
+
+class Replanner:
+    """Watches each region's forecast and re-plans pending jobs when it changes"""
+
+    def __init__(self):
+        # region -> (snapshot_id, (start_time, step_seconds, values)) last seen
+        self._forecasts = {}
+
+    def _stored_previous(self, db, region, snapshot_id):
+        snapshot = db.query(ForecastSnapshot).filter(
+            ForecastSnapshot.region == region, ForecastSnapshot.id != snapshot_id
+        ).order_by(ForecastSnapshot.id.desc()).first()
+        return (snapshot.start_time, snapshot.step_seconds, decode_values(snapshot)) if snapshot else None
+
+    def check(self, carbon_data, now=None):
+        """Re-plan for carbon_data's region if its forecast is new; returns a summary or None"""
+        region = carbon_data.get("location")
+        if not region or region.startswith("SIMULATED") or not carbon_data.get("forecast"):
+            # Simulated forecasts are random on every fetch
+            return None
+        db = SessionLocal()
+        try:
+            snapshot_id = get_or_create_snapshot(db, carbon_data)
+            db.commit()
+            seen = self._forecasts.get(region)
+            if snapshot_id is None or (seen and seen[0] == snapshot_id):
+                return None
+            snapshot = db.get(ForecastSnapshot, snapshot_id)
+            forecast = (snapshot.start_time, snapshot.step_seconds, decode_values(snapshot))
+            previous = seen[1] if seen else self._stored_previous(db, region, snapshot_id)
+            self._forecasts[region] = (snapshot_id, forecast)
+            if previous is None:
+                return None
+            return replan_region(db, region, carbon_data, snapshot_id, previous, forecast, now)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def run(self, interval=REPLAN_CHECK_SECONDS):
+        """Check every candidate region's forecast every interval seconds"""
+        while True:
+            try:
+                for carbon_data in await get_regional_carbon_intensity():
+                    await asyncio.to_thread(self.check, carbon_data)
+            except Exception as e:
+                logger.warning("Error re-planning pending jobs: %s", e)
+            await asyncio.sleep(interval)
+
+replanner = Replanner()
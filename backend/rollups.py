@@ -0,0 +1,189 @@
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import AnalyticsRollup, Job, JobStatus
+
+# Analytics are served from analytics_rollups: one row of running sums per
+# (bucket_kind, bucket_start, resource_usage, status). Creating a job adds
+# its metrics to each bucket kind; a status change moves them from the old
+# status row to the new one. Reads therefore cost O(buckets), not O(jobs).
+BUCKET_KINDS = ("hour", "day", "week")
+METRICS = (
+    "job_count", "carbon_saved", "money_saved", "intensity_sum", "baseline_intensity_sum",
+    "intensity_count", "baseline_intensity_count"
+)
+
+def bucket_start(when, kind):
+    """Start of the hour, day or (Monday-based) week containing when"""
+    if kind == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
+def _status_value(status):
+    return status.value if isinstance(status, JobStatus) else str(status).lower()
+
+def job_metrics(carbon_saved, results):
+    """Per-job contribution to each rollup metric"""
+    analysis = (results or {}).get("analysis") or {}
+    intensity = analysis.get("optimized_intensity")
+    baseline_intensity = analysis.get("baseline_intensity")
+    return (
+        1,
+        float(carbon_saved or 0),
+        float(analysis.get("money_saved") or 0),
+        float(intensity or 0),
+        float(baseline_intensity or 0),
+        int(intensity is not None),
+        int(baseline_intensity is not None)
+    )
+
+def collect_deltas(rows, deltas=None):
+    """
+    Accumulate (created_at, resource_usage, status, carbon_saved, results, sign)
+    rows into per-bucket metric deltas, so a batch costs one write per bucket
+    """
+    deltas = deltas if deltas is not None else defaultdict(lambda: [0] * len(METRICS))
+    for created_at, resource_usage, status, carbon_saved, results, sign in rows:
+        metrics = job_metrics(carbon_saved, results)
+        for kind in BUCKET_KINDS:
+            key = (kind, bucket_start(created_at, kind), (resource_usage or "").lower(), _status_value(status))
+            totals = deltas[key]
+            for index, value in enumerate(metrics):
+                totals[index] += sign * value
+    return deltas
+
+def _insert_for(bind):
+    return postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+
+def apply_deltas(conn, deltas):
+    """Upsert metric deltas into analytics_rollups on conn (a Session or Connection)"""
+    if not deltas:
+        return
+    table = AnalyticsRollup.__table__
+    statement = _insert_for(conn.get_bind() if hasattr(conn, "get_bind") else conn)(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["bucket_kind", "bucket_start", "resource_usage", "status"],
+        set_={name: table.c[name] + statement.excluded[name] for name in METRICS}
+    )
+    conn.execute(statement, [
+        {
+            "bucket_kind": kind,
+            "bucket_start": start,
+            "resource_usage": resource_usage,
+            "status": status,
+            **dict(zip(METRICS, totals))
+        }
+        for (kind, start, resource_usage, status), totals in deltas.items()
+    ])
+
+def record_jobs_created(db, jobs):
+    """Add freshly flushed Job rows to the rollups in the caller's transaction"""
+    apply_deltas(db, collect_deltas(
+        (job.created_at, job.resource_usage, job.status, job.carbon_saved, job.results, 1) for job in jobs
+    ))
+
+def record_status_change(db, job, old_status, new_status):
+    """Move a job's metrics from its old status row to the new one"""
+    record_status_changes(db, [job], old_status, new_status)
+
+def record_status_changes(db, jobs, old_status, new_status):
+    """record_status_change for many jobs with one write per affected bucket"""
+    if _status_value(old_status) == _status_value(new_status):
+        return
+    deltas = None
+    for job in jobs:
+        fields = (job.created_at, job.resource_usage)
+        deltas = collect_deltas([
+            (*fields, old_status, job.carbon_saved, job.results, -1),
+            (*fields, new_status, job.carbon_saved, job.results, 1)
+        ], deltas)
+    apply_deltas(db, deltas)
+
+def record_metric_changes(db, changes):
+    """
+    Replace jobs' metrics in the rollups after their savings were re-derived.
+    changes are (job, carbon_saved, results): the job row still holds the old
+    values, carbon_saved and results are the new ones.
+    """
+    apply_deltas(db, collect_deltas(
+        row
+        for job, carbon_saved, results in changes
+        for row in (
+            (job.created_at, job.resource_usage, job.status, job.carbon_saved, job.results, -1),
+            (job.created_at, job.resource_usage, job.status, carbon_saved, results, 1)
+        )
+    ))
+
+def clear_rollups(db):
+    db.query(AnalyticsRollup).delete(synchronize_session=False)
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from the jobs table (migration backfill and repair)"""
+    conn.execute(AnalyticsRollup.__table__.delete())
+    query = select(Job.created_at, Job.resource_usage, Job.status, Job.carbon_saved, Job.results).where(
+        Job.created_at.is_not(None)
+    )
+    deltas = None
+    for row in conn.execute(query.execution_options(yield_per=1000)):
+        deltas = collect_deltas([(*row, 1)], deltas)
+    apply_deltas(conn, deltas)
+
+def query_rollups(db, bucket="day", start=None, end=None, resource_usage=None, status=None):
+    """
+    Bucketed analytics: one entry per bucket_start with totals, mean
+    intensities and a breakdown by resource_usage and status.
+    """
+    # Rows whose jobs all moved to another status stay behind with zero counts
+    query = db.query(AnalyticsRollup).filter(AnalyticsRollup.bucket_kind == bucket, AnalyticsRollup.job_count != 0)
+    if start:
+        query = query.filter(AnalyticsRollup.bucket_start >= bucket_start(start, bucket))
+    if end:
+        query = query.filter(AnalyticsRollup.bucket_start < end)
+    if resource_usage:
+        query = query.filter(AnalyticsRollup.resource_usage == resource_usage.lower())
+    if status:
+        query = query.filter(AnalyticsRollup.status == _status_value(status))
+
+    buckets = {}
+    totals = dict.fromkeys(METRICS, 0)
+    for row in query.order_by(AnalyticsRollup.bucket_start):
+        entry = buckets.setdefault(row.bucket_start, {
+            "bucket_start": row.bucket_start,
+            **dict.fromkeys(METRICS, 0),
+            "by_resource_usage": defaultdict(int),
+            "by_status": defaultdict(int)
+        })
+        for name in METRICS:
+            value = getattr(row, name) or 0
+            entry[name] += value
+            totals[name] += value
+        entry["by_resource_usage"][row.resource_usage] += row.job_count or 0
+        entry["by_status"][row.status] += row.job_count or 0
+    return {
+        "bucket": bucket,
+        "totals": summarize(totals),
+        "buckets": [summarize(entry) for entry in buckets.values()]
+    }
+
+def summarize(entry):
+    """Replace intensity sums with means and add derived metrics"""
+    summary = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in entry.items() if not key.startswith(("intensity_", "baseline_intensity_"))
+    }
+    # Averaged over the jobs that have an intensity, not every job in the bucket
+    for name, sum_key, count_key in (
+        ("mean_intensity", "intensity_sum", "intensity_count"),
+        ("mean_baseline_intensity", "baseline_intensity_sum", "baseline_intensity_count")
+    ):
+        count = entry[count_key]
+        summary[name] = round(entry[sum_key] / count, 2) if count else None
+    # Same factor as groq_inference.build_sustainability_impact
+    summary["trees_equivalent"] = round(entry["carbon_saved"] * 0.0165, 2)
+    for name in ("carbon_saved", "money_saved"):
+        summary[name] = round(summary[name], 4)
+    return summary
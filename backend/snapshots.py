@@ -0,0 +1,81 @@
+import hashlib
+import numpy as np
+from datetime import timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from cache import TTLCache
+from metrics import register_cache
+from models import ForecastSnapshot
+from optimizer import forecast_to_series, parse_point_time, to_naive_utc
+
+# content_hash -> snapshot id, so repeat jobs on one forecast skip the lookup query
+_snapshot_ids = TTLCache(maxsize=256, ttl_seconds=24 * 60 * 60)
+register_cache("snapshot_ids", _snapshot_ids)
+
+def encode_forecast(forecast):
+    """Pack a forecast list into (start_time, step_seconds, float32 bytes)"""
+    start, step, values = forecast_to_series(forecast)
+    if start is None:
+        return None
+    return to_naive_utc(start), int(step.total_seconds()), values.astype("<f4").tobytes()
+
+def decode_values(snapshot):
+    """Zero-copy float32 view over a snapshot's packed values"""
+    return np.frombuffer(snapshot.values, dtype="<f4")
+
+def snapshot_to_forecast(snapshot):
+    """Expand a snapshot back into the {"point_time", "value"} list format"""
+    start = snapshot.start_time.replace(tzinfo=timezone.utc)
+    step = timedelta(seconds=snapshot.step_seconds)
+    return [
+        {"point_time": (start + step * index).isoformat(), "value": float(value)}
+        for index, value in enumerate(decode_values(snapshot))
+    ]
+
+def carbon_data_summary(carbon_data):
+    """carbon_data without the forecast series, which lives in forecast_snapshots"""
+    return {key: value for key, value in carbon_data.items() if key != "forecast"}
+
+def get_or_create_snapshot(db, carbon_data, signal_type="co2_moer"):
+    """
+    Return the id of the snapshot holding carbon_data's forecast, inserting it
+    the first time this exact forecast is seen. Returns None without a forecast.
+    """
+    encoded = encode_forecast(carbon_data.get("forecast"))
+    if not encoded:
+        return None
+    start_time, step_seconds, packed = encoded
+    region = carbon_data.get("location")
+    digest = hashlib.sha256(
+        f"{region}|{signal_type}|{start_time.isoformat()}|{step_seconds}|".encode() + packed
+    ).hexdigest()
+
+    snapshot_id = _snapshot_ids.get(digest)
+    if snapshot_id:
+        return snapshot_id
+
+    snapshot_id = db.query(ForecastSnapshot.id).filter(ForecastSnapshot.content_hash == digest).scalar()
+    if snapshot_id:
+        # Only memoize committed rows; a fresh insert may still be rolled back
+        _snapshot_ids.set(digest, snapshot_id)
+        return snapshot_id
+
+    generated_at = carbon_data.get("generated_at")
+    snapshot = ForecastSnapshot(
+        region=region,
+        signal_type=signal_type,
+        unit=carbon_data.get("unit"),
+        generated_at=to_naive_utc(parse_point_time(generated_at)) if generated_at else None,
+        start_time=start_time,
+        step_seconds=step_seconds,
+        point_count=len(packed) // 4,
+        values=packed,
+        content_hash=digest
+    )
+    try:
+        # Savepoint so a concurrent insert of the same forecast does not
+        # roll back the caller's transaction
+        with db.begin_nested():
+            db.add(snapshot)
+        return snapshot.id
+    except IntegrityError:
+        return db.query(ForecastSnapshot.id).filter(ForecastSnapshot.content_hash == digest).scalar()
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+# The backend modules read their configuration from the environment at import
+# time, so point them at a scratch database and turn background work off first
+_scratch = tempfile.mkdtemp(prefix="carbon-scheduler-tests-")
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(_scratch, "jobs.db"))
+os.environ.setdefault("HISTORY_DIR", os.path.join(_scratch, "history"))
+for flag in ("DISPATCHER_ENABLED", "HISTORY_ENABLED", "REPLAN_ENABLED"):
+    os.environ.setdefault(flag, "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture
+def client():
+    from main import app
+    with TestClient(app) as client:
+        yield client
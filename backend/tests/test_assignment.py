@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func
+from assignment import write_moves
+from groq_inference import calculate_carbon_savings
+from models import AnalyticsRollup, Job, JobStatus, SessionLocal, init_db
+from rollups import record_jobs_created
+
+@pytest.fixture
+def db():
+    init_db()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+def rollup_totals(db):
+    return db.query(func.sum(AnalyticsRollup.carbon_saved), func.sum(AnalyticsRollup.intensity_sum)).filter(
+        AnalyticsRollup.bucket_kind == "day", AnalyticsRollup.resource_usage == "moved"
+    ).one()
+
+def test_moved_job_rederives_savings_and_rollups(db):
+    now = datetime.utcnow().replace(microsecond=0)
+    analysis = {"baseline_intensity": 400.0, "optimized_intensity": 300.0, "carbon_difference": 100.0, "money_saved": 5.0}
+    job = Job(
+        task_name="move", status=JobStatus.PENDING, duration_hours=2, resource_usage="moved",
+        scheduled_time=now + timedelta(hours=3), carbon_intensity=400.0, expected_intensity=300.0,
+        carbon_saved=1.0, parameters={"recommendation": {}}, results={"analysis": analysis, "note": "kept"},
+        created_at=now
+    )
+    db.add(job)
+    db.flush()
+    record_jobs_created(db, [job])
+    db.commit()
+
+    moves = [{"job_id": job.id, "new_time": now + timedelta(hours=5), "new_intensity": 200.0, "new_parameters": {"recommendation": {}}}]
+    assert len(write_moves(db, moves, now)) == 1
+    db.commit()
+    db.expire_all()
+
+    moved = db.get(Job, job.id)
+    assert moved.results["note"] == "kept"
+    assert moved.results["analysis"]["optimized_intensity"] == 200.0
+    assert moved.results["analysis"]["carbon_difference"] == 200.0
+    assert moved.carbon_saved == pytest.approx(calculate_carbon_savings(400.0, 200.0, 2, "moved"))
+    assert moved.parameters["recommendation"]["carbon_savings_estimate"] == moved.carbon_saved
+    carbon_saved, intensity_sum = rollup_totals(db)
+    assert carbon_saved == pytest.approx(moved.carbon_saved)
+    assert intensity_sum == pytest.approx(200.0)
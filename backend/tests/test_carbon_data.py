@@ -0,0 +1,15 @@
+from carbon_data import get_carbon_intensity, schedule_request
+from metrics import schedule_stage_seconds
+
+def token_observations():
+    series = schedule_stage_seconds._series.get(("token",))
+    return series[1] if series else 0
+
+def test_stage_timings_only_cover_schedule_requests():
+    before = token_observations()
+    get_carbon_intensity()
+    assert token_observations() == before
+
+    with schedule_request():
+        get_carbon_intensity()
+    assert token_observations() == before + 1
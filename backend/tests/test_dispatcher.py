@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+from dispatcher import mark_finished
+from models import Job, JobSegment, JobStatus, SessionLocal, init_db
+
+def test_mark_finished_completes_final_segment():
+    init_db()
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        job = Job(task_name="segmented", status=JobStatus.RUNNING, duration_hours=2, resource_usage="low",
+                  worker_id="worker-a", lease_expires_at=now + timedelta(minutes=5), created_at=now)
+        db.add(job)
+        db.flush()
+        db.add_all([
+            JobSegment(job_id=job.id, seq=0, start_time=now - timedelta(hours=3), end_time=now - timedelta(hours=2),
+                       completed_at=now - timedelta(hours=2)),
+            JobSegment(job_id=job.id, seq=1, start_time=now - timedelta(hours=1), end_time=now)
+        ])
+        db.commit()
+        job_id = job.id
+
+        assert mark_finished(job_id, JobStatus.COMPLETED, {"exit_code": 0}, worker_id="worker-a")
+        db.expire_all()
+        segments = db.query(JobSegment).filter(JobSegment.job_id == job_id).order_by(JobSegment.seq).all()
+    finally:
+        db.close()
+    assert segments[0].completed_at == now - timedelta(hours=2)
+    assert segments[1].completed_at is not None
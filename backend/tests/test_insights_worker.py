@@ -0,0 +1,25 @@
+from insights_worker import store_insights
+from models import Job, JobStatus, SessionLocal, init_db
+
+def test_store_insights_keeps_other_results_keys():
+    init_db()
+    db = SessionLocal()
+    try:
+        job = Job(task_name="insights", status=JobStatus.COMPLETED, duration_hours=1, resource_usage="low",
+                  results={"analysis": {"money_saved": 1.0}, "insights_status": "pending"})
+        db.add(job)
+        db.commit()
+        job_id = job.id
+        # As mark_finished would record it while insights are being generated
+        db.query(Job).filter(Job.id == job_id).update({Job.results: {**job.results, "execution": {"exit_code": 0}}})
+        db.commit()
+
+        store_insights(job_id, {"summary": "ok"})
+        db.expire_all()
+        results = db.get(Job, job_id).results
+    finally:
+        db.close()
+    assert results["execution"] == {"exit_code": 0}
+    assert results["insights"] == {"summary": "ok"}
+    assert results["insights_status"] == "ready"
+    assert results["analysis"] == {"money_saved": 1.0}
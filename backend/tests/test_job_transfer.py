@@ -0,0 +1,15 @@
+import json
+
+def test_minimal_import_line_keeps_job_listing_valid(client):
+    response = client.post("/api/jobs/import", content=json.dumps({"task_name": "min", "duration_hours": 1}).encode())
+    assert response.status_code == 200
+    assert response.json()["imported"] == 0
+    assert response.json()["errors"][0]["error"] == "missing resource_usage"
+
+    line = {"task_name": "min", "duration_hours": 1, "resource_usage": "low"}
+    response = client.post("/api/jobs/import", content=json.dumps(line).encode())
+    assert response.json()["imported"] == 1
+
+    response = client.get("/api/jobs")
+    assert response.status_code == 200
+    assert "min" in [job["task_name"] for job in response.json()]
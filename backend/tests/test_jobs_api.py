@@ -0,0 +1,21 @@
+import json
+from models import Job, SessionLocal
+
+def test_jobs_etag_follows_writes_from_other_processes(client):
+    line = {"task_name": "etag", "duration_hours": 1, "resource_usage": "etag"}
+    client.post("/api/jobs/import", content=json.dumps(line).encode())
+    response = client.get("/api/jobs", params={"resource_usage": "etag"})
+    etag = response.headers["ETag"]
+    assert client.get("/api/jobs", params={"resource_usage": "etag"}, headers={"If-None-Match": etag}).status_code == 304
+
+    # Written without publishing an event, as another worker process would
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.resource_usage == "etag").one()
+        job.task_name = "etag renamed"
+        db.commit()
+    finally:
+        db.close()
+    response = client.get("/api/jobs", params={"resource_usage": "etag"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["task_name"] == "etag renamed"
@@ -0,0 +1,28 @@
+from datetime import datetime
+from models import Job, JobStatus, SessionLocal, init_db
+from rollups import query_rollups, record_jobs_created
+
+def test_mean_intensity_skips_jobs_without_analysis():
+    init_db()
+    created_at = datetime(2020, 1, 6, 12)
+    analysis = {"baseline_intensity": 400.0, "optimized_intensity": 300.0, "money_saved": 5.0}
+    db = SessionLocal()
+    try:
+        jobs = [
+            Job(task_name="analysed", status=JobStatus.PENDING, duration_hours=1, resource_usage="mean",
+                results={"analysis": analysis}, created_at=created_at),
+            Job(task_name="imported", status=JobStatus.PENDING, duration_hours=1, resource_usage="mean",
+                results={}, created_at=created_at)
+        ]
+        db.add_all(jobs)
+        db.flush()
+        record_jobs_created(db, jobs)
+        db.commit()
+        summary = query_rollups(db, bucket="day", start=created_at, end=datetime(2020, 1, 7), resource_usage="mean")
+    finally:
+        db.close()
+    totals = summary["totals"]
+    assert totals["job_count"] == 2
+    assert totals["mean_intensity"] == 300.0
+    assert totals["mean_baseline_intensity"] == 400.0
+    assert "intensity_count" not in totals
@@ -28,6 +28,26 @@ function App() {
   const { isDarkMode, toggleTheme } = useTheme();
   const isMobile = useMediaQuery((theme) => theme.breakpoints.down('sm'));
 
+  // Insights are generated in the background after the job is stored
+  const pollInsights = async (baseUrl, jobId, attempts = 15) => {
+    for (let i = 0; i < attempts; i++) {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      try {
+        const response = await fetch(`${baseUrl}/api/jobs/${jobId}`);
+        if (!response.ok) continue;
+        const job = await response.json();
+        if (job.results && job.results.insights_status === 'ready') {
+          setScheduleData((prev) => prev && prev.job_id === jobId
+            ? { ...prev, insights: job.results.insights, insights_status: 'ready' }
+            : prev);
+          return;
+        }
+      } catch (err) {
+        console.error('Error fetching insights:', err);
+      }
+    }
+  };
+
   const handleSchedule = async (taskData) => {
     setLoading(true);
     setError(null);
@@ -45,6 +65,9 @@ function App() {
       
       const data = await response.json();
       setScheduleData(data);
+      if (data.insights_status === 'pending') {
+        pollInsights(baseUrl, data.job_id);
+      }
     } catch (error) {
       console.error("Error scheduling task:", error);
       setError("Failed to schedule task. Please try again later.");
@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import {
   Box,
   Card,
@@ -26,25 +26,39 @@ import CO2Icon from '@mui/icons-material/Co2';
 import SavingsIcon from '@mui/icons-material/Savings';
 import ForestIcon from '@mui/icons-material/Forest';
 
-const AnalyticsDashboard = ({ jobs }) => {
+const AnalyticsDashboard = ({ bucket = 'day' }) => {
   const theme = useTheme();
+  const [analytics, setAnalytics] = useState({ totals: {}, buckets: [] });
+
+  // Totals come pre-aggregated from the server's rollups, so this stays
+  // cheap however many jobs have been scheduled
+  useEffect(() => {
+    const baseUrl = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+    fetch(`${baseUrl}/api/analytics?bucket=${bucket}`)
+      .then(response => (response.ok ? response.json() : Promise.reject(response.status)))
+      .then(setAnalytics)
+      .catch(error => console.error('Error fetching analytics:', error));
+  }, [bucket]);
 
   // Calculate cumulative metrics
-  const totalCarbonSaved = jobs.reduce((acc, job) => acc + (job.carbon_saved || 0), 0);
-  const totalCostSaved = jobs.reduce((acc, job) => acc + (job.sustainability_impact?.energy_cost_savings || 0), 0);
-  const totalTreesEquivalent = jobs.reduce((acc, job) => acc + (job.sustainability_impact?.equivalent_trees_planted || 0), 0);
+  const { totals } = analytics;
+  const totalCarbonSaved = totals.carbon_saved || 0;
+  const totalCostSaved = totals.money_saved || 0;
+  const totalTreesEquivalent = totals.trees_equivalent || 0;
 
   // Prepare time series data
-  const timeSeriesData = jobs.map(job => ({
-    date: new Date(job.created_at).toLocaleDateString(),
-    carbonSaved: job.carbon_saved || 0,
-    costSaved: job.sustainability_impact?.energy_cost_savings || 0,
-    treesEquivalent: job.sustainability_impact?.equivalent_trees_planted || 0,
+  const timeSeriesData = analytics.buckets.map(entry => ({
+    date: new Date(entry.bucket_start).toLocaleDateString(),
+    carbonSaved: entry.carbon_saved || 0,
+    costSaved: entry.money_saved || 0,
+    treesEquivalent: entry.trees_equivalent || 0,
   }));
 
   // Calculate success metrics
-  const completedJobs = jobs.filter(job => job.status === 'completed').length;
-  const totalJobs = jobs.length;
+  const completedJobs = analytics.buckets.reduce(
+    (acc, entry) => acc + (entry.by_status?.completed || 0), 0
+  );
+  const totalJobs = totals.job_count || 0;
   const successRate = totalJobs > 0 ? (completedJobs / totalJobs) * 100 : 0;
 
   const pieData = [
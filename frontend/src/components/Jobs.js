@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   Box,
   Paper,
@@ -55,11 +55,16 @@ function Jobs() {
     return `${baseUrl}/api`;
   };
 
+  const etagRef = useRef(null);
+
   const fetchJobs = async () => {
     try {
       const apiUrl = getApiUrl();
-      const response = await fetch(`${apiUrl}/jobs`);
+      const headers = etagRef.current ? { 'If-None-Match': etagRef.current } : {};
+      const response = await fetch(`${apiUrl}/jobs`, { headers, cache: 'no-store' });
+      if (response.status === 304) return;
       if (!response.ok) throw new Error('Failed to fetch jobs');
+      etagRef.current = response.headers.get('ETag');
       const data = await response.json();
       setJobs(data);
       setError(null);
@@ -73,9 +78,24 @@ function Jobs() {
 
   useEffect(() => {
     fetchJobs();
-    // Poll for updates every 10 seconds
-    const interval = setInterval(fetchJobs, 10000);
-    return () => clearInterval(interval);
+    // Live updates are pushed over server-sent events
+    const source = new EventSource(`${getApiUrl()}/events`);
+    source.addEventListener('job.created', (event) => {
+      const job = JSON.parse(event.data);
+      setJobs((prev) => [job, ...prev.filter((j) => j.id !== job.id)]);
+    });
+    source.addEventListener('job.status', (event) => {
+      const update = JSON.parse(event.data);
+      setJobs((prev) => prev.map((j) => (j.id === update.id ? { ...j, ...update } : j)));
+    });
+    source.addEventListener('jobs.cleared', () => setJobs([]));
+    source.addEventListener('resync', fetchJobs);
+    // Slow safety-net poll; unchanged lists come back as a cheap 304
+    const interval = setInterval(fetchJobs, 60000);
+    return () => {
+      source.close();
+      clearInterval(interval);
+    };
   }, []);
 
   const handleCancelJob = async (jobId) => {
@@ -344,7 +344,7 @@ function Timeline({ data }) {
                         bgcolor: 'rgba(33, 150, 243, 0.08)'
                       }}>
                         <ReactMarkdown remarkPlugins={[remarkGfm]}>
-                          {insights}
+                          {insights || '_Generating insights..._'}
                         </ReactMarkdown>
                       </Box>
                     </Collapse>